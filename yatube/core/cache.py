@@ -0,0 +1,506 @@
+"""Бэкенды кэша: общий SQLite-кэш на диске и двухуровневый кэш с LRU
+процесса перед ним.
+
+SQLiteCache хранит записи в одном файле базы SQLite, который видят все
+процессы на машине. TwoTierCache держит перед ним небольшой LRU в памяти
+процесса, ограниченный по байтам. Записи LRU сверяются со счётчиками
+поколений в общем файле, отображённом в память: любая запись в общий
+кэш увеличивает счётчик своего ключа, и копии этого ключа в других
+процессах перестают находиться без лишних запросов к базе.
+
+Metrics-варианты бэкендов сообщают о попаданиях и промахах в метрики
+запроса.
+"""
+import mmap
+import os
+import pickle
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from . import metrics
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_MISSING = object()
+_GENERATION = struct.Struct('<Q')
+CULL_EVERY = 64
+
+SCHEMA_SQL = (
+    """
+    CREATE TABLE IF NOT EXISTS cache (
+        key TEXT PRIMARY KEY,
+        value BLOB NOT NULL,
+        expires REAL
+    )
+    """,
+    'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)',
+)
+
+
+class MetricsCacheMixin:
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _MISSING, version)
+        if value is _MISSING:
+            metrics.record_cache(0, 1)
+            return default
+        metrics.record_cache(1, 0)
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        # Базовый get_many сводится к get, поэтому считаем только здесь.
+        with metrics.paused():
+            found = super().get_many(keys, version)
+        metrics.record_cache(len(found), len(keys) - len(found))
+        return found
+
+
+class MetricsLocMemCache(MetricsCacheMixin, LocMemCache):
+    pass
+
+
+class TierStats:
+    """Попадания и промахи одного уровня кэша в этом процессе."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hits, misses):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+
+class SQLiteCache(BaseCache):
+    """Кэш в файле SQLite, общий для всех процессов машины.
+
+    LOCATION — путь к файлу базы. Журнал WAL позволяет читать, пока
+    другой процесс пишет. Просроченные записи и лишние сверх MAX_ENTRIES
+    удаляются раз в CULL_EVERY записей процесса.
+    """
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        self._local = threading.local()
+        self._writes = 0
+        self.stats = TierStats()
+
+    @property
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            for sql in SCHEMA_SQL:
+                db.execute(sql)
+            self._local.db = db
+        return db
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _read(self, keys):
+        """Возвращает {ключ: (pickle, срок)} для живых записей."""
+        found = {}
+        now = time.time()
+        # SQLite ограничивает число параметров запроса.
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self._db.execute(
+                'SELECT key, value, expires FROM cache WHERE key IN ({}) '
+                'AND (expires IS NULL OR expires > ?)'.format(
+                    ', '.join('?' * len(chunk))
+                ),
+                (*chunk, now),
+            )
+            found.update(
+                (key, (value, expires)) for key, value, expires in rows
+            )
+        self.stats.record(len(found), len(keys) - len(found))
+        return found
+
+    def _write(self, rows, only_new=False):
+        verb = 'INSERT OR IGNORE' if only_new else 'INSERT OR REPLACE'
+        cursor = self._db.executemany(
+            f'{verb} INTO cache (key, value, expires) VALUES (?, ?, ?)', rows
+        )
+        self._writes += 1
+        if self._writes % CULL_EVERY == 0:
+            self._cull()
+        return cursor.rowcount
+
+    def _cull(self):
+        db = self._db
+        db.execute('DELETE FROM cache WHERE expires <= ?', (time.time(),))
+        count, = db.execute('SELECT count(*) FROM cache').fetchone()
+        excess = count - self._max_entries
+        if excess > 0:
+            db.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                'ORDER BY expires IS NULL, expires LIMIT ?)',
+                (max(count // self._cull_frequency, excess),),
+            )
+
+    def _row(self, key, value, timeout):
+        return (
+            key,
+            pickle.dumps(value, self.pickle_protocol),
+            self.get_backend_timeout(timeout),
+        )
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        row = self._read([key]).get(key)
+        return default if row is None else pickle.loads(row[0])
+
+    def get_many(self, keys, version=None):
+        keys = {self._key(key, version): key for key in keys}
+        return {
+            keys[key]: pickle.loads(value)
+            for key, (value, _) in self._read(list(keys)).items()
+        }
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        with self._transaction():
+            self._db.execute(
+                'DELETE FROM cache WHERE key = ? AND expires <= ?',
+                (key, time.time()),
+            )
+            return self._write(
+                [self._row(key, value, timeout)], only_new=True
+            ) > 0
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._write([self._row(self._key(key, version), value, timeout)])
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        self._write([
+            self._row(self._key(key, version), value, timeout)
+            for key, value in data.items()
+        ])
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        cursor = self._db.execute(
+            'UPDATE cache SET expires = ? WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (
+                self.get_backend_timeout(timeout),
+                self._key(key, version),
+                time.time(),
+            ),
+        )
+        return cursor.rowcount > 0
+
+    def delete(self, key, version=None):
+        self._db.execute(
+            'DELETE FROM cache WHERE key = ?', (self._key(key, version),)
+        )
+
+    def delete_many(self, keys, version=None):
+        self._db.executemany(
+            'DELETE FROM cache WHERE key = ?',
+            [(self._key(key, version),) for key in keys],
+        )
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        return key in self._read([key])
+
+    def incr(self, key, delta=1, version=None):
+        """Увеличивает число атомарно для всех процессов."""
+        key = self._key(key, version)
+        with self._transaction():
+            row = self._read([key]).get(key)
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            self._db.execute(
+                'UPDATE cache SET value = ? WHERE key = ?',
+                (pickle.dumps(value, self.pickle_protocol), key),
+            )
+        return value
+
+    def clear(self):
+        self._db.execute('DELETE FROM cache')
+
+    def tier_stats(self):
+        """Попадания и промахи по уровням кэша."""
+        return {
+            'shared': {'hits': self.stats.hits, 'misses': self.stats.misses},
+        }
+
+    def close(self, **kwargs):
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+    def _transaction(self):
+        return _Immediate(self._db)
+
+
+class _Immediate:
+    """Транзакция, которая сразу берёт блокировку записи."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+class Generations:
+    """Счётчики поколений ключей в файле, отображённом в память.
+
+    Ключ попадает в один из slots счётчиков по crc32, нулевой счётчик —
+    общий для очистки всего кэша. Чтение — это чтение восьми байт общей
+    памяти, увеличение идёт под блокировкой файла.
+    """
+
+    def __init__(self, path, slots):
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._file = open(path, 'a+b')
+        size = slots * _GENERATION.size
+        if os.fstat(self._file.fileno()).st_size < size:
+            self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+
+    def slot(self, key):
+        return 1 + zlib.crc32(key.encode()) % (self.slots - 1)
+
+    def _read(self, slot):
+        return _GENERATION.unpack_from(self._map, slot * _GENERATION.size)[0]
+
+    def get(self, key):
+        return self._read(0) + self._read(self.slot(key))
+
+    def bump(self, slots):
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                for slot in set(slots):
+                    _GENERATION.pack_into(
+                        self._map, slot * _GENERATION.size,
+                        self._read(slot) + 1,
+                    )
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def bump_keys(self, keys):
+        self.bump(self.slot(key) for key in keys)
+
+
+class LocalLRU:
+    """LRU процесса, ограниченный суммарным размером значений в байтах.
+
+    Запись хранит pickle значения, срок жизни и поколение ключа, при
+    котором она прочитана; устаревшая по сроку или поколению запись
+    считается промахом и удаляется.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = TierStats()
+
+    def get(self, key, generation):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires, entry_generation = entry
+                if entry_generation == generation and (
+                        expires is None or expires > time.time()):
+                    self._data.move_to_end(key)
+                    self.stats.record(1, 0)
+                    return value
+                self._pop(key)
+        self.stats.record(0, 1)
+        return None
+
+    def set(self, key, value, expires, generation):
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(key)
+            self._data[key] = value, expires, generation
+            self.size += size
+            while self.size > self.max_bytes:
+                self._pop(next(iter(self._data)))
+
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.size -= len(key) + len(entry[0])
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+# LRU и счётчики поколений общие для всех потоков процесса, как у
+# LocMemCache: Django создаёт свой объект бэкенда в каждом потоке.
+_locals = {}
+_generations = {}
+_shared_stats = {}
+_registry_lock = threading.Lock()
+
+
+class TwoTierCache(SQLiteCache):
+    """SQLiteCache с LRU процесса перед ним.
+
+    OPTIONS: LOCAL_MAX_BYTES — размер LRU, GENERATION_SLOTS — число
+    счётчиков поколений. Файл счётчиков лежит рядом с базой. Чтения
+    сначала идут в LRU, промахи — в общий кэш, найденное кладётся в LRU
+    с поколением, прочитанным до похода в базу. Записи идут в общий кэш
+    и увеличивают поколения своих ключей.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(location, params)
+        options = params.get('OPTIONS', {})
+        with _registry_lock:
+            if location not in _locals:
+                _locals[location] = LocalLRU(
+                    int(options.get('LOCAL_MAX_BYTES', 8 * 1024 * 1024))
+                )
+                directory = os.path.dirname(location)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                _generations[location] = Generations(
+                    location + '.generations',
+                    int(options.get('GENERATION_SLOTS', 4096)),
+                )
+                _shared_stats[location] = self.stats
+        self._lru = _locals[location]
+        self._generations = _generations[location]
+        self.stats = _shared_stats[location]
+
+    def _lookup(self, keys):
+        """Возвращает {ключ: pickle} сначала из LRU, затем из базы."""
+        found = {}
+        missing = {}
+        for key in keys:
+            # Поколение читается до базы: если ключ перепишут между
+            # чтениями, запись в LRU сразу окажется устаревшей.
+            generation = self._generations.get(key)
+            value = self._lru.get(key, generation)
+            if value is None:
+                missing[key] = generation
+            else:
+                found[key] = value
+        if missing:
+            for key, (value, expires) in self._read(list(missing)).items():
+                self._lru.set(key, value, expires, missing[key])
+                found[key] = value
+        return found
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        value = self._lookup([key]).get(key)
+        return default if value is None else pickle.loads(value)
+
+    def get_many(self, keys, version=None):
+        keys = {self._key(key, version): key for key in keys}
+        return {
+            keys[key]: pickle.loads(value)
+            for key, value in self._lookup(list(keys)).items()
+        }
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        return key in self._lookup([key])
+
+    def _invalidate(self, keys, version=None):
+        self._generations.bump_keys(
+            self._key(key, version) for key in keys
+        )
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = super().add(key, value, timeout, version)
+        if added:
+            self._invalidate([key], version)
+        return added
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        super().set(key, value, timeout, version)
+        self._invalidate([key], version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = super().set_many(data, timeout, version)
+        self._invalidate(data, version)
+        return failed
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        touched = super().touch(key, timeout, version)
+        self._invalidate([key], version)
+        return touched
+
+    def delete(self, key, version=None):
+        super().delete(key, version)
+        self._invalidate([key], version)
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        super().delete_many(keys, version)
+        self._invalidate(keys, version)
+
+    def incr(self, key, delta=1, version=None):
+        value = super().incr(key, delta, version)
+        self._invalidate([key], version)
+        return value
+
+    def clear(self):
+        super().clear()
+        self._generations.bump([0])
+        self._lru.clear()
+
+    def tier_stats(self):
+        stats = self._lru.stats
+        return {
+            'local': {
+                'hits': stats.hits,
+                'misses': stats.misses,
+                'entries': len(self._lru),
+                'bytes': self._lru.size,
+            },
+            **super().tier_stats(),
+        }
+
+
+class MetricsTwoTierCache(MetricsCacheMixin, TwoTierCache):
+    pass
@@ -0,0 +1,235 @@
+"""Метрики запросов в памяти процесса и их вывод для Prometheus.
+
+MetricsMiddleware замеряет каждый запрос: время, число и время
+SQL-запросов, попадания и промахи кэша, размер ответа. Данные
+складываются в Registry по имени view (posts:index, posts:profile, …)
+под одной короткой блокировкой, а /metrics отдаёт их в текстовом
+формате Prometheus. Каждый процесс считает свои метрики: при
+нескольких воркерах Prometheus опрашивает каждый из них.
+"""
+import threading
+from bisect import bisect_left
+from contextlib import ExitStack, contextmanager
+from time import perf_counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+BUCKET_LABELS = (*map(repr, DURATION_BUCKETS), '+Inf')
+UNRESOLVED = '<unresolved>'
+
+COUNTERS = (
+    ('yatube_db_queries_total', 'queries', 'Число SQL-запросов.'),
+    (
+        'yatube_db_query_duration_seconds_total', 'query_time',
+        'Суммарное время SQL-запросов.',
+    ),
+    ('yatube_cache_hits_total', 'cache_hits', 'Попадания в кэш.'),
+    ('yatube_cache_misses_total', 'cache_misses', 'Промахи кэша.'),
+    (
+        'yatube_response_bytes_total', 'response_bytes',
+        'Суммарный размер ответов.',
+    ),
+)
+CACHE_TIER_METRICS = (
+    (
+        'yatube_cache_tier_hits_total', 'hits', 'counter',
+        'Попадания по уровням кэша.',
+    ),
+    (
+        'yatube_cache_tier_misses_total', 'misses', 'counter',
+        'Промахи по уровням кэша.',
+    ),
+    (
+        'yatube_cache_tier_entries', 'entries', 'gauge',
+        'Число записей в уровне кэша.',
+    ),
+    (
+        'yatube_cache_tier_bytes', 'bytes', 'gauge',
+        'Размер уровня кэша в байтах.',
+    ),
+)
+
+_local = threading.local()
+
+
+class RequestStats:
+    """Счётчики одного запроса, которые собирают обёртки БД и кэша."""
+
+    __slots__ = ('queries', 'query_time', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def execute(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.query_time += perf_counter() - start
+            self.queries += 1
+
+
+def current():
+    """Счётчики запроса, который обрабатывает этот поток, или None."""
+    return getattr(_local, 'stats', None)
+
+
+@contextmanager
+def paused():
+    """Временно не записывает события в счётчики текущего запроса."""
+    stats = current()
+    _local.stats = None
+    try:
+        yield
+    finally:
+        _local.stats = stats
+
+
+def record_cache(hits, misses):
+    stats = current()
+    if stats is not None:
+        stats.cache_hits += hits
+        stats.cache_misses += misses
+
+
+class ViewMetrics:
+    __slots__ = (
+        'buckets', 'duration', 'requests', 'queries', 'query_time',
+        'cache_hits', 'cache_misses', 'response_bytes',
+    )
+
+    def __init__(self):
+        self.buckets = [0] * (len(DURATION_BUCKETS) + 1)
+        self.duration = 0.0
+        self.requests = {}
+        self.queries = 0
+        self.query_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.response_bytes = 0
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def observe(self, view, status, duration, stats, size):
+        with self._lock:
+            metrics = self._views.get(view)
+            if metrics is None:
+                metrics = self._views[view] = ViewMetrics()
+            metrics.buckets[bisect_left(DURATION_BUCKETS, duration)] += 1
+            metrics.duration += duration
+            metrics.requests[status] = metrics.requests.get(status, 0) + 1
+            metrics.queries += stats.queries
+            metrics.query_time += stats.query_time
+            metrics.cache_hits += stats.cache_hits
+            metrics.cache_misses += stats.cache_misses
+            metrics.response_bytes += size
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+    def render(self):
+        """Возвращает метрики в текстовом формате Prometheus."""
+        with self._lock:
+            views = sorted(self._views.items())
+            lines = [
+                *_histogram_lines(views),
+                *_requests_lines(views),
+                *_counter_lines(views),
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+def _histogram_lines(views):
+    name = 'yatube_request_duration_seconds'
+    yield f'# HELP {name} Время обработки запроса.'
+    yield f'# TYPE {name} histogram'
+    for view, metrics in views:
+        total = 0
+        for bound, count in zip(BUCKET_LABELS, metrics.buckets):
+            total += count
+            yield f'{name}_bucket{{view="{view}",le="{bound}"}} {total}'
+        yield f'{name}_sum{{view="{view}"}} {metrics.duration!r}'
+        yield f'{name}_count{{view="{view}"}} {total}'
+
+
+def _requests_lines(views):
+    name = 'yatube_requests_total'
+    yield f'# HELP {name} Число ответов по кодам.'
+    yield f'# TYPE {name} counter'
+    for view, metrics in views:
+        for status, count in sorted(metrics.requests.items()):
+            yield f'{name}{{view="{view}",status="{status}"}} {count}'
+
+
+def _counter_lines(views):
+    for name, attr, help_text in COUNTERS:
+        yield f'# HELP {name} {help_text}'
+        yield f'# TYPE {name} counter'
+        for view, metrics in views:
+            yield f'{name}{{view="{view}"}} {getattr(metrics, attr)!r}'
+
+
+registry = Registry()
+
+
+def render_cache_tiers():
+    """Возвращает статистику уровней кэшей, у которых она есть."""
+    tiers = [
+        (alias, tier, values)
+        for alias in settings.CACHES
+        for tier, values in getattr(
+            caches[alias], 'tier_stats', dict
+        )().items()
+    ]
+    lines = []
+    for name, key, kind, help_text in CACHE_TIER_METRICS:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        lines += [
+            f'{name}{{cache="{alias}",tier="{tier}"}} {values[key]}'
+            for alias, tier, values in tiers
+            if key in values
+        ]
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    """Замеряет запросы и складывает результаты в registry."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = _local.stats = RequestStats()
+        start = perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(stats.execute)
+                    )
+                response = self.get_response(request)
+        finally:
+            _local.stats = None
+        duration = perf_counter() - start
+        match = request.resolver_match
+        registry.observe(
+            match.view_name if match else UNRESOLVED,
+            response.status_code,
+            duration,
+            stats,
+            0 if response.streaming else len(response.content),
+        )
+        return response
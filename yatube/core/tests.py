@@ -1,6 +1,16 @@
+import os
+import shutil
+import tempfile
+import time
 from http import HTTPStatus
 
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from . import metrics, throttling
+from .cache import LocalLRU, TwoTierCache
 
 
 class ViewTestClass(TestCase):
@@ -8,3 +18,218 @@ class ViewTestClass(TestCase):
         response = self.client.get('/nonexist-page/')
         self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
         self.assertTemplateUsed(response, 'core/404.html')
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.registry.clear()
+
+    def get_metrics(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return response.content.decode()
+
+    def test_requests_are_measured_per_view(self):
+        """Запросы попадают в гистограмму и счётчики своего view."""
+        self.client.get('/')
+        self.client.get('/')
+        self.client.get('/nonexist-page/')
+        text = self.get_metrics()
+        self.assertIn(
+            'yatube_request_duration_seconds_count{view="posts:index"} 2',
+            text,
+        )
+        self.assertIn(
+            'yatube_request_duration_seconds_bucket'
+            '{view="posts:index",le="+Inf"} 2',
+            text,
+        )
+        self.assertIn(
+            'yatube_requests_total{view="<unresolved>",status="404"} 1', text
+        )
+        self.assertRegex(
+            text, r'yatube_db_queries_total\{view="posts:index"\} [1-9]'
+        )
+        self.assertRegex(
+            text, r'yatube_cache_hits_total\{view="posts:index"\} [1-9]'
+        )
+        self.assertRegex(
+            text, r'yatube_response_bytes_total\{view="posts:index"\} [1-9]'
+        )
+
+    def test_cache_get_many_counted_once(self):
+        """Промахи get_many не считаются повторно через get."""
+        stats = metrics._local.stats = metrics.RequestStats()
+        try:
+            cache.set('key', 1)
+            cache.get_many(['key', 'missing'])
+            cache.get('missing')
+        finally:
+            metrics._local.stats = None
+        self.assertEqual((stats.cache_hits, stats.cache_misses), (1, 2))
+
+    def test_cache_tiers_are_exposed(self):
+        """/metrics показывает попадания каждого уровня кэша."""
+        self.client.get('/')
+        self.client.get('/')
+        text = self.get_metrics()
+        self.assertRegex(
+            text,
+            r'yatube_cache_tier_hits_total\{cache="default",tier="local"\} '
+            r'[1-9]',
+        )
+        self.assertIn(
+            'yatube_cache_tier_misses_total{cache="default",tier="shared"}',
+            text,
+        )
+
+    def test_metrics_hidden_from_other_hosts(self):
+        """/metrics закрыт для внешних адресов."""
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, HTTPStatus.FORBIDDEN)
+
+
+class ThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        throttling.clear()
+        self.user = get_user_model().objects.create(username='writer')
+        self.client.force_login(self.user)
+
+    @override_settings(THROTTLE_RATES={'post_create': {'user': (2, 60)}})
+    def test_writes_over_rate_get_429(self):
+        """Запись сверх пакета получает 429 с Retry-After и считается."""
+        url = reverse('posts:post_create')
+        for _ in range(2):
+            response = self.client.post(url, {'text': 'Пост'})
+            self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        response = self.client.post(url, {'text': 'Пост'})
+        self.assertEqual(response.status_code, HTTPStatus.TOO_MANY_REQUESTS)
+        self.assertTemplateUsed(response, 'core/429.html')
+        self.assertIn(int(response['Retry-After']), range(1, 61))
+        self.assertEqual(self.user.posts.count(), 2)
+        self.assertEqual(self.client.get(url).status_code, HTTPStatus.OK)
+        self.assertIn(
+            'yatube_throttled_requests_total'
+            '{scope="post_create",bucket="user"} 1',
+            self.client.get('/metrics').content.decode(),
+        )
+
+    @override_settings(THROTTLE_RATES={'signup': {'ip': (1, 600)}})
+    def test_anonymous_throttled_by_ip(self):
+        self.client.logout()
+        url = reverse('users:signup')
+        self.client.post(url, {})
+        response = self.client.post(url, {})
+        self.assertEqual(response.status_code, HTTPStatus.TOO_MANY_REQUESTS)
+        other = self.client.post(url, {}, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(other.status_code, HTTPStatus.OK)
+
+    @override_settings(THROTTLE_RATES={
+        'profile_follow': {'user': (1, 600), 'ip': (1, 600)},
+    })
+    def test_follow_links_are_throttled(self):
+        author = get_user_model().objects.create(username='author')
+        url = reverse('posts:profile_follow', kwargs={'username': author})
+        self.assertEqual(self.client.get(url).status_code, HTTPStatus.FOUND)
+        self.assertEqual(
+            self.client.get(url).status_code,
+            HTTPStatus.TOO_MANY_REQUESTS,
+        )
+
+    def test_tokens_refill_and_are_taken_from_all_buckets(self):
+        """Пакеты восполняются со временем, а пустой не тратит другие."""
+        buckets = {
+            throttling.USER: ('throttle:test:user', 2, 0.05),
+            throttling.IP: ('throttle:test:ip', 1, 0.05),
+        }
+        self.assertEqual(throttling.take(buckets), (0, []))
+        retry_after, empty = throttling.take(buckets)
+        self.assertEqual(empty, [throttling.IP])
+        self.assertLessEqual(retry_after, 0.05)
+        tokens, _ = cache.get('throttle:test:user')
+        self.assertEqual(tokens, 1)
+        time.sleep(0.06)
+        self.assertEqual(throttling.take(buckets), (0, []))
+
+
+class TwoTierCacheTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.location = os.path.join(directory, 'shared.sqlite3')
+        self.cache = self.make_cache()
+        # Второй объект со своим LRU ведёт себя как другой процесс.
+        self.other = self.make_cache()
+        self.other._lru = LocalLRU(1024 * 1024)
+
+    def make_cache(self):
+        return TwoTierCache(self.location, {'OPTIONS': {
+            'LOCAL_MAX_BYTES': 1024 * 1024, 'GENERATION_SLOTS': 64,
+        }})
+
+    def test_second_read_served_from_local_tier(self):
+        """Повторное чтение не ходит в общий кэш."""
+        self.cache.set('key', {'value': 1})
+        self.assertEqual(self.cache.get('key'), {'value': 1})
+        self.assertEqual(self.cache.get('key'), {'value': 1})
+        stats = self.cache.tier_stats()
+        self.assertEqual(stats['local']['hits'], 1)
+        self.assertEqual(stats['shared']['hits'], 1)
+        self.assertEqual(stats['local']['entries'], 1)
+
+    def test_writes_invalidate_other_processes(self):
+        """Запись и очистка в одном процессе видны в LRU другого."""
+        self.cache.set('key', 'old')
+        self.other.set('untouched', 1)
+        self.assertEqual(self.other.get('key'), 'old')
+        self.assertEqual(self.other.get('untouched'), 1)
+        self.cache.set('key', 'new')
+        self.assertEqual(self.other.get('key'), 'new')
+        self.assertEqual(self.cache.incr('untouched'), 2)
+        self.assertEqual(self.other.get('untouched'), 2)
+        self.cache.delete('key')
+        self.assertIsNone(self.other.get('key'))
+        self.other.set('key', 'again')
+        self.cache.clear()
+        self.assertIsNone(self.other.get('key'))
+
+    def test_add_touch_and_many(self):
+        """Остальные операции бэкенда работают через оба уровня."""
+        self.assertTrue(self.cache.add('key', 1))
+        self.assertFalse(self.cache.add('key', 2))
+        self.cache.set_many({'a': 1, 'b': 2})
+        self.assertEqual(
+            self.other.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2}
+        )
+        self.assertTrue(self.cache.has_key('a'))
+        self.assertTrue(self.cache.touch('a', 0))
+        self.assertFalse(self.other.has_key('a'))
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_expired_entries_not_served(self):
+        """Просроченная запись не отдаётся ни из LRU, ни из базы."""
+        self.cache.set('key', 1, timeout=60)
+        self.assertEqual(self.cache.get('key'), 1)
+        lru = self.cache._lru
+        value, _, generation = lru._data[self.cache._key('key', None)]
+        lru._data[self.cache._key('key', None)] = (
+            value, time.time() - 1, generation
+        )
+        self.cache.set('gone', 1, timeout=0)
+        self.assertIsNone(self.cache.get('gone'))
+        self.assertEqual(self.cache.get('key'), 1)
+        self.assertEqual(self.cache.tier_stats()['local']['hits'], 0)
+
+    def test_lru_bounded_by_bytes(self):
+        """LRU вытесняет давно прочитанные записи сверх лимита байт."""
+        lru = LocalLRU(300)
+        for key in 'abcd':
+            lru.set(key, b'x' * 99, None, 0)
+        self.assertLessEqual(lru.size, 300)
+        self.assertIsNone(lru.get('a', 0))
+        self.assertEqual(lru.get('d', 0), b'x' * 99)
+        lru.set('huge', b'x' * 301, None, 0)
+        self.assertIsNone(lru.get('huge', 0))
@@ -0,0 +1,159 @@
+"""Ограничение частоты записи пакетами жетонов в кэше.
+
+У каждого ограниченного view свои пакеты на пользователя и на IP-адрес,
+их размеры задаёт THROTTLE_RATES. Пакет вмещает capacity жетонов и
+получает новый жетон каждые interval секунд, а запрос записи берёт по
+жетону из всех своих пакетов. Если хоть один пуст, view не вызывается:
+клиент получает 429 с Retry-After, через сколько секунд жетон появится.
+
+Пакет хранится в общем кэше как (жетоны, время) и меняется под
+блокировкой cache.add, поэтому параллельные запросы одного клиента не
+берут один жетон дважды. Полный пакет истекает из кэша сам.
+"""
+import math
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.shortcuts import render
+
+USER = 'user'
+IP = 'ip'
+LOCK_TIMEOUT = 5
+LOCK_WAIT = 0.5
+LOCK_POLL = 0.005
+METRIC = 'yatube_throttled_requests_total'
+
+_lock = threading.Lock()
+_throttled = Counter()
+
+
+def get_buckets(request, scope):
+    """Пакеты запроса: {вид: (ключ, ёмкость, интервал)}."""
+    rates = settings.THROTTLE_RATES.get(scope, {})
+    idents = {IP: request.META.get('REMOTE_ADDR', '')}
+    if request.user.is_authenticated:
+        idents[USER] = request.user.pk
+    return {
+        kind: (f'throttle:{scope}:{kind}:{idents[kind]}', *rates[kind])
+        for kind in rates
+        if kind in idents
+    }
+
+
+def _acquire(keys):
+    """Берёт блокировки всех ключей или, не дождавшись, ни одной."""
+    deadline = time.monotonic() + LOCK_WAIT
+    locks = []
+    for key in sorted(keys):
+        lock = f'{key}:lock'
+        while not cache.add(lock, True, LOCK_TIMEOUT):
+            if time.monotonic() > deadline:
+                cache.delete_many(locks)
+                return None
+            time.sleep(LOCK_POLL)
+        locks.append(lock)
+    return locks
+
+
+def _level(state, capacity, interval, now):
+    if state is None:
+        return capacity
+    tokens, updated = state
+    return min(capacity, tokens + (now - updated) / interval)
+
+
+def take(buckets):
+    """Берёт по жетону из каждого пакета.
+
+    Возвращает 0 и пустой список, если жетоны взяты, иначе — через
+    сколько секунд повторить запрос и виды пустых пакетов. Из пакетов
+    ничего не берётся, если пуст хоть один из них.
+    """
+    if not buckets:
+        return 0, []
+    keys = {key: kind for kind, (key, *_) in buckets.items()}
+    locks = _acquire(keys)
+    if locks is None:
+        # Клиент шлёт параллельные запросы быстрее, чем они проходят.
+        return 1, list(buckets)
+    try:
+        now = time.time()
+        stored = cache.get_many(list(keys))
+        levels = {
+            key: (_level(stored.get(key), capacity, interval, now), interval)
+            for key, capacity, interval in buckets.values()
+        }
+        empty = {
+            keys[key]: (1 - level) * interval
+            for key, (level, interval) in levels.items()
+            if level < 1
+        }
+        if empty:
+            return max(empty.values()), sorted(empty)
+        # Через capacity * interval секунд пакет снова полон.
+        timeout = math.ceil(max(
+            capacity * interval for _, capacity, interval in buckets.values()
+        ))
+        cache.set_many(
+            {key: (level - 1, now) for key, (level, _) in levels.items()},
+            timeout,
+        )
+        return 0, []
+    finally:
+        cache.delete_many(locks)
+
+
+def _count(scope, kinds):
+    with _lock:
+        for kind in kinds:
+            _throttled[scope, kind] += 1
+
+
+def throttle(scope, methods=('POST',)):
+    """Ограничивает запросы methods к view пакетами scope.
+
+    View, для scope которого нет записи в THROTTLE_RATES, не ограничивается.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if request.method in methods:
+                retry_after, empty = take(get_buckets(request, scope))
+                if empty:
+                    _count(scope, empty)
+                    retry_after = math.ceil(retry_after)
+                    response = render(
+                        request,
+                        'core/429.html',
+                        {'retry_after': retry_after},
+                        status=429,
+                    )
+                    response['Retry-After'] = str(retry_after)
+                    return response
+            return view_func(request, *args, **kwargs)
+        return _wrapped_view
+    return decorator
+
+
+def clear():
+    with _lock:
+        _throttled.clear()
+
+
+def render_metrics():
+    """Возвращает счётчики отклонённых запросов для Prometheus."""
+    with _lock:
+        counts = sorted(_throttled.items())
+    lines = [
+        f'# HELP {METRIC} Запросы, отклонённые ограничением частоты.',
+        f'# TYPE {METRIC} counter',
+        *(
+            f'{METRIC}{{scope="{scope}",bucket="{kind}"}} {count}'
+            for (scope, kind), count in counts
+        ),
+    ]
+    return '\n'.join(lines) + '\n'
@@ -5,7 +5,12 @@ import sys
 
 
 def main():
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+    # Тесты не трогают кэш и копию страниц запущенного сервера.
+    os.environ.setdefault(
+        'DJANGO_SETTINGS_MODULE',
+        'yatube.test_settings' if sys.argv[1:2] == ['test']
+        else 'yatube.settings',
+    )
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
@@ -1,6 +1,7 @@
 from django.conf import settings
 from django.contrib import admin
 
+from . import search
 from .models import Post, Group
 
 
@@ -17,6 +18,11 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ("pub_date",)
     empty_value_display = settings.EMPTY_VALUE_DISPLAY
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search.filter_posts(queryset, search_term), False
+
 
 class GroupAdmin(admin.ModelAdmin):
     list_display = (
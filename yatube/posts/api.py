@@ -0,0 +1,279 @@
+"""JSON API только для чтения: ленты, посты и комментарии.
+
+Ответы повторяют страницы index, group_posts, profile, follow_index и
+post_detail, но собираются из values() без моделей и шаблонов. Ленты
+листаются тем же курсором, что и HTML-страницы: курсоры следующей и
+предыдущей страницы приходят в полях next и previous, а batch отдаёт
+посты по списку id одним запросом.
+
+Ленты index, group_list и profile кэшируются до изменения постов, а
+комментарии и просмотры их версий не меняют, поэтому comments_count и
+views_count дописываются в кэшированный ответ одним запросом мимо кэша.
+"""
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import require_safe
+
+from . import pageviews, thumbnails
+from .caching import (
+    author_scopes, cache_page_versions, group_scopes, index_scopes
+)
+from .feed import FEED_ORDERING, get_feed
+from .models import Comment, Group, Post, User
+from .utils import CursorPaginator
+from .views import COMMENT_ORDERING
+
+POST_ORDERING = ('-pub_date', '-id')
+AUTHOR_FIELDS = ('author__username', 'author__first_name', 'author__last_name')
+POST_FIELDS = (
+    'id', 'text', 'pub_date', 'image', 'image_width', 'image_height',
+    'group__slug', 'group__title', *AUTHOR_FIELDS,
+)
+COUNTER_FIELDS = ('comments_count', 'views_count')
+LIVE_POST_FIELDS = (*POST_FIELDS, *COUNTER_FIELDS)
+COMMENT_FIELDS = ('id', 'text', 'pub_date', *AUTHOR_FIELDS)
+FEED_POST = 'post__'
+
+
+def json_response(data, status=200):
+    return JsonResponse(
+        data,
+        status=status,
+        json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')},
+    )
+
+
+def error(detail, status):
+    return json_response({'detail': detail}, status)
+
+
+def api_view(view_func):
+    """Отвечает только на GET и HEAD, а 404 отдаёт в JSON."""
+    @require_safe
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        try:
+            return view_func(request, *args, **kwargs)
+        except Http404:
+            return error('Не найдено.', 404)
+    return _wrapped_view
+
+
+def author_payload(row, prefix=''):
+    full_name = '{} {}'.format(
+        row[f'{prefix}author__first_name'], row[f'{prefix}author__last_name']
+    )
+    return {
+        'username': row[f'{prefix}author__username'],
+        'full_name': full_name.strip(),
+    }
+
+
+def image_payload(name, width, height):
+    if not name:
+        return None
+    return {
+        'url': Post._meta.get_field('image').storage.url(name),
+        'width': width,
+        'height': height,
+        'thumbnail': thumbnails.card_url(name),
+    }
+
+
+def post_payload(row, prefix=''):
+    """Пост из строки values(); счётчики — если они есть в строке.
+
+    В кэшированных лентах их дописывает with_live_counters.
+    """
+    slug = row[f'{prefix}group__slug']
+    payload = {
+        'id': row[f'{prefix}id'],
+        'text': row[f'{prefix}text'],
+        'pub_date': row[f'{prefix}pub_date'],
+        'author': author_payload(row, prefix),
+        'group': slug and {
+            'slug': slug, 'title': row[f'{prefix}group__title']
+        },
+        'image': image_payload(
+            row[f'{prefix}image'],
+            row[f'{prefix}image_width'],
+            row[f'{prefix}image_height'],
+        ),
+    }
+    if f'{prefix}comments_count' in row:
+        payload.update(counters_payload(row, prefix))
+    return payload
+
+
+def counters_payload(row, prefix=''):
+    post_id = row[f'{prefix}id']
+    return {
+        'comments_count': row.get(f'{prefix}comments_count', 0),
+        'views_count': (
+            row.get(f'{prefix}views_count', 0) + pageviews.pending(post_id)
+        ),
+    }
+
+
+def feed_payload(row):
+    return post_payload(row, FEED_POST)
+
+
+def comment_payload(row):
+    return {
+        'id': row['id'],
+        'text': row['text'],
+        'pub_date': row['pub_date'],
+        'author': author_payload(row),
+    }
+
+
+def get_page(request, rows, ordering, per_page=None):
+    paginator = CursorPaginator(
+        rows, per_page or settings.POSTS_COUNT, ordering
+    )
+    return paginator.get_page(
+        request.GET.get(CursorPaginator.cursor_query_param)
+    )
+
+
+def page_payload(page, serialize):
+    return {
+        'results': [serialize(row) for row in page],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    }
+
+
+def with_live_counters(view_func):
+    """Дописывает в посты кэшированной ленты свежие счётчики."""
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        response = view_func(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+        data = json.loads(response.content)
+        posts = data['results']
+        rows = {
+            row['id']: row
+            for row in Post.objects.filter(
+                id__in=[post['id'] for post in posts]
+            ).order_by().values('id', *COUNTER_FIELDS)
+        }
+        for post in posts:
+            row = rows.get(post['id'], {'id': post['id']})
+            post.update(counters_payload(row))
+        return json_response(data)
+    return _wrapped_view
+
+
+def posts_response(request, rows, exists=None):
+    """Страница постов; пустая страница проверяет, есть ли владелец."""
+    page = get_page(request, rows.values(*POST_FIELDS), POST_ORDERING)
+    if not page.object_list and exists is not None and not exists():
+        raise Http404
+    return json_response(page_payload(page, post_payload))
+
+
+@api_view
+@with_live_counters
+@cache_page_versions(index_scopes)
+def index(request):
+    return posts_response(request, Post.objects.all())
+
+
+@api_view
+@with_live_counters
+@cache_page_versions(group_scopes)
+def group_posts(request, slug):
+    return posts_response(
+        request,
+        Post.objects.filter(group__slug=slug),
+        Group.objects.filter(slug=slug).exists,
+    )
+
+
+@api_view
+@with_live_counters
+@cache_page_versions(author_scopes)
+def profile(request, username):
+    return posts_response(
+        request,
+        Post.objects.filter(author__username=username),
+        User.objects.filter(username=username).exists,
+    )
+
+
+@api_view
+def follow_index(request):
+    if not request.user.is_authenticated:
+        return error('Нужна авторизация.', 401)
+    rows = get_feed(request.user).values(
+        'pub_date',
+        'post_id',
+        *(FEED_POST + field for field in LIVE_POST_FIELDS),
+    )
+    page = get_page(request, rows, FEED_ORDERING)
+    return json_response(page_payload(page, feed_payload))
+
+
+def get_comments_page(request, post_id):
+    return get_page(
+        request,
+        Comment.objects.filter(post_id=post_id).values(*COMMENT_FIELDS),
+        COMMENT_ORDERING,
+        settings.COMMENTS_COUNT,
+    )
+
+
+@api_view
+def post_detail(request, post_id):
+    row = get_object_or_404(
+        Post.objects.values(*LIVE_POST_FIELDS), id=post_id
+    )
+    return json_response({
+        **post_payload(row),
+        'comments': page_payload(
+            get_comments_page(request, post_id), comment_payload
+        ),
+    })
+
+
+@api_view
+def comments(request, post_id):
+    page = get_comments_page(request, post_id)
+    if not page.object_list and not Post.objects.filter(id=post_id).exists():
+        raise Http404
+    return json_response(page_payload(page, comment_payload))
+
+
+@api_view
+def batch(request):
+    """Посты по списку ?ids=1,2,3 в порядке запроса и ненайденные id."""
+    try:
+        ids = list(dict.fromkeys(
+            int(value) for value in request.GET.get('ids', '').split(',')
+            if value
+        ))
+    except ValueError:
+        return error('ids — это id постов через запятую.', 400)
+    if len(ids) > settings.API_BATCH_SIZE:
+        return error(
+            f'За один запрос можно получить не больше '
+            f'{settings.API_BATCH_SIZE} постов.',
+            400,
+        )
+    rows = {
+        row['id']: row
+        for row in Post.objects.filter(id__in=ids).order_by().values(
+            *LIVE_POST_FIELDS
+        )
+    }
+    return json_response({
+        'results': [post_payload(rows[id_]) for id_ in ids if id_ in rows],
+        'missing': [id_ for id_ in ids if id_ not in rows],
+    })
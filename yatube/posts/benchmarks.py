@@ -0,0 +1,237 @@
+"""Нагрузочные данные и замер задержек страниц.
+
+seed() наполняет базу пользователями, группами, постами, комментариями
+и подписками через bulk_create и затем чинит то, что обычно делают
+сигналы: счётчики, ленты и версии кэша страниц. run() открывает
+тестовым клиентом маршруты чтения posts.urls и считает перцентили
+задержки и число SQL-запросов, а compare() сверяет их с сохранённым
+эталоном. Маршруты записи не замеряются: GET подписки и отписки менял
+бы данные и упирался бы в ограничение частоты.
+"""
+import math
+import random
+import time
+import uuid
+from itertools import islice
+from urllib.parse import urlencode
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import caching, counters, feed, trending
+from .models import Comment, Follow, Group, Post, User, UserStats
+from .urls import app_name, urlpatterns
+
+WORDS = (
+    'кот', 'собака', 'город', 'река', 'книга', 'музыка', 'лето', 'зима',
+    'дорога', 'море', 'лес', 'поезд', 'друг', 'утро', 'вечер', 'работа',
+    'кофе', 'снег', 'солнце', 'история', 'фильм', 'код', 'сад', 'дом',
+)
+PERCENTILES = (50, 95, 99)
+READ_ROUTES = (
+    'index', 'feed', 'trending', 'groups', 'group_list', 'group_feed',
+    'group_trending', 'profile', 'profile_feed', 'search', 'post_detail',
+    'comments', 'follow_index',
+)
+WRITE_ROUTES = (
+    'post_create', 'post_edit', 'add_comment', 'post_view',
+    'profile_follow', 'profile_unfollow',
+)
+# Поиск замеряется с запросом, иначе до полнотекстового индекса он не
+# доходит. Слова seed() берёт из WORDS.
+ROUTE_PARAMS = {'search': {'q': WORDS[0]}}
+OK_STATUSES = (200, 302)
+
+
+class BenchmarkError(Exception):
+    """Маршрут ответил ошибкой, и его задержка ничего не значит."""
+
+
+def _bulk_create(model, objects, batch_size):
+    objects = iter(objects)
+    while True:
+        batch = list(islice(objects, batch_size))
+        if not batch:
+            return
+        # Размер INSERT внутри порции выбирает бэкенд с учётом лимитов
+        # SQLite на число параметров и UNION ALL.
+        model.objects.bulk_create(batch)
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def _authors(rng, user_ids, user_id, count):
+    authors = rng.sample(user_ids, min(count + 1, len(user_ids)))
+    return [author_id for author_id in authors if author_id != user_id][:count]
+
+
+def seed(users, groups, posts, comments, follows, batch_size=1000,
+         seed=None):
+    """Создаёт данные и возвращает префикс имён созданных записей."""
+    rng = random.Random(seed)
+    prefix = f'bench-{uuid.uuid4().hex[:8]}'
+    password = make_password(None)
+    _bulk_create(User, (
+        User(username=f'{prefix}-{i}', password=password)
+        for i in range(users)
+    ), batch_size)
+    user_ids = list(User.objects.filter(
+        username__startswith=prefix
+    ).values_list('id', flat=True))
+    _bulk_create(Group, (
+        Group(
+            title=f'Группа {i}',
+            slug=f'{prefix}-{i}',
+            description=_text(rng, 12),
+        )
+        for i in range(groups)
+    ), batch_size)
+    group_ids = list(Group.objects.filter(
+        slug__startswith=prefix
+    ).values_list('id', flat=True)) + [None]
+    _bulk_create(Post, (
+        Post(
+            text=_text(rng, rng.randint(5, 60)),
+            author_id=rng.choice(user_ids),
+            group_id=rng.choice(group_ids),
+        )
+        for _ in range(posts)
+    ), batch_size)
+    post_ids = list(Post.objects.filter(
+        author_id__in=user_ids
+    ).values_list('id', flat=True))
+    if post_ids:
+        _bulk_create(Comment, (
+            Comment(
+                post_id=rng.choice(post_ids),
+                author_id=rng.choice(user_ids),
+                text=_text(rng, rng.randint(3, 20)),
+            )
+            for _ in range(comments)
+        ), batch_size)
+    _bulk_create(Follow, (
+        Follow(user_id=user_id, author_id=author_id)
+        for user_id in user_ids
+        for author_id in _authors(rng, user_ids, user_id, follows)
+    ), batch_size)
+    counters.rebuild()
+    feed.rebuild(user_ids)
+    trending.rebuild()
+    caching.bump(caching.SITE)
+    return prefix
+
+
+def percentile(values, percent):
+    """Перцентиль по ближайшему рангу."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+def sample_kwargs(user):
+    """Подбирает аргументы маршрутов: самого популярного автора, свежий
+    пост читателя и группу этого поста.
+    """
+    author = User.objects.filter(
+        id__in=UserStats.objects.exclude(user=user).order_by(
+            '-followers_count'
+        ).values('user')[:1]
+    ).first() or user
+    post = (
+        Post.objects.filter(author=user).first() or Post.objects.first()
+    )
+    group = post.group if post and post.group else Group.objects.first()
+    return {
+        'username': author.username,
+        'post_id': post.id if post else 0,
+        'slug': group.slug if group else '-',
+    }
+
+
+def route_urls(user):
+    """Возвращает адреса маршрутов чтения posts.urls с реальными данными."""
+    kwargs = sample_kwargs(user)
+    urls = {}
+    for pattern in urlpatterns:
+        if pattern.name not in READ_ROUTES:
+            continue
+        url = reverse(
+            f'{app_name}:{pattern.name}',
+            kwargs={name: kwargs[name] for name in pattern.pattern.converters},
+        )
+        params = ROUTE_PARAMS.get(pattern.name)
+        urls[pattern.name] = f'{url}?{urlencode(params)}' if params else url
+    return urls
+
+
+def _get(client, url):
+    response = client.get(url)
+    if response.streaming:
+        # Потоковый ответ строится при чтении, и чтение входит в замер.
+        b''.join(response.streaming_content)
+    if response.status_code not in OK_STATUSES:
+        raise BenchmarkError(f'{url}: код ответа {response.status_code}')
+    return response
+
+
+def measure(client, url, iterations, cold=False):
+    _get(client, url)
+    timings = []
+    queries = 0
+    for _ in range(iterations):
+        if cold:
+            cache.clear()
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = _get(client, url)
+            timings.append((time.perf_counter() - start) * 1000)
+        queries = max(queries, len(captured))
+    result = {
+        f'p{percent}': round(percentile(timings, percent), 3)
+        for percent in PERCENTILES
+    }
+    result.update(queries=queries, status=response.status_code)
+    return result
+
+
+def run(user, iterations, cold=False):
+    """Замеряет маршруты чтения от имени user.
+
+    Ответ с кодом не из OK_STATUSES прерывает замер BenchmarkError.
+    """
+    client = Client()
+    client.force_login(user)
+    return {
+        name: measure(client, url, iterations, cold)
+        for name, url in route_urls(user).items()
+    }
+
+
+def compare(results, baseline, tolerance, slack):
+    """Возвращает описания регрессий относительно эталона.
+
+    Задержка считается регрессией, если p95 вырос больше чем на долю
+    tolerance и больше чем на slack миллисекунд, число запросов — при
+    любом росте.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        limit = max(base['p95'] * (1 + tolerance), base['p95'] + slack)
+        if result['p95'] > limit:
+            regressions.append(
+                f'{name}: p95 {result["p95"]} мс, эталон {base["p95"]} мс'
+            )
+        if result['queries'] > base['queries']:
+            regressions.append(
+                f'{name}: {result["queries"]} запросов, '
+                f'эталон {base["queries"]}'
+            )
+    return regressions
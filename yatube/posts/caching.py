@@ -0,0 +1,278 @@
+"""Кэш страниц, сбрасываемый по событиям, а не по таймеру.
+
+Ключ страницы включает версии данных, от которых она зависит: общей
+ленты, группы, автора и всего сайта. Сигналы записи постов, подписок,
+групп и пользователей меняют нужные версии, после чего старые копии
+страниц просто перестают находиться в кэше.
+"""
+import hashlib
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max, OuterRef, Subquery
+from django.http import HttpResponse
+from django.utils.cache import get_cache_key, learn_cache_key
+from django.views.decorators.http import condition
+
+from . import pageviews, thumbnails
+from .models import Comment, Group, Post, User
+
+SITE = 'site'
+INDEX = 'index'
+TRENDING = 'trending'
+GROUPS = 'groups'
+
+
+def group_scope(slug):
+    return f'group:{slug}'
+
+
+def author_scope(username):
+    return f'author:{username}'
+
+
+def post_scope(post_id):
+    return f'post:{post_id}'
+
+
+def version_key(scope):
+    return f'version:{scope}'
+
+
+def get_versions(scopes):
+    keys = [version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = {
+        key: uuid.uuid4().hex[:12] for key in keys if key not in versions
+    }
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return '.'.join(versions[key] for key in keys)
+
+
+def bump(*scopes):
+    """Делает недействительными страницы, зависящие от scopes."""
+    cache.set_many(
+        {version_key(scope): uuid.uuid4().hex[:12] for scope in scopes},
+        None,
+    )
+
+
+def bump_on_commit(*scopes):
+    """Сбрасывает версии scopes после фиксации транзакции.
+
+    Сброс до фиксации позволил бы параллельному запросу нарисовать
+    старые строки под новой версией и держать их в кэше до следующего
+    сброса. Вне транзакции версии сбрасываются сразу.
+    """
+    transaction.on_commit(lambda: bump(*scopes))
+
+
+def index_scopes(request):
+    return SITE, INDEX
+
+
+def group_scopes(request, slug):
+    return SITE, group_scope(slug)
+
+
+def author_scopes(request, username):
+    return SITE, author_scope(username)
+
+
+def groups_scopes(request):
+    return SITE, GROUPS
+
+
+def trending_scopes(request):
+    return SITE, INDEX, TRENDING
+
+
+def group_trending_scopes(request, slug):
+    return SITE, group_scope(slug), TRENDING
+
+
+def cache_page_versions(get_scopes):
+    """Кэширует GET-ответ view, пока не изменится версия его данных.
+
+    get_scopes получает те же аргументы, что и view, и возвращает
+    области, от которых зависит страница.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_func(request, *args, **kwargs)
+            # Страница отличается для каждого пользователя (шапка, кнопки
+            # подписки), а Vary: Cookie от сессии появится только после
+            # view, поэтому пользователь входит в ключ явно.
+            key_prefix = 'page:{}:{}'.format(
+                request.user.pk or 0,
+                get_versions(get_scopes(request, *args, **kwargs)),
+            )
+            cache_key = get_cache_key(request, key_prefix, 'GET', cache)
+            if cache_key is not None:
+                response = cache.get(cache_key)
+                if response is not None:
+                    return response
+            fallbacks = thumbnails.fallbacks_rendered()
+            response = view_func(request, *args, **kwargs)
+            if (response.status_code == 200 and not response.cookies
+                    and thumbnails.fallbacks_rendered() == fallbacks):
+                timeout = settings.PAGE_CACHE_TIMEOUT
+                cache_key = learn_cache_key(
+                    request, response, timeout, key_prefix, cache
+                )
+                if response.streaming:
+                    _cache_when_streamed(response, cache_key, timeout)
+                else:
+                    cache.set(cache_key, response, timeout)
+            return response
+        return _wrapped_view
+    return decorator
+
+
+def _cache_when_streamed(response, cache_key, timeout):
+    """Кладёт потоковый ответ в кэш, когда он отдан целиком.
+
+    Заголовки запоминаются сразу, как и у обычного ответа, который
+    попадает в кэш до того, как condition добавит ETag и Last-Modified.
+    """
+    headers = list(response.items())
+    content = response.streaming_content
+
+    def stream():
+        chunks = []
+        for chunk in content:
+            chunks.append(chunk)
+            yield chunk
+        cached = HttpResponse(b''.join(chunks), status=response.status_code)
+        for header, value in headers:
+            cached[header] = value
+        cache.set(cache_key, cached, timeout)
+
+    response.streaming_content = stream()
+
+
+def conditional_page(get_state):
+    """Отвечает 304 Not Modified, если у клиента свежая копия страницы.
+
+    get_state получает аргументы view и возвращает время последнего
+    изменения данных страницы, области, от которых она зависит, и,
+    по желанию, другие значения со страницы, не меняющие ни времени, ни
+    версий. Last-Modified — это время, а ETag добавляет к нему адрес с
+    номером страницы, пользователя, версии областей и эти значения,
+    поэтому удаления и правки, не меняющие времени, тоже дают новую
+    копию. Оба значения считаются один раз на запрос.
+    """
+    def get_freshness(request, *args, **kwargs):
+        if not hasattr(request, '_freshness'):
+            last_modified, scopes, *extra = get_state(
+                request, *args, **kwargs
+            )
+            etag = None
+            if last_modified is not None:
+                etag = hashlib.md5('{}:{}:{}:{}:{}'.format(
+                    request.get_full_path(),
+                    request.user.pk or 0,
+                    get_versions(scopes),
+                    last_modified.isoformat(),
+                    extra,
+                ).encode()).hexdigest()
+            request._freshness = etag, last_modified
+        return request._freshness
+
+    return condition(
+        etag_func=lambda *args, **kwargs: get_freshness(*args, **kwargs)[0],
+        last_modified_func=(
+            lambda *args, **kwargs: get_freshness(*args, **kwargs)[1]
+        ),
+    )
+
+
+def _last_edited(**filters):
+    return Post.objects.filter(**filters).aggregate(
+        last=Max('edited')
+    )['last']
+
+
+def index_state(request):
+    return _last_edited(), index_scopes(request)
+
+
+def group_state(request, slug):
+    return _last_edited(group_id=Subquery(
+        Group.objects.filter(slug=slug).values('id')[:1]
+    )), group_scopes(request, slug)
+
+
+def author_state(request, username):
+    return _last_edited(author_id=Subquery(
+        User.objects.filter(username=username).values('id')[:1]
+    )), author_scopes(request, username)
+
+
+def post_state(request, post_id):
+    row = Post.objects.filter(id=post_id).order_by().annotate(
+        last_comment=Subquery(
+            Comment.objects.filter(post=OuterRef('pk')).order_by(
+                '-pub_date'
+            ).values('pub_date')[:1]
+        ),
+        author_edited=Subquery(
+            Post.objects.filter(author=OuterRef('author')).order_by(
+                '-edited'
+            ).values('edited')[:1]
+        ),
+    ).values_list(
+        'edited', 'last_comment', 'author_edited', 'author__username',
+        'views_count',
+    ).first()
+    if row is None:
+        return None, ()
+    *timestamps, username, views = row
+    # Просмотры не двигают время правки, но видны на странице.
+    views = (views + pageviews.pending(post_id)) // (
+        settings.PAGEVIEWS_ETAG_STEP
+    )
+    return max(filter(None, timestamps)), (
+        SITE, author_scope(username), post_scope(post_id)
+    ), views
+
+
+def bump_posts_pages(author_id, group_ids=()):
+    """Сбрасывает ленту, страницу автора и страницы групп поста после
+    фиксации транзакции.
+
+    Имена авторов и групп читаются сразу: после удаления их в базе уже
+    может не быть.
+    """
+    scopes = [INDEX]
+    scopes.extend(
+        author_scope(username)
+        for username in User.objects.filter(id=author_id).values_list(
+            'username', flat=True
+        )
+    )
+    group_ids = {group_id for group_id in group_ids if group_id}
+    if group_ids:
+        scopes.extend(
+            group_scope(slug)
+            for slug in Group.objects.filter(id__in=group_ids).values_list(
+                'slug', flat=True
+            )
+        )
+    bump_on_commit(*scopes)
+
+
+def bump_authors_pages(*user_ids):
+    bump_on_commit(*(
+        author_scope(username)
+        for username in User.objects.filter(id__in=user_ids).values_list(
+            'username', flat=True
+        )
+    ))
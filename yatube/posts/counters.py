@@ -0,0 +1,116 @@
+"""Денормализованные счётчики постов, комментариев и подписок.
+
+Счётчики меняются сигналами в той же транзакции, что и сама запись,
+поэтому страницы читают готовые числа и не выполняют COUNT(*).
+Разошедшиеся значения чинит команда rebuild_counters.
+"""
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import (
+    Count, F, OuterRef, PositiveIntegerField, Subquery
+)
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Comment, Follow, Post, User, UserStats
+
+
+def _user_totals(user_ids=None):
+    """Считает фактические значения счётчиков по таблицам."""
+    totals = {}
+    sources = (
+        ('posts_count', Post.objects, 'author'),
+        ('followers_count', Follow.objects, 'author'),
+        ('following_count', Follow.objects, 'user'),
+    )
+    for counter, manager, field in sources:
+        queryset = manager.all()
+        if user_ids is not None:
+            queryset = queryset.filter(**{f'{field}__in': user_ids})
+        rows = queryset.order_by().values_list(field).annotate(Count('id'))
+        for user_id, value in rows:
+            totals.setdefault(user_id, {})[counter] = value
+    return totals
+
+
+def _shifted(counter, delta):
+    """Счётчик после приращения, не ниже нуля.
+
+    Разошедшийся счётчик иначе упёрся бы в CHECK поля
+    PositiveIntegerField, и удаление поста или подписки упало бы.
+    """
+    return Greatest(F(counter) + delta, 0)
+
+
+def change_user_stats(user_id, **deltas):
+    """Прибавляет к счётчикам пользователя переданные приращения."""
+    updated = UserStats.objects.filter(user_id=user_id).update(
+        **{
+            counter: _shifted(counter, delta)
+            for counter, delta in deltas.items()
+        }
+    )
+    if not updated and all(delta > 0 for delta in deltas.values()):
+        UserStats.objects.get_or_create(
+            user_id=user_id, defaults=_user_totals([user_id]).get(user_id, {})
+        )
+
+
+def change_comments_count(post_id, delta):
+    Post.objects.filter(id=post_id).update(
+        comments_count=_shifted('comments_count', delta)
+    )
+
+
+def _fix_user_stats(user_ids):
+    totals = _user_totals(user_ids)
+    stats = UserStats.objects.in_bulk(user_ids)
+    counters = ('posts_count', 'followers_count', 'following_count')
+    missing = []
+    changed = []
+    for user_id in user_ids:
+        actual = totals.get(user_id, {})
+        row = stats.get(user_id)
+        if row is None:
+            missing.append(UserStats(user_id=user_id, **actual))
+            continue
+        if any(getattr(row, name) != actual.get(name, 0) for name in counters):
+            for name in counters:
+                setattr(row, name, actual.get(name, 0))
+            changed.append(row)
+    UserStats.objects.bulk_create(missing)
+    UserStats.objects.bulk_update(changed, counters)
+    return len(missing) + len(changed)
+
+
+def rebuild(user_ids=None, posts=None, chunk_size=500):
+    """Пересчитывает счётчики и возвращает число исправленных.
+
+    По умолчанию пересчитываются все посты и пользователи; user_ids и
+    queryset posts сужают пересчёт, например до загруженных записей.
+    Пользователи обходятся порциями по chunk_size, каждая в своей
+    транзакции, так что в памяти нет счётчиков всех пользователей.
+    """
+    actual = Coalesce(Subquery(
+        Comment.objects.filter(post=OuterRef('pk')).order_by().values(
+            'post'
+        ).annotate(total=Count('id')).values('total'),
+        output_field=PositiveIntegerField(),
+    ), 0)
+    if posts is None:
+        posts = Post.objects.all()
+    fixed = posts.exclude(comments_count=actual).update(
+        comments_count=actual
+    )
+
+    if user_ids is None:
+        user_ids = User.objects.order_by('id').values_list(
+            'id', flat=True
+        ).iterator(chunk_size=chunk_size)
+    user_ids = iter(user_ids)
+    while True:
+        chunk = list(islice(user_ids, chunk_size))
+        if not chunk:
+            return fixed
+        with transaction.atomic():
+            fixed += _fix_user_stats(chunk)
@@ -0,0 +1,187 @@
+"""Лента подписок с разветвлением при записи.
+
+Пост автора раскладывается в FeedEntry каждого подписчика в момент
+публикации, поэтому чтение ленты — один проход по индексу
+(user, -pub_date, -post). Посты авторов, у которых подписчиков больше
+FEED_FANOUT_LIMIT, не раскладываются при записи: читатель подтягивает
+их к себе сам при открытии ленты.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import follows
+from .models import FeedEntry, FeedSync, Follow, Post, UserStats
+
+FEED_ORDERING = ('-pub_date', '-post_id')
+CELEBRITIES_CACHE_KEY = 'feed:celebrities'
+PULL_OVERLAP = timedelta(minutes=1)
+
+
+def _create_entries(pairs, pub_dates):
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(
+                user_id=user_id, post_id=post_id, pub_date=pub_dates[post_id]
+            )
+            for user_id, post_id in pairs
+        ),
+        batch_size=settings.FEED_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def get_celebrity_ids():
+    """Возвращает id авторов, чьи посты не раскладываются при записи."""
+    celebrity_ids = cache.get(CELEBRITIES_CACHE_KEY)
+    if celebrity_ids is None:
+        celebrity_ids = set(
+            UserStats.objects.filter(
+                followers_count__gt=settings.FEED_FANOUT_LIMIT
+            ).values_list('user_id', flat=True)
+        )
+        cache.set(
+            CELEBRITIES_CACHE_KEY,
+            celebrity_ids,
+            settings.FEED_CELEBRITIES_TIMEOUT,
+        )
+    return celebrity_ids
+
+
+def fan_out_post(post):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    follower_ids = list(
+        Follow.objects.filter(author_id=post.author_id).values_list(
+            'user_id', flat=True
+        )[:settings.FEED_FANOUT_LIMIT + 1]
+    )
+    if len(follower_ids) > settings.FEED_FANOUT_LIMIT:
+        celebrity_ids = get_celebrity_ids()
+        if post.author_id not in celebrity_ids:
+            cache.set(
+                CELEBRITIES_CACHE_KEY,
+                celebrity_ids | {post.author_id},
+                settings.FEED_CELEBRITIES_TIMEOUT,
+            )
+        return
+    _create_entries(
+        ((user_id, post.id) for user_id in follower_ids),
+        {post.id: post.pub_date},
+    )
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту читателя последние посты нового автора.
+
+    Подписка не должна ждать вставки всего архива автора, поэтому
+    берётся одна страница ленты — POSTS_COUNT самых свежих постов.
+    """
+    pub_dates = dict(
+        Post.objects.filter(author_id=author_id)
+        .order_by('-pub_date', '-id')
+        .values_list('id', 'pub_date')[:settings.POSTS_COUNT]
+    )
+    _create_entries(((user_id, post_id) for post_id in pub_dates), pub_dates)
+    FeedSync.objects.get_or_create(
+        user_id=user_id, defaults={'synced_at': timezone.now()}
+    )
+
+
+def prune(user_id, author_id):
+    """Убирает из ленты читателя посты автора после отписки."""
+    FeedEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+def rebuild(user_ids=None):
+    """Раскладывает по лентам посты всех авторов, на которых подписаны
+    читатели, например после массовой загрузки в обход сигналов.
+
+    Записи ленты строятся одним INSERT ... SELECT в базе, без выборки
+    строк в Python. Ленты переданных user_ids строятся порциями по
+    FEED_BATCH_SIZE читателей, каждая в своей транзакции.
+    """
+    sql = (
+        '{insert} {entry} (user_id, post_id, pub_date) '
+        'SELECT follow.user_id, post.id, post.pub_date '
+        'FROM {follow} follow '
+        'INNER JOIN {post} post ON post.author_id = follow.author_id'
+    ).format(
+        insert=connection.ops.insert_statement(ignore_conflicts=True),
+        entry=FeedEntry._meta.db_table,
+        follow=Follow._meta.db_table,
+        post=Post._meta.db_table,
+    )
+    suffix = connection.ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)
+    followers = Follow.objects.values_list('user', flat=True).distinct()
+    if user_ids is None:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'{sql} {suffix}')
+            _mark_synced(followers)
+        return
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), settings.FEED_BATCH_SIZE):
+        batch = user_ids[start:start + settings.FEED_BATCH_SIZE]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                '{} WHERE follow.user_id IN ({}) {}'.format(
+                    sql, ', '.join(['%s'] * len(batch)), suffix
+                ),
+                batch,
+            )
+            _mark_synced(followers.filter(user_id__in=batch))
+
+
+def _mark_synced(user_ids):
+    now = timezone.now()
+    FeedSync.objects.bulk_create(
+        (FeedSync(user_id=user_id, synced_at=now) for user_id in user_ids),
+        batch_size=settings.FEED_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def pull_celebrity_posts(user):
+    """Подтягивает в ленту посты популярных авторов, вышедшие с прошлого
+    открытия ленты.
+    """
+    celebrity_ids = get_celebrity_ids()
+    if not celebrity_ids:
+        return
+    author_ids = celebrity_ids.intersection(follows.followee_ids(user.id))
+    if not author_ids:
+        return
+    sync = FeedSync.objects.filter(user=user).first()
+    if sync is None:
+        return
+    pub_dates = dict(
+        Post.objects.filter(
+            author_id__in=author_ids,
+            pub_date__gt=sync.synced_at - PULL_OVERLAP,
+        ).values_list('id', 'pub_date')
+    )
+    for post_id in FeedEntry.objects.filter(
+            user=user, post_id__in=list(pub_dates)
+    ).values_list('post_id', flat=True):
+        del pub_dates[post_id]
+    if not pub_dates:
+        return
+    with transaction.atomic():
+        _create_entries(
+            ((user.id, post_id) for post_id in pub_dates), pub_dates
+        )
+        FeedSync.objects.filter(user=user).update(
+            synced_at=max(sync.synced_at, *pub_dates.values())
+        )
+
+
+def get_feed(user):
+    """Возвращает записи ленты читателя вместе с постами."""
+    pull_celebrity_posts(user)
+    return FeedEntry.objects.filter(user=user).select_related(
+        'post__author', 'post__group'
+    )
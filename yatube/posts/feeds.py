@@ -0,0 +1,151 @@
+"""Atom-ленты сайта, групп и авторов.
+
+Читатели лент опрашивают их регулярно, поэтому лента отвечает так же,
+как страницы: conditional_page даёт 304 по ETag и Last-Modified без
+построения ленты, а cache_page_versions хранит готовый XML до изменения
+версий данных. Без кэша XML отдаётся потоком, запись за записью.
+"""
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.syndication.views import Feed
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.feedgenerator import Atom1Feed
+from django.utils.text import Truncator
+from django.utils.xmlutils import SimplerXMLGenerator
+
+from .caching import (
+    author_scopes, author_state, cache_page_versions, conditional_page,
+    group_scopes, group_state, index_scopes, index_state
+)
+from .models import Group, Post, User
+
+
+class StreamingAtom1Feed(Atom1Feed):
+    def stream(self, encoding):
+        """Отдаёт XML ленты частями: заголовок и по одной записи."""
+        buffer = StringIO()
+        handler = SimplerXMLGenerator(buffer, encoding)
+
+        def flush():
+            chunk = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return chunk
+
+        handler.startDocument()
+        handler.startElement('feed', self.root_attributes())
+        self.add_root_elements(handler)
+        yield flush()
+        for item in self.items:
+            handler.startElement('entry', self.item_attributes(item))
+            self.add_item_elements(handler, item)
+            handler.endElement('entry')
+            yield flush()
+        handler.endElement('feed')
+        yield flush()
+
+
+class PostsFeed(Feed):
+    feed_type = StreamingAtom1Feed
+
+    def __call__(self, request, *args, **kwargs):
+        try:
+            obj = self.get_object(request, *args, **kwargs)
+        except ObjectDoesNotExist:
+            raise Http404('Лента не найдена.')
+        feedgen = self.get_feed(obj, request)
+        return StreamingHttpResponse(
+            feedgen.stream(settings.DEFAULT_CHARSET),
+            content_type=feedgen.content_type,
+        )
+
+    def recent(self, posts):
+        return posts.select_related('author', 'group')[
+            :settings.SYNDICATION_ITEMS_COUNT
+        ]
+
+    def item_title(self, item):
+        return Truncator(item.text).words(8)
+
+    def item_description(self, item):
+        return item.text
+
+    def item_link(self, item):
+        return reverse('posts:post_detail', kwargs={'post_id': item.id})
+
+    def item_author_name(self, item):
+        return item.author.get_full_name() or item.author.username
+
+    def item_author_link(self, item):
+        return reverse(
+            'posts:profile', kwargs={'username': item.author.username}
+        )
+
+    def item_pubdate(self, item):
+        return item.pub_date
+
+    def item_updateddate(self, item):
+        return item.edited
+
+    def item_categories(self, item):
+        return (item.group.title,) if item.group else ()
+
+
+class LatestPostsFeed(PostsFeed):
+    title = 'Yatube: последние записи'
+    description = 'Новые записи всех авторов'
+
+    def link(self):
+        return reverse('posts:index')
+
+    def items(self):
+        return self.recent(Post.objects.all())
+
+
+class GroupPostsFeed(PostsFeed):
+    def get_object(self, request, slug):
+        return get_object_or_404(Group, slug=slug)
+
+    def title(self, group):
+        return f'Yatube: {group.title}'
+
+    def description(self, group):
+        return group.description
+
+    def link(self, group):
+        return reverse('posts:group_list', kwargs={'slug': group.slug})
+
+    def items(self, group):
+        return self.recent(group.posts.all())
+
+
+class AuthorPostsFeed(PostsFeed):
+    def get_object(self, request, username):
+        return get_object_or_404(User, username=username)
+
+    def title(self, author):
+        return 'Yatube: {}'.format(author.get_full_name() or author.username)
+
+    def description(self, author):
+        return f'Записи автора {author.username}'
+
+    def link(self, author):
+        return reverse('posts:profile', kwargs={'username': author.username})
+
+    def items(self, author):
+        return self.recent(author.posts.all())
+
+
+latest_posts = conditional_page(index_state)(
+    cache_page_versions(index_scopes)(LatestPostsFeed())
+)
+group_posts = conditional_page(group_state)(
+    cache_page_versions(group_scopes)(GroupPostsFeed())
+)
+author_posts = conditional_page(author_state)(
+    cache_page_versions(author_scopes)(AuthorPostsFeed())
+)
@@ -0,0 +1,65 @@
+"""Граф подписок в кэше.
+
+Для каждого читателя в кэше лежит отсортированный массив id авторов, на
+которых он подписан: восемь байт на подписку вместо строк запроса.
+Массив читается из базы при первой проверке, поэтому проверка «подписан
+ли» на профиле и в ленте — двоичный поиск без SQL.
+
+Подписка и отписка не правят массив на месте: чтение, изменение и
+запись без блокировки затирали бы параллельные подписки, а откаченная
+транзакция оставила бы неверный массив. Вместо этого массив читателя
+удаляется из кэша после фиксации, и следующая проверка читает его из
+базы заново. Сами подписка и отписка идут в базу без оглядки на массив.
+"""
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Follow
+
+TYPECODE = 'q'
+
+
+def _key(user_id):
+    return f'follows:{user_id}'
+
+
+def _load(user_id):
+    return array(TYPECODE, Follow.objects.filter(user_id=user_id).order_by(
+        'author_id'
+    ).values_list('author_id', flat=True))
+
+
+def followee_ids(user_id):
+    """Отсортированный массив id авторов, на которых подписан читатель."""
+    key = _key(user_id)
+    author_ids = cache.get(key)
+    if author_ids is None:
+        author_ids = _load(user_id)
+        cache.set(key, author_ids, settings.FOLLOW_GRAPH_TIMEOUT)
+    return author_ids
+
+
+def _contains(author_ids, author_id):
+    index = bisect_left(author_ids, author_id)
+    return index < len(author_ids) and author_ids[index] == author_id
+
+
+def is_following(user, author):
+    if not user.is_authenticated or user.id == author.id:
+        return False
+    return _contains(followee_ids(user.id), author.id)
+
+
+def forget(user_ids):
+    """Сбрасывает массивы читателей, чьи подписки менялись в обход
+    сигналов."""
+    cache.delete_many([_key(user_id) for user_id in user_ids])
+
+
+def forget_on_commit(user_id):
+    """Сбрасывает массив читателя после фиксации подписки или отписки."""
+    transaction.on_commit(lambda: forget([user_id]))
@@ -1,5 +1,7 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 
+from . import images
 from .models import Post, Comment
 
 
@@ -8,6 +10,17 @@ class PostForm(forms.ModelForm):
         model = Post
         fields = ('text', 'group', 'image')
 
+    def clean_image(self):
+        """Ужимает и перекодирует новую картинку, запоминая её размер."""
+        image = self.cleaned_data['image']
+        if isinstance(image, UploadedFile):
+            image = images.ingest(image)
+            self.instance.image_width = image.width
+            self.instance.image_height = image.height
+        elif not image:
+            self.instance.image_width = self.instance.image_height = None
+        return image
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,113 @@
+"""Приём картинок постов и их адаптивные варианты.
+
+ingest() обрабатывает загрузку до сохранения поста: поворачивает снимок
+по EXIF, уменьшает до POST_IMAGE_MAX_SIZE по большей стороне и
+перекодирует в прогрессивный JPEG без метаданных. Камерный оригинал на
+несколько мегабайт становится файлом в сотни килобайт, и миниатюры
+режутся уже из него.
+
+variants() перечисляет размеры и форматы для srcset: ширины
+POST_IMAGE_WIDTHS в кадре POST_IMAGE_FRAME, в WebP (если Pillow собран
+с ним) и в JPEG. Их заранее нарезает thumbnails, а тег post_picture
+строит по ним <picture>.
+
+release() удаляет файл картинки вместе с миниатюрами, когда на него
+больше не ссылается ни один пост.
+"""
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, features
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from .models import Post
+
+JPEG = 'JPEG'
+WEBP = 'WEBP'
+# JPEG идёт последним: последний вариант служит признаком того, что
+# нарезаны все остальные.
+FORMATS = (WEBP, JPEG) if features.check('webp') else (JPEG,)
+MIME_TYPES = {JPEG: 'image/jpeg', WEBP: 'image/webp'}
+THUMBNAIL_OPTIONS = {'crop': 'center', 'upscale': True}
+
+
+def _flatten(image):
+    """Кладёт прозрачную картинку на белый фон: в JPEG нет альфа-канала."""
+    if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def ingest(upload):
+    """Возвращает обработанную картинку для Post.image.
+
+    У результата есть width и height итоговой картинки.
+    """
+    max_size = settings.POST_IMAGE_MAX_SIZE
+    upload.seek(0)
+    with Image.open(upload) as image:
+        # JPEG сразу декодируется в уменьшенном масштабе.
+        image.draft('RGB', (max_size, max_size))
+        icc_profile = image.info.get('icc_profile')
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+        image = _flatten(image)
+    buffer = BytesIO()
+    image.save(
+        buffer, JPEG,
+        quality=settings.POST_IMAGE_QUALITY,
+        optimize=True,
+        progressive=True,
+        icc_profile=icc_profile,
+    )
+    name = os.path.splitext(os.path.basename(upload.name))[0] + '.jpg'
+    content = ContentFile(buffer.getvalue(), name=name)
+    content.width, content.height = image.size
+    return content
+
+
+def geometry(width, height):
+    return f'{width}x{height}'
+
+
+def variants():
+    """Возвращает (формат, ширина, высота, опции sorl) всех вариантов."""
+    frame_width, frame_height = settings.POST_IMAGE_FRAME
+    return [
+        (
+            format_, width, round(width * frame_height / frame_width),
+            {**THUMBNAIL_OPTIONS, 'format': format_},
+        )
+        for format_ in FORMATS
+        for width in settings.POST_IMAGE_WIDTHS
+    ]
+
+
+def source(name):
+    """Картинка поста для sorl с хранилищем поля Post.image."""
+    return ImageFile(name, Post._meta.get_field('image').storage)
+
+
+def release(name):
+    """Удаляет файл и его миниатюры, если на него не ссылаются посты.
+
+    Недавно записанный файл остаётся: такую же картинку могли только что
+    загрузить для поста, который ещё не сохранён.
+    """
+    storage = Post._meta.get_field('image').storage
+    if not name or Post.objects.filter(image=name).exists():
+        return
+    try:
+        if not storage.exists(name) or storage.recently_saved(name):
+            return
+    except SuspiciousFileOperation:
+        # Путь вне MEDIA_ROOT хранилищу не принадлежит.
+        return
+    default.backend.delete(source(name))
@@ -0,0 +1,103 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import benchmarks
+from posts.models import User, UserStats
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет задержку и число SQL-запросов страниц posts '
+        'и сравнивает их с эталоном'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument(
+            '--username',
+            help='Читатель, от имени которого открываются страницы; '
+                 'по умолчанию — пользователь с наибольшим числом подписок',
+        )
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='Очищать кэш перед каждым запросом',
+        )
+        parser.add_argument(
+            '--baseline', default=settings.BENCHMARK_BASELINE,
+        )
+        parser.add_argument(
+            '--save-baseline', action='store_true',
+            help='Записать результаты как новый эталон',
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=settings.BENCHMARK_TOLERANCE,
+            help='Допустимый рост p95 в долях эталона',
+        )
+        parser.add_argument(
+            '--slack', type=float, default=settings.BENCHMARK_SLACK_MS,
+            help='Рост p95 в миллисекундах, который не считается регрессией',
+        )
+
+    def get_user(self, username):
+        if username:
+            user = User.objects.filter(username=username).first()
+        else:
+            user = User.objects.filter(
+                id__in=UserStats.objects.order_by(
+                    '-following_count'
+                ).values('user')[:1]
+            ).first()
+        if user is None:
+            raise CommandError(
+                'Нет пользователя для замеров, сначала выполните seed_data'
+            )
+        return user
+
+    def write_results(self, results):
+        self.stdout.write(
+            f'{"Маршрут":<20}{"p50":>10}{"p95":>10}{"p99":>10}'
+            f'{"SQL":>6}{"Код":>6}'
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<20}{result["p50"]:>10}{result["p95"]:>10}'
+                f'{result["p99"]:>10}{result["queries"]:>6}'
+                f'{result["status"]:>6}'
+            )
+
+    def handle(self, *args, **options):
+        try:
+            results = benchmarks.run(
+                self.get_user(options['username']),
+                options['iterations'],
+                options['cold'],
+            )
+        except benchmarks.BenchmarkError as error:
+            raise CommandError(f'Замер прерван: {error}')
+        self.write_results(results)
+        # Замеры с пустым и с прогретым кэшем хранятся в эталоне раздельно.
+        mode = 'cold' if options['cold'] else 'warm'
+        try:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+        except FileNotFoundError:
+            baseline = {}
+        if options['save_baseline']:
+            baseline[mode] = results
+            with open(options['baseline'], 'w') as baseline_file:
+                json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+            self.stdout.write(f'Эталон сохранён в {options["baseline"]}')
+            return
+        if mode not in baseline:
+            self.stdout.write('Эталон не найден, сравнение пропущено')
+            return
+        regressions = benchmarks.compare(
+            results, baseline[mode], options['tolerance'], options['slack']
+        )
+        if regressions:
+            raise CommandError(
+                'Регрессии производительности:\n' + '\n'.join(regressions)
+            )
+        self.stdout.write('Регрессий нет')
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from posts import jsonl
+
+
+class Command(BaseCommand):
+    help = 'Выгружает группы, посты, комментарии и подписки в JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default='-',
+            help='Файл для выгрузки, по умолчанию stdout',
+        )
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument(
+            '--media-dir', help='Каталог, куда скопировать картинки постов'
+        )
+
+    def handle(self, *args, **options):
+        if options['path'] == '-':
+            exported = jsonl.export(
+                self.stdout, options['chunk_size'], options['media_dir']
+            )
+        else:
+            with open(options['path'], 'w', encoding='utf-8') as stream:
+                exported = jsonl.export(
+                    stream, options['chunk_size'], options['media_dir']
+                )
+        for label, count in exported.items():
+            self.stderr.write(f'{label}: {count}')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from posts import snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        'Рисует публичные страницы для анонимов в статическую копию, '
+        'которую отдаёт nginx'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--root',
+            help='Каталог копии, по умолчанию SNAPSHOT_ROOT',
+        )
+
+    def handle(self, *args, **options):
+        written, total = snapshots.export(options['root'])
+        self.stdout.write(
+            f'Сохранено страниц: {written} из {total}, '
+            f'остальные отдаёт Django'
+        )
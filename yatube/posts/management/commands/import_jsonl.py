@@ -0,0 +1,38 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import jsonl
+
+
+class Command(BaseCommand):
+    help = 'Загружает группы, посты, комментарии и подписки из JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--media-root',
+            help='Каталог с картинками постов, выгруженными с --media-dir',
+        )
+
+    def handle(self, *args, **options):
+        importer = jsonl.Importer(
+            options['batch_size'], options['media_root']
+        )
+        start = time.perf_counter()
+        with open(options['path'], encoding='utf-8') as stream:
+            records = (json.loads(line) for line in stream if line.strip())
+            try:
+                imported = importer.run(records)
+            except (ValueError, KeyError) as error:
+                raise CommandError(f'Не удалось загрузить файл: {error}')
+        elapsed = time.perf_counter() - start
+        total = sum(imported.values())
+        for label, count in imported.items():
+            self.stdout.write(f'{label}: {count}')
+        self.stdout.write(
+            f'Загружено записей: {total} за {elapsed:.1f} с '
+            f'({total / max(elapsed, 1e-9):.0f} в секунду)'
+        )
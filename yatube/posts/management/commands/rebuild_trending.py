@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from posts import trending
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает рейтинг популярных постов'
+
+    def handle(self, *args, **options):
+        count = trending.rebuild()
+        self.stdout.write(f'Постов в рейтинге: {count}')
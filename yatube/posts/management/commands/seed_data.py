@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Наполняет базу данными для нагрузочных замеров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--comments', type=int, default=10000)
+        parser.add_argument(
+            '--follows', type=int, default=20,
+            help='Подписок на одного пользователя',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            prefix = benchmarks.seed(
+                users=options['users'],
+                groups=options['groups'],
+                posts=options['posts'],
+                comments=options['comments'],
+                follows=options['follows'],
+                batch_size=options['batch_size'],
+                seed=options['seed'],
+            )
+        self.stdout.write(f'Данные созданы, префикс имён: {prefix}')
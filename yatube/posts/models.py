@@ -3,6 +3,7 @@ from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import models
 
+from .storage import ContentAddressedStorage
 from .validators import validate_not_empty
 
 User = get_user_model()
@@ -13,6 +14,12 @@ class Group(models.Model):
     slug = models.SlugField(unique=True, verbose_name='Ссылка')
     description = models.TextField(verbose_name='Описание')
 
+    class Meta:
+        # Каталог групп листается курсором в порядке (title, id).
+        indexes = (
+            models.Index(fields=('title',), name='group_title_idx'),
+        )
+
     def __str__(self):
         return self.title
 
@@ -26,6 +33,7 @@ class Post(CreatedModel):
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='posts',
         verbose_name='Автор',
     )
@@ -34,18 +42,69 @@ class Post(CreatedModel):
         on_delete=models.SET_NULL,
         blank=True,
         null=True,
+        db_index=False,
         related_name='posts',
         verbose_name='Группа',
         help_text='Группа, к которой будет относиться пост',
     )
     image = models.ImageField(
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True,
         verbose_name='Картинка',
     )
+    image_width = models.PositiveIntegerField(
+        null=True,
+        editable=False,
+        verbose_name='Ширина картинки',
+    )
+    image_height = models.PositiveIntegerField(
+        null=True,
+        editable=False,
+        verbose_name='Высота картинки',
+    )
+    edited = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения',
+    )
+    comments_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество комментариев',
+    )
+    views_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество просмотров',
+    )
 
     class Meta:
         ordering = ('-pub_date',)
+        # SQLite дописывает id в конец каждого индекса, а обратный проход
+        # по возрастающему индексу даёт порядок (-pub_date, -id), по
+        # которому работает курсорная пагинация.
+        indexes = (
+            models.Index(
+                fields=('author', 'pub_date'), name='post_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=('group', 'pub_date'), name='post_group_pub_date_idx'
+            ),
+            models.Index(fields=('pub_date',), name='post_pub_date_idx'),
+            # Время последней правки для Last-Modified общей Atom-ленты.
+            models.Index(fields=('edited',), name='post_edited_idx'),
+            # Время последней правки постов автора и группы для
+            # Last-Modified читается одним шагом по индексу.
+            models.Index(
+                fields=('author', 'edited'), name='post_author_edited_idx'
+            ),
+            models.Index(
+                fields=('group', 'edited'), name='post_group_edited_idx'
+            ),
+            # Одинаковые картинки хранятся одним файлом, и перед его
+            # удалением ссылки на него считаются по этому индексу.
+            models.Index(fields=('image',), name='post_image_idx'),
+        )
 
     def __str__(self):
         return self.text[:settings.MAX_LENGTH_STR]
@@ -55,6 +114,7 @@ class Comment(CreatedModel):
     post = models.ForeignKey(
         Post,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='comments',
         verbose_name='Комментарий'
     )
@@ -70,6 +130,14 @@ class Comment(CreatedModel):
         help_text='Введите текст комментария',
     )
 
+    class Meta:
+        ordering = ('pub_date',)
+        indexes = (
+            models.Index(
+                fields=('post', 'pub_date'), name='comment_post_pub_date_idx'
+            ),
+        )
+
     def __str__(self):
         return self.text[:settings.MAX_LENGTH_STR]
 
@@ -78,6 +146,7 @@ class Follow(models.Model):
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='follower',
         verbose_name='Подписчик'
     )
@@ -87,3 +156,102 @@ class Follow(models.Model):
         related_name='following',
         verbose_name='Подписаться на'
     )
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'author'), name='unique_follow'
+            ),
+        )
+
+
+class UserStats(models.Model):
+    """Счётчики пользователя, обновляемые вместе с постами и подписками."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='Пользователь',
+    )
+    posts_count = models.PositiveIntegerField(
+        default=0, verbose_name='Количество постов'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0, db_index=True, verbose_name='Количество подписчиков'
+    )
+    following_count = models.PositiveIntegerField(
+        default=0, verbose_name='Количество подписок'
+    )
+
+
+class FeedEntry(models.Model):
+    """Запись ленты подписок, материализованная при публикации поста."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Читатель',
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Пост',
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации поста')
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'post'), name='unique_feed_entry'
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('user', '-pub_date', '-post'),
+                name='feed_user_pub_date_idx',
+            ),
+        )
+
+
+class FeedSync(models.Model):
+    """Момент последней подгрузки в ленту постов популярных авторов."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='feed_sync',
+        verbose_name='Читатель',
+    )
+    synced_at = models.DateTimeField(verbose_name='Синхронизировано')
+
+
+class TrendingPost(models.Model):
+    """Место поста в рейтинге популярного, пересчитываемом периодически."""
+    post = models.OneToOneField(
+        Post,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='trending',
+        verbose_name='Пост',
+    )
+    group = models.ForeignKey(
+        Group,
+        on_delete=models.SET_NULL,
+        null=True,
+        db_index=False,
+        related_name='trending_posts',
+        verbose_name='Группа поста',
+    )
+    score = models.FloatField(verbose_name='Рейтинг')
+
+    class Meta:
+        # Обратный проход по индексу с дописанным post_id даёт порядок
+        # (-score, -post_id) для курсорной пагинации.
+        indexes = (
+            models.Index(fields=('score',), name='trending_score_idx'),
+            models.Index(
+                fields=('group', 'score'), name='trending_group_score_idx'
+            ),
+        )
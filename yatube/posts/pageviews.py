@@ -0,0 +1,163 @@
+"""Счётчик просмотров постов с отложенной записью.
+
+UPDATE на каждый просмотр занимал бы единственного писателя SQLite на
+каждом чтении поста. Вместо этого просмотры копятся в памяти процесса и
+пишутся в Post.views_count одной пачкой: фоновым потоком раз в
+PAGEVIEWS_FLUSH_INTERVAL секунд, сразу при PAGEVIEWS_MAX_PENDING
+просмотрах в очереди и при выходе процесса. При падении процесса
+теряются только просмотры с последней записи.
+
+Просмотр считается до conditional_page, поэтому ответ 304 — тоже
+просмотр, а листание комментариев курсором — нет. Клиент (пользователь
+или IP-адрес) даёт посту не больше одного просмотра за
+PAGEVIEWS_DEDUPE_WINDOW секунд. Страницы из статической копии (см.
+posts.snapshots) отдаёт nginx, и просмотр из копии присылает скрипт
+страницы на post_view.
+count() складывает записанное в базу с тем, что этот процесс ещё не
+записал.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .models import Post
+from .utils import CursorPaginator
+
+logger = logging.getLogger(__name__)
+
+_pending = Counter()
+_pending_views = 0
+_pending_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_flusher = None
+
+
+def _first_view(request, post_id):
+    """Первый ли это просмотр поста клиентом за окно повторов."""
+    window = settings.PAGEVIEWS_DEDUPE_WINDOW
+    if not window:
+        return True
+    if request.user.is_authenticated:
+        client = f'user:{request.user.pk}'
+    else:
+        client = 'ip:' + request.META.get('REMOTE_ADDR', '')
+    return cache.add(f'pageview:{post_id}:{client}', True, window)
+
+
+def record(request, post_id):
+    """Учитывает просмотр поста и пишет пачку, если очередь полна."""
+    global _pending_views
+    if getattr(request, 'snapshot', False) or not _first_view(
+            request, post_id):
+        return
+    with _pending_lock:
+        _pending[post_id] += 1
+        _pending_views += 1
+        full = _pending_views >= settings.PAGEVIEWS_MAX_PENDING
+    _start_flusher()
+    if full:
+        flush()
+
+
+def counted(view_func):
+    """Считает GET-просмотр поста post_id до вызова view.
+
+    Запрос с курсором листает комментарии и просмотром не считается.
+    Несуществующие посты тоже попадают в очередь, но UPDATE их не
+    находит, и просмотры пропадают при записи.
+    """
+    @wraps(view_func)
+    def _wrapped_view(request, post_id, *args, **kwargs):
+        if (request.method == 'GET'
+                and CursorPaginator.cursor_query_param not in request.GET):
+            record(request, post_id)
+        return view_func(request, post_id, *args, **kwargs)
+    return _wrapped_view
+
+
+def pending(post_id):
+    with _pending_lock:
+        return _pending.get(post_id, 0)
+
+
+def count(post):
+    """Просмотры поста: записанные в базу и ждущие записи."""
+    return post.views_count + pending(post.id)
+
+
+def flush():
+    """Пишет накопленные просмотры одним executemany.
+
+    Запись идёт в одном потоке за раз; если она не удалась, просмотры
+    возвращаются в очередь до следующей попытки.
+    """
+    global _pending_views
+    if not _flush_lock.acquire(blocking=False):
+        return 0
+    try:
+        with _pending_lock:
+            deltas = dict(_pending)
+            _pending.clear()
+            _pending_views = 0
+        if not deltas:
+            return 0
+        try:
+            _write(deltas)
+        except Exception:
+            with _pending_lock:
+                _pending.update(deltas)
+                _pending_views += sum(deltas.values())
+            logger.exception('Не удалось записать просмотры постов')
+            return 0
+        return len(deltas)
+    finally:
+        _flush_lock.release()
+
+
+def _run_flusher():
+    while True:
+        time.sleep(settings.PAGEVIEWS_FLUSH_INTERVAL)
+        try:
+            flush()
+        finally:
+            # У потока своё соединение с базой, и между записями оно
+            # не нужно.
+            connection.close()
+
+
+def _start_flusher():
+    """Запускает фоновую запись при первом просмотре в процессе."""
+    global _flusher
+    if _flusher is not None:
+        return
+    with _pending_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(
+                target=_run_flusher, name='pageviews', daemon=True
+            )
+            _flusher.start()
+
+
+@atexit.register
+def _flush_at_exit():
+    if settings.PAGEVIEWS_FLUSH_AT_EXIT:
+        flush()
+
+
+def _write(deltas):
+    sql = 'UPDATE {table} SET {views} = {views} + %s WHERE {id} = %s'.format(
+        table=connection.ops.quote_name(Post._meta.db_table),
+        views=connection.ops.quote_name('views_count'),
+        id=connection.ops.quote_name('id'),
+    )
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            (delta, post_id) for post_id, delta in sorted(deltas.items())
+        ])
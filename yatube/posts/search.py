@@ -0,0 +1,203 @@
+"""Полнотекстовый поиск по постам на SQLite FTS5.
+
+Таблица posts_post_fts хранит только индекс по posts_post.text
+(external content): сам текст читается из posts_post. Индекс
+обновляют триггеры базы, поэтому его не обходят ни bulk_create, ни
+QuerySet.update. Схемный редактор SQLite при изменении Post
+пересоздаёт таблицу вместе с триггерами, так что install() повторяется
+после каждой миграции, а команда rebuild_search_index перестраивает
+индекс целиком.
+"""
+import re
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Post
+from .utils import CursorPaginator
+
+FTS_TABLE = 'posts_post_fts'
+SNIPPET_TOKENS = 24
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+INSTALL_SQL = (
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        text,
+        content='posts_post',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert
+    AFTER INSERT ON posts_post BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete
+    AFTER DELETE ON posts_post BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text)
+        VALUES ('delete', old.id, old.text);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update
+    AFTER UPDATE OF text ON posts_post BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text)
+        VALUES ('delete', old.id, old.text);
+        INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+)
+UNINSTALL_SQL = (
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_insert',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_delete',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_update',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+)
+
+
+def _execute(using, statements):
+    if using.vendor != 'sqlite':
+        return
+    with using.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def install(using=connection):
+    """Создаёт индекс и триггеры, если их ещё нет."""
+    _execute(using, INSTALL_SQL)
+
+
+def uninstall(using=connection):
+    _execute(using, UNINSTALL_SQL)
+
+
+def rebuild(using=connection):
+    """Заново строит индекс по всем постам."""
+    _execute(
+        using, (f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",)
+    )
+
+
+def to_match(query):
+    """Превращает строку пользователя в безопасный запрос FTS5.
+
+    Все слова должны встретиться в тексте. Слова ищутся целиком, кроме
+    последнего, которое пользователь может ещё дописывать: оно ищется
+    по префиксу, если в нём не меньше SEARCH_PREFIX_MIN_LENGTH букв,
+    чтобы короткий префикс не разворачивался в половину словаря.
+    Операторы FTS5 из строки не принимаются.
+    """
+    words = [f'"{word}"' for word in re.findall(r'\w+', query)]
+    if words and len(words[-1]) - 2 >= settings.SEARCH_PREFIX_MIN_LENGTH:
+        words[-1] += '*'
+    return ' '.join(words)
+
+
+def highlight(snippet):
+    return mark_safe(
+        escape(snippet)
+        .replace(HIGHLIGHT_START, '<mark>')
+        .replace(HIGHLIGHT_END, '</mark>')
+    )
+
+
+def filter_posts(queryset, query):
+    """Оставляет в queryset только посты, подходящие под запрос."""
+    match = to_match(query)
+    if not match:
+        return queryset.none()
+    return queryset.filter(id__in=RawSQL(
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+        (match,),
+    ))
+
+
+class SearchResults:
+    """Найденные посты по убыванию релевантности (bm25).
+
+    Посты выбираются по ключу (rank, rowid) без OFFSET и без подсчёта
+    всех совпадений, см. SearchPaginator. Сниппеты строятся только для
+    выбранной порции.
+    """
+    def __init__(self, query):
+        self.match = to_match(query)
+
+    def fetch(self, after=None, forward=True, limit=None):
+        """До limit постов за ключом after = (rank, id) в порядке
+        релевантности или, при forward=False, в обратном.
+        """
+        if not self.match:
+            return []
+        order = '' if forward else ' DESC'
+        keyset = ''
+        keyset_params = ()
+        if after is not None:
+            rank, post_id = after
+            keyset = 'AND (rank {0} %s OR rank = %s AND rowid {0} %s)'.format(
+                '>' if forward else '<'
+            )
+            keyset_params = (rank, rank, post_id)
+        with connection.cursor() as cursor:
+            # Сниппет строится во внешнем запросе, только для выбранных.
+            cursor.execute(
+                f"""
+                SELECT rowid, rank,
+                    snippet({FTS_TABLE}, 0, %s, %s, '…', %s)
+                FROM {FTS_TABLE}
+                WHERE {FTS_TABLE} MATCH %s AND rowid IN (
+                    SELECT rowid FROM {FTS_TABLE}
+                    WHERE {FTS_TABLE} MATCH %s {keyset}
+                    ORDER BY rank{order}, rowid{order} LIMIT %s
+                )
+                ORDER BY rank{order}, rowid{order}
+                """,
+                (
+                    HIGHLIGHT_START, HIGHLIGHT_END, SNIPPET_TOKENS,
+                    self.match, self.match, *keyset_params,
+                    -1 if limit is None else limit,
+                ),
+            )
+            rows = cursor.fetchall()
+        posts = Post.objects.select_related('author', 'group').in_bulk(
+            [post_id for post_id, _, _ in rows]
+        )
+        results = []
+        for post_id, rank, snippet in rows:
+            post = posts.get(post_id)
+            if post is not None:
+                post.rank = rank
+                post.snippet = highlight(snippet)
+                results.append(post)
+        return results
+
+
+class SearchPaginator(CursorPaginator):
+    """Курсорный пагинатор результатов поиска по ключу (rank, id).
+
+    rank пересчитывается на каждом запросе, поэтому после изменения
+    индекса граница страницы может немного сдвинуться.
+    """
+
+    def __init__(self, results, per_page):
+        # Результаты — не QuerySet, и order_by базового класса не нужен.
+        Paginator.__init__(self, results, per_page)
+        self.ordering = self.fields = ('rank', 'id')
+        self._num_pages = 1
+
+    def to_python(self, values):
+        rank, post_id = values
+        return [float(rank), int(post_id)]
+
+    def fetch(self, values, forward):
+        rows = self.object_list.fetch(values, forward, self.per_page + 1)
+        return rows[:self.per_page], len(rows) > self.per_page
@@ -0,0 +1,247 @@
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models.signals import (
+    post_delete, post_migrate, post_save, pre_delete, pre_save
+)
+from django.dispatch import receiver
+
+from . import (
+    caching, counters, feed, follows, images, search, snapshots, trending
+)
+from .models import Comment, Follow, Group, Post, User, UserStats
+
+
+def shown_fields_changed(update_fields):
+    return update_fields is None or set(update_fields) != {'last_login'}
+
+
+@receiver(pre_save, sender=User)
+def remember_old_username(sender, instance, raw=False, update_fields=None,
+                          **kwargs):
+    if (not raw and not instance._state.adding and snapshots.enabled()
+            and shown_fields_changed(update_fields)):
+        instance._old_username = User.objects.filter(
+            id=instance.id
+        ).values_list('username', flat=True).first()
+
+
+@receiver(post_save, sender=User)
+def create_user_stats(sender, instance, created, raw=False, update_fields=None,
+                      **kwargs):
+    if raw:
+        return
+    if created:
+        UserStats.objects.get_or_create(user=instance)
+    elif shown_fields_changed(update_fields):
+        caching.bump_on_commit(caching.SITE)
+        snapshots.schedule(lambda: snapshots.user_pages(
+            instance.id,
+            getattr(instance, '_old_username', None) or instance.username,
+            instance.username,
+        ))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def bump_site_pages(sender, **kwargs):
+    caching.bump_on_commit(caching.SITE)
+
+
+@receiver(pre_save, sender=Group)
+def remember_old_slug(sender, instance, raw=False, **kwargs):
+    if not raw and not instance._state.adding and snapshots.enabled():
+        instance._old_slug = Group.objects.filter(
+            id=instance.id
+        ).values_list('slug', flat=True).first()
+
+
+@receiver(post_save, sender=Group)
+def render_group_pages(sender, instance, raw=False, **kwargs):
+    if not raw:
+        snapshots.schedule(lambda: snapshots.group_pages(
+            instance.id,
+            getattr(instance, '_old_slug', None) or instance.slug,
+            instance.slug,
+        ))
+
+
+@receiver(pre_delete, sender=Group)
+def render_deleted_group_pages(sender, instance, **kwargs):
+    # После удаления посты группы уже не найти: SET_NULL их отвязал.
+    snapshots.schedule(
+        lambda: snapshots.group_pages(instance.id, instance.slug)
+    )
+
+
+def release_image(name):
+    if name:
+        transaction.on_commit(lambda: images.release(name))
+
+
+@receiver(pre_save, sender=Post)
+def remember_old_values(sender, instance, raw=False, **kwargs):
+    if not raw and not instance._state.adding:
+        (
+            instance._old_author_id,
+            instance._old_group_id,
+            instance._old_image,
+        ) = Post.objects.filter(id=instance.id).values_list(
+            'author_id', 'group_id', 'image'
+        ).first() or (None, None, '')
+
+
+@receiver(post_save, sender=Post)
+def count_post(sender, instance, created, **kwargs):
+    if created:
+        counters.change_user_stats(instance.author_id, posts_count=1)
+        return
+    old_author_id = getattr(instance, '_old_author_id', None)
+    if old_author_id and old_author_id != instance.author_id:
+        # Автора меняют в админке: пост переходит в счётчик нового.
+        counters.change_user_stats(old_author_id, posts_count=-1)
+        counters.change_user_stats(instance.author_id, posts_count=1)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_new_post(sender, instance, created, **kwargs):
+    if created:
+        feed.fan_out_post(instance)
+
+
+@receiver(post_save, sender=Post)
+def bump_saved_post_pages(sender, instance, created, **kwargs):
+    old_author_id = getattr(instance, '_old_author_id', None)
+    if old_author_id and old_author_id != instance.author_id:
+        caching.bump_posts_pages(old_author_id)
+    caching.bump_posts_pages(
+        instance.author_id,
+        (instance.group_id, getattr(instance, '_old_group_id', None)),
+    )
+    old_group_id = getattr(instance, '_old_group_id', instance.group_id)
+    if created and instance.group_id or old_group_id != instance.group_id:
+        caching.bump_on_commit(caching.GROUPS)
+
+
+@receiver(post_save, sender=Post)
+def move_trending_post(sender, instance, **kwargs):
+    old_group_id = getattr(instance, '_old_group_id', instance.group_id)
+    if old_group_id != instance.group_id:
+        trending.move(instance)
+
+
+@receiver(post_save, sender=Post)
+def release_replaced_image(sender, instance, **kwargs):
+    old_image = getattr(instance, '_old_image', '')
+    if old_image != instance.image.name:
+        release_image(old_image)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def render_post_pages(sender, instance, **kwargs):
+    snapshots.schedule(lambda: snapshots.post_pages(instance))
+
+
+@receiver(post_delete, sender=Post)
+def uncount_post(sender, instance, **kwargs):
+    counters.change_user_stats(instance.author_id, posts_count=-1)
+
+
+@receiver(post_delete, sender=Post)
+def bump_deleted_post_pages(sender, instance, **kwargs):
+    caching.bump_posts_pages(instance.author_id, (instance.group_id,))
+    if instance.group_id:
+        caching.bump_on_commit(caching.GROUPS)
+
+
+@receiver(post_delete, sender=Post)
+def release_deleted_image(sender, instance, **kwargs):
+    release_image(instance.image.name)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        counters.change_comments_count(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    counters.change_comments_count(instance.post_id, -1)
+
+
+@receiver(post_delete, sender=Comment)
+def bump_comment_pages(sender, instance, **kwargs):
+    caching.bump_on_commit(caching.post_scope(instance.post_id))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def render_comment_pages(sender, instance, **kwargs):
+    snapshots.schedule(lambda: snapshots.comment_pages(instance.post_id))
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def forget_follow_graph(sender, instance, created=True, **kwargs):
+    # post_delete не передаёт created: удаление подписки меняет всё.
+    if created:
+        follows.forget_on_commit(instance.user_id)
+
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, **kwargs):
+    if created:
+        counters.change_user_stats(instance.user_id, following_count=1)
+        counters.change_user_stats(instance.author_id, followers_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def uncount_follow(sender, instance, **kwargs):
+    counters.change_user_stats(instance.user_id, following_count=-1)
+    counters.change_user_stats(instance.author_id, followers_count=-1)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_feed(sender, instance, created, **kwargs):
+    if created:
+        feed.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def prune_feed(sender, instance, **kwargs):
+    feed.prune(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def bump_follow_pages(sender, instance, created=True, **kwargs):
+    if created:
+        caching.bump_authors_pages(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def render_follow_pages(sender, instance, created=True, **kwargs):
+    if created:
+        snapshots.schedule(lambda: snapshots.profile_paths(
+            instance.user_id, instance.author_id
+        ))
+
+
+@receiver(post_migrate)
+def restore_search_index(sender, using, **kwargs):
+    # Изменение Post в миграции пересоздаёт таблицу и теряет триггеры.
+    connection = connections[using]
+    if (sender.name == 'posts' and Post._meta.db_table
+            in connection.introspection.table_names()):
+        search.install(connection)
+
+
+@receiver(post_migrate)
+def clear_shared_cache(sender, plan=None, **kwargs):
+    # Общий кэш на диске переживает пересоздание базы, а версии страниц
+    # в нём ничего не знают о новых данных. migrate без новых миграций
+    # базу не меняет, и кэш остаётся.
+    if sender.name == 'posts' and plan:
+        cache.clear()
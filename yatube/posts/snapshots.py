@@ -0,0 +1,323 @@
+"""Статические копии публичных страниц для анонимных посетителей.
+
+Анонимы видят ленту, страницы групп, авторов и постов и раздел about
+одинаково, поэтому их можно отдавать файлами. export_snapshot рисует
+эти страницы для анонима и кладёт в SNAPSHOT_ROOT как <адрес>/index.html.
+Фронтовый nginx отдаёт файл сам, если у запроса нет строки запроса и
+cookie sessionid, а остальное передаёт Django:
+
+    map $args$cookie_sessionid $snapshot {
+        '' $uri/index.html;
+        default @django;
+    }
+    location / {
+        root /path/to/snapshot;
+        try_files $snapshot @django;
+    }
+
+Пока каталог копии существует, сигналы постов, комментариев, подписок,
+групп и пользователей ставят затронутые страницы в очередь, и один
+фоновый поток перерисовывает их после фиксации транзакции. Страница,
+которую нельзя отдать файлом (не 200, с cookie или с оригиналом вместо
+миниатюры), из копии удаляется, и её отдаёт Django.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.core.handlers.base import BaseHandler
+from django.db import connections, transaction
+from django.db.models import Q
+from django.test import RequestFactory
+from django.urls import reverse
+
+from . import thumbnails
+from .models import Group, Post, User
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = 'index.html'
+
+_handler = None
+_pending = set()
+_pending_lock = threading.Lock()
+_executor = None
+
+
+def enabled():
+    root = settings.SNAPSHOT_ROOT
+    return bool(root) and os.path.isdir(root)
+
+
+def file_path(path, root=None):
+    """Файл копии для адреса или None, если адрес выходит из каталога."""
+    parts = [unquote(part) for part in path.split('/') if part]
+    if any(part in ('.', '..') or os.sep in part for part in parts):
+        return None
+    return os.path.join(root or settings.SNAPSHOT_ROOT, *parts, INDEX_FILE)
+
+
+def _get_handler():
+    global _handler
+    if _handler is None:
+        handler = BaseHandler()
+        handler.load_middleware()
+        _handler = handler
+    return _handler
+
+
+def _write(target, content):
+    directory = os.path.dirname(target)
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=directory)
+    with os.fdopen(descriptor, 'wb') as stream:
+        stream.write(content)
+    os.chmod(temporary, 0o644)
+    os.replace(temporary, target)
+
+
+def _remove(target):
+    try:
+        os.remove(target)
+    except FileNotFoundError:
+        pass
+
+
+def _host():
+    """Имя сайта в запросах отрисовки.
+
+    SNAPSHOT_HOST, иначе первое имя из ALLOWED_HOSTS, иначе localhost:
+    при DEBUG Django пропускает его и с пустым ALLOWED_HOSTS.
+    """
+    if settings.SNAPSHOT_HOST:
+        return settings.SNAPSHOT_HOST
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*':
+            return host.lstrip('.')
+    return 'localhost'
+
+
+def render(path, root=None):
+    """Перерисовывает копию страницы по адресу path.
+
+    Возвращает True, если файл записан, False, если страницу отдаёт
+    Django, и None, если на ней пока нет миниатюр: её стоит
+    перерисовать после нарезки.
+    """
+    target = file_path(path, root)
+    if target is None:
+        return False
+    fallbacks = thumbnails.fallbacks_rendered()
+    request = RequestFactory(SERVER_NAME=_host()).get(path)
+    # Отрисовка копии — не просмотр страницы.
+    request.snapshot = True
+    response = _get_handler().get_response(request)
+    if thumbnails.fallbacks_rendered() != fallbacks:
+        _remove(target)
+        return None
+    if (response.status_code != 200 or response.streaming
+            or response.cookies):
+        _remove(target)
+        return False
+    _write(target, response.content)
+    return True
+
+
+def render_all(paths, root=None):
+    """Перерисовывает страницы и возвращает число записанных файлов.
+
+    Страницы, ждущие миниатюр, рисуются ещё раз после нарезки.
+    """
+    results = {path: render(path, root) for path in paths}
+    waiting = [path for path, result in results.items() if result is None]
+    if waiting:
+        thumbnails.wait(settings.SNAPSHOT_THUMBNAILS_TIMEOUT)
+        results.update((path, render(path, root)) for path in waiting)
+    return sum(1 for result in results.values() if result)
+
+
+def public_paths():
+    """Адреса всех страниц, которые анонимы видят одинаково."""
+    yield reverse('posts:index')
+    yield reverse('about:author')
+    yield reverse('about:tech')
+    for slug in list(Group.objects.values_list('slug', flat=True)):
+        yield reverse('posts:group_list', kwargs={'slug': slug})
+    for username in list(User.objects.values_list('username', flat=True)):
+        yield reverse('posts:profile', kwargs={'username': username})
+    yield from post_paths(Post.objects.values_list('id', flat=True))
+
+
+def post_paths(post_ids):
+    return [
+        reverse('posts:post_detail', kwargs={'post_id': post_id})
+        for post_id in list(post_ids)
+    ]
+
+
+def posts_pages(author_id, group_ids=(), post_ids=()):
+    """Лента, страницы автора, его групп и постов post_ids."""
+    paths = [reverse('posts:index'), *post_paths(post_ids)]
+    paths.extend(profile_paths(author_id))
+    group_ids = {group_id for group_id in group_ids if group_id}
+    if group_ids:
+        paths.extend(
+            reverse('posts:group_list', kwargs={'slug': slug})
+            for slug in Group.objects.filter(id__in=group_ids).values_list(
+                'slug', flat=True
+            )
+        )
+    return paths
+
+
+def post_pages(post):
+    """Страницы, которые показывают пост: его собственная и списки.
+
+    Число постов автора копия страницы поста не показывает, так что
+    публикация не трогает остальные посты автора.
+    """
+    paths = posts_pages(
+        post.author_id,
+        (post.group_id, getattr(post, '_old_group_id', None)),
+        (post.id,),
+    )
+    old_author_id = getattr(post, '_old_author_id', None)
+    if old_author_id and old_author_id != post.author_id:
+        paths.extend(profile_paths(old_author_id))
+    return paths
+
+
+def comment_pages(post_id):
+    """Страница поста: карточки в списках комментариев не показывают."""
+    return post_paths((post_id,))
+
+
+def group_pages(group_id, *slugs):
+    """Страницы с названием группы под её прежним и новым адресом.
+
+    Название видно на ленте группы, в карточках её постов на главной и
+    у авторов и на страницах самих постов.
+    """
+    return [
+        reverse('posts:index'),
+        *(
+            reverse('posts:group_list', kwargs={'slug': slug})
+            for slug in dict.fromkeys(slugs)
+        ),
+        *_profiles(User.objects.filter(posts__group_id=group_id)),
+        *post_paths(Post.objects.filter(
+            group_id=group_id
+        ).values_list('id', flat=True)),
+    ]
+
+
+def user_pages(user_id, *usernames):
+    """Страницы с именем пользователя под прежним и новым адресом.
+
+    Имя видно в профиле, в карточках его постов на главной и в группах
+    и на страницах постов, которые он написал или прокомментировал.
+    """
+    posts = Post.objects.filter(
+        Q(author_id=user_id) | Q(comments__author_id=user_id)
+    )
+    return [
+        reverse('posts:index'),
+        *(
+            reverse('posts:profile', kwargs={'username': username})
+            for username in dict.fromkeys(usernames)
+        ),
+        *(
+            reverse('posts:group_list', kwargs={'slug': slug})
+            for slug in Group.objects.filter(
+                posts__author_id=user_id
+            ).values_list('slug', flat=True).distinct()
+        ),
+        *post_paths(posts.values_list('id', flat=True).distinct()),
+    ]
+
+
+def _profiles(users):
+    return [
+        reverse('posts:profile', kwargs={'username': username})
+        for username in users.values_list('username', flat=True).distinct()
+    ]
+
+
+def profile_paths(*user_ids):
+    return _profiles(User.objects.filter(id__in=user_ids))
+
+
+def export(root=None):
+    """Рисует все публичные страницы заново и подменяет ими копию.
+
+    Новая копия собирается рядом со старой, поэтому удалённые страницы
+    из неё пропадают, а nginx не видит наполовину нарисованной копии.
+    """
+    root = os.path.abspath(root or settings.SNAPSHOT_ROOT)
+    parent, name = os.path.split(root)
+    os.makedirs(parent, exist_ok=True)
+    building = tempfile.mkdtemp(prefix=f'.{name}-', dir=parent)
+    paths = list(public_paths())
+    try:
+        written = render_all(paths, building)
+    except BaseException:
+        shutil.rmtree(building, ignore_errors=True)
+        raise
+    os.chmod(building, 0o755)
+    previous = None
+    if os.path.exists(root):
+        previous = tempfile.mkdtemp(prefix=f'.{name}-', dir=parent)
+        os.replace(root, os.path.join(previous, name))
+    os.replace(building, root)
+    if previous:
+        shutil.rmtree(previous, ignore_errors=True)
+    return written, len(paths)
+
+
+def _get_executor():
+    global _executor
+    with _pending_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='snapshots'
+            )
+    return _executor
+
+
+def _drain():
+    while True:
+        with _pending_lock:
+            paths = sorted(_pending)
+            _pending.clear()
+        if not paths:
+            break
+        try:
+            render_all(paths)
+        except Exception:
+            logger.exception('Не удалось обновить копии страниц')
+    connections.close_all()
+
+
+def _submit(paths):
+    with _pending_lock:
+        idle = not _pending
+        _pending.update(paths)
+    if idle:
+        _get_executor().submit(_drain)
+
+
+def schedule(get_paths):
+    """Перерисует страницы get_paths() после фиксации транзакции.
+
+    Адреса вычисляются сразу: после удаления поста его автора и группы
+    в базе уже может не быть.
+    """
+    if not enabled():
+        return
+    paths = get_paths()
+    transaction.on_commit(lambda: _submit(paths))
@@ -0,0 +1,52 @@
+"""Хранилище картинок постов с адресацией по содержимому.
+
+Имя файла — sha256 его байтов, поэтому повторная загрузка той же
+картинки не пишет новый файл, а ссылается на прежний. Имена миниатюр
+sorl выводятся из имени исходника, так что дубликату достаются уже
+нарезанные варианты. Файл удаляет images.release(), когда на него не
+остаётся ссылок из постов.
+"""
+import hashlib
+import os
+import posixpath
+import time
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        directory, basename = posixpath.split(name.replace('\\', '/'))
+        stem, extension = os.path.splitext(basename)
+        if stem == digest and posixpath.basename(directory) == digest[:2]:
+            # Имя уже адресовано содержимым (например, из выгрузки JSONL):
+            # второго уровня каталогов ему не нужно.
+            directory = posixpath.dirname(directory)
+        name = posixpath.join(
+            directory, digest[:2], digest + extension.lower()
+        )
+        if self.exists(name):
+            # Свежее время изменения не даёт release() удалить файл, на
+            # который вот-вот сошлётся ещё не сохранённый пост.
+            os.utime(self.path(name))
+            return name
+        saved = self._save(name, content)
+        if saved != name:
+            # Те же байты только что записал параллельный запрос.
+            self.delete(saved)
+        return name
+
+    def recently_saved(self, name):
+        age = time.time() - os.path.getmtime(self.path(name))
+        return age < settings.POST_IMAGE_RELEASE_GRACE
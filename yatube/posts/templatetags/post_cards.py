@@ -0,0 +1,50 @@
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from posts import caching, thumbnails
+
+register = template.Library()
+
+CARD_TEMPLATE = 'posts/includes/post_list.html'
+
+
+def card_key(post, show_author, show_group):
+    return 'post_card:{}{}:{}:{}'.format(
+        int(show_author), int(show_group), post.id, post.edited.timestamp()
+    )
+
+
+@register.simple_tag
+def post_cards(posts, show_author=True, show_group=True):
+    """Возвращает разметку карточек постов, беря готовую из кэша.
+
+    Вся страница карточек читается одним get_many. Ключ содержит дату
+    изменения поста, поэтому правка поста сама выводит старую карточку
+    из оборота, а версия сайта в значении сбрасывает карточки после
+    переименования групп и авторов.
+    """
+    posts = list(posts)
+    keys = [card_key(post, show_author, show_group) for post in posts]
+    version_key = caching.version_key(caching.SITE)
+    cached = cache.get_many(keys + [version_key])
+    version = cached.get(version_key) or caching.get_versions([caching.SITE])
+    cards = []
+    missed = {}
+    for post, key in zip(posts, keys):
+        card_version, html = cached.get(key, (None, None))
+        if card_version != version:
+            fallbacks = thumbnails.fallbacks_rendered()
+            html = render_to_string(CARD_TEMPLATE, {
+                'post': post,
+                'show_author': show_author,
+                'show_group': show_group,
+            })
+            if thumbnails.fallbacks_rendered() == fallbacks:
+                missed[key] = (version, html)
+        cards.append(mark_safe(html))
+    if missed:
+        cache.set_many(missed, settings.PAGE_CACHE_TIMEOUT)
+    return cards
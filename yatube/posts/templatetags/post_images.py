@@ -0,0 +1,46 @@
+from django import template
+from django.conf import settings
+from sorl.thumbnail import default
+
+from posts import images
+
+register = template.Library()
+
+
+@register.inclusion_tag('posts/includes/post_picture.html')
+def post_picture(post):
+    """Картинка поста с вариантами для srcset.
+
+    Готовность проверяется одним чтением — по последнему варианту, он
+    нарезается последним. Пока его нет, показывается оригинал, а нарезка
+    ставится в очередь. Адреса остальных вариантов вычисляются без
+    обращений к хранилищу.
+    """
+    variants = images.variants()
+    *_, (_, width, height, options) = variants
+    marker = default.backend.get_thumbnail(
+        post.image, images.geometry(width, height), **options
+    )
+    if marker.name == post.image.name:
+        return {'post': post, 'ready': False}
+    srcsets = {}
+    for format_, width, height, options in variants:
+        url = default.backend.get_url(
+            post.image, images.geometry(width, height), **options
+        )
+        srcsets.setdefault(format_, []).append(f'{url} {width}w')
+    frame_width, frame_height = settings.POST_IMAGE_FRAME
+    return {
+        'post': post,
+        'ready': True,
+        'sources': [
+            (images.MIME_TYPES[format_], ', '.join(srcset))
+            for format_, srcset in srcsets.items()
+            if format_ != images.JPEG
+        ],
+        'src': marker.url,
+        'srcset': ', '.join(srcsets[images.JPEG]),
+        'sizes': settings.POST_IMAGE_SIZES,
+        'width': frame_width,
+        'height': frame_height,
+    }
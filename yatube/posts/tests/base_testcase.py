@@ -1,11 +1,16 @@
+import os
 import shutil
 import tempfile
 
 from django.conf import settings
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from sorl.thumbnail.conf import settings as sorl_settings
 
+from .. import thumbnails
 from ..models import User, Post, Group
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
@@ -45,12 +50,54 @@ class PostTestCase(TestCase):
 
     @classmethod
     def tearDownClass(cls):
+        # Пул не должен писать миниатюры в удаляемый каталог.
+        thumbnails.shutdown()
         super().tearDownClass()
         shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
 
+    def tearDown(self):
+        # Миниатюры, нарезанные в тесте, следующему тесту не достаются.
+        thumbnails.wait()
+        shutil.rmtree(
+            os.path.join(TEMP_MEDIA_ROOT, sorl_settings.THUMBNAIL_PREFIX),
+            ignore_errors=True,
+        )
+        super().tearDown()
+
     def setUp(self):
         self.authorized_client = Client()
         self.authorized_client.force_login(self.user)
         self.authorized_follower = Client()
         self.authorized_follower.force_login(self.follower)
         cache.clear()
+
+    def run_commit_hooks(self):
+        """Выполняет колбэки on_commit, как при фиксации транзакции.
+
+        TestCase не фиксирует транзакции и иначе отбрасывает их.
+        """
+        callbacks = connection.run_on_commit
+        connection.run_on_commit = []
+        for _, callback in callbacks:
+            callback()
+
+    def generate_thumbnails(self):
+        """Нарезает миниатюры картинок постов, как это сделал бы пул."""
+        for name in Post.objects.exclude(image='').values_list(
+                'image', flat=True):
+            thumbnails.generate_all(name)
+
+
+class QueryBudgetMixin:
+    """Проверяет, что страница укладывается в бюджет SQL-запросов."""
+
+    def assertQueryBudget(self, client, url, budget):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        executed = '\n'.join(query['sql'] for query in queries)
+        self.assertLessEqual(
+            len(queries),
+            budget,
+            f'{url}: {len(queries)} запросов вместо {budget}\n{executed}',
+        )
+        return response
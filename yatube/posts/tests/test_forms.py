@@ -1,7 +1,12 @@
+from io import BytesIO
+
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
 from django.urls import reverse
+from PIL import Image
 
 from .base_testcase import PostTestCase
+from ..forms import PostForm
 from ..models import Post, Comment
 
 
@@ -41,7 +46,8 @@ class PostCreateFormTests(PostTestCase):
         self.assertEqual(post.text, form_data['text'])
         self.assertEqual(post.group.id, form_data['group'])
         self.assertEqual(post.author, self.user)
-        self.assertEqual(post.image, 'posts/big.gif')
+        self.assertRegex(post.image.name, r'^posts/\w\w/\w{64}\.jpg$')
+        self.assertEqual((post.image_width, post.image_height), (2, 1))
 
     def test_edit_post(self):
         """Валидная форма редактирует запись в Post."""
@@ -68,6 +74,65 @@ class PostCreateFormTests(PostTestCase):
         self.assertEqual(self.post.group.id, form_data['group'])
 
 
+@override_settings(POST_IMAGE_MAX_SIZE=100)
+class ImageIngestTests(PostTestCase):
+    def upload(self, image, name, **params):
+        buffer = BytesIO()
+        image.save(buffer, **params)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def submit(self, upload):
+        form = PostForm(
+            data={'text': 'Снимок', 'group': self.group.id},
+            files={'image': upload},
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        post = form.save(commit=False)
+        post.author = self.user
+        post.save()
+        return post
+
+    def test_camera_original_is_shrunk_and_cleaned(self):
+        """Снимок поворачивается по EXIF, ужимается и теряет метаданные."""
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010F] = 'Камера'
+        post = self.submit(self.upload(
+            Image.new('RGB', (400, 200), 'red'), 'camera.jpeg',
+            format='JPEG', exif=exif.tobytes(),
+        ))
+        self.assertTrue(post.image.name.endswith('.jpg'))
+        self.assertEqual((post.image_width, post.image_height), (50, 100))
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.format, 'JPEG')
+            self.assertEqual(image.size, (50, 100))
+            self.assertTrue(image.info.get('progressive'))
+            self.assertNotIn('exif', image.info)
+
+    def test_transparent_image_gets_white_background(self):
+        """Прозрачные области после перекодирования в JPEG белые."""
+        post = self.submit(self.upload(
+            Image.new('RGBA', (10, 10), (0, 0, 0, 0)), 'logo.png',
+            format='PNG',
+        ))
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.mode, 'RGB')
+            self.assertGreater(min(image.getpixel((5, 5))), 250)
+
+    def test_cleared_image_forgets_size(self):
+        """Удаление картинки стирает её размеры."""
+        post = self.submit(self.upload(
+            Image.new('RGB', (20, 10)), 'small.png', format='PNG',
+        ))
+        form = PostForm(
+            data={'text': post.text, 'image-clear': 'on'}, instance=post
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        post = form.save()
+        self.assertFalse(post.image)
+        self.assertIsNone(post.image_width)
+
+
 class CommentCreateFormTests(PostTestCase):
 
     def test_create_comment(self):
@@ -1,6 +1,22 @@
+import json
+import os
+import re
+import tempfile
+from io import BytesIO, StringIO
+
 from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+from sorl.thumbnail import default
 
-from .base_testcase import PostTestCase
+from .base_testcase import TEMP_MEDIA_ROOT, PostTestCase, Post, Group, User
+from ..models import Comment, FeedEntry, Follow, UserStats
+from .. import images, thumbnails, trending
 
 
 class GroupModelTest(PostTestCase):
@@ -46,3 +62,248 @@ class PostModelTest(PostTestCase):
                 self.assertEqual(
                     self.post._meta.get_field(field).help_text, expected_value
                 )
+
+
+class CountersTest(PostTestCase):
+    def test_counters_follow_writes(self):
+        """Счётчики меняются вместе с постами, комментариями и подписками."""
+        post = Post.objects.create(text='Ещё пост', author=self.user)
+        Comment.objects.create(post=post, author=self.follower, text='Ок')
+        Follow.objects.create(user=self.follower, author=self.user)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(
+            UserStats.objects.get(user=self.user).posts_count, 2
+        )
+        self.assertEqual(
+            UserStats.objects.get(user=self.user).followers_count, 1
+        )
+        self.assertEqual(
+            UserStats.objects.get(user=self.follower).following_count, 1
+        )
+        post.delete()
+        Follow.objects.all().delete()
+        stats = UserStats.objects.get(user=self.user)
+        self.assertEqual(stats.posts_count, 1)
+        self.assertEqual(stats.followers_count, 0)
+
+    def test_post_count_moves_with_author(self):
+        """Пост со сменой автора переходит в счётчик нового автора."""
+        post = Post.objects.create(text='Ещё пост', author=self.user)
+        post.author = self.follower
+        post.save()
+        self.assertEqual(
+            UserStats.objects.get(user=self.user).posts_count, 1
+        )
+        self.assertEqual(
+            UserStats.objects.get(user=self.follower).posts_count, 1
+        )
+        post.delete()
+        self.assertEqual(
+            UserStats.objects.get(user=self.follower).posts_count, 0
+        )
+
+    def test_drifted_counter_does_not_block_delete(self):
+        """Разошедшийся счётчик не уходит ниже нуля и не мешает удалению."""
+        UserStats.objects.filter(user=self.user).update(posts_count=0)
+        Post.objects.filter(id=self.post.id).delete()
+        self.assertEqual(
+            UserStats.objects.get(user=self.user).posts_count, 0
+        )
+
+    def test_rebuild_counters_fixes_drift(self):
+        """Команда rebuild_counters исправляет разошедшиеся счётчики."""
+        UserStats.objects.filter(user=self.user).update(posts_count=100)
+        Post.objects.filter(id=self.post.id).update(comments_count=7)
+        out = StringIO()
+        call_command('rebuild_counters', stdout=out)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 0)
+        self.assertEqual(
+            UserStats.objects.get(user=self.user).posts_count, 1
+        )
+        self.assertIn('2', out.getvalue())
+
+
+class JsonlTest(PostTestCase):
+    def test_export_import_roundtrip(self):
+        """Выгруженные данные загружаются обратно со связями и датами."""
+        Comment.objects.create(post=self.post, author=self.follower, text='Ок')
+        Follow.objects.create(user=self.follower, author=self.user)
+        path = os.path.join(TEMP_MEDIA_ROOT, 'dump.jsonl')
+        media_dir = tempfile.mkdtemp(dir=TEMP_MEDIA_ROOT)
+        call_command(
+            'export_jsonl', path, media_dir=media_dir, stderr=StringIO()
+        )
+        Group.objects.all().delete()
+        User.objects.filter(id=self.follower.id).delete()
+        Post.objects.all().delete()
+        out = StringIO()
+        call_command('import_jsonl', path, media_root=media_dir, stdout=out)
+        post = Post.objects.get()
+        self.assertEqual(post.text, self.post.text)
+        self.assertEqual(post.image.name, self.post.image.name)
+        self.assertEqual(post.pub_date, self.post.pub_date)
+        self.assertEqual(post.group.slug, self.group.slug)
+        self.assertEqual(post.comments_count, 1)
+        self.assertTrue(post.image.storage.exists(post.image.name))
+        follower = User.objects.get(username='follower')
+        self.assertEqual(
+            post.comments.get().author, follower
+        )
+        self.assertTrue(
+            FeedEntry.objects.filter(user=follower, post=post).exists()
+        )
+        self.assertIn('Загружено записей: 4', out.getvalue())
+
+    def test_import_into_filled_database(self):
+        """Повторная загрузка не задевает существующие посты."""
+        Comment.objects.create(post=self.post, author=self.follower, text='Ок')
+        path = os.path.join(TEMP_MEDIA_ROOT, 'dump.jsonl')
+        call_command('export_jsonl', path, stderr=StringIO())
+        call_command('import_jsonl', path, stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 2)
+        self.assertEqual(Group.objects.count(), 1)
+        for post in Post.objects.all():
+            self.assertEqual(post.comments.count(), 1)
+
+    def test_unknown_model_rejected(self):
+        """Файл с неизвестной моделью не загружается."""
+        path = os.path.join(TEMP_MEDIA_ROOT, 'bad.jsonl')
+        with open(path, 'w') as stream:
+            stream.write('{"model": "auth.user"}\n')
+        with self.assertRaises(CommandError):
+            call_command('import_jsonl', path, stdout=StringIO())
+
+    def test_failed_import_recounts_only_loaded_records(self):
+        """После ошибки загруженное досчитано, чужие счётчики не тронуты."""
+        UserStats.objects.filter(user=self.user).update(posts_count=5)
+        path = os.path.join(TEMP_MEDIA_ROOT, 'partial.jsonl')
+        records = (
+            {'model': 'posts.post', 'id': 1, 'author': 'newbie',
+             'group': None, 'text': 'Новый', 'image': '', 'pub_date': None},
+            {'model': 'posts.follow', 'user': 'follower', 'author': 'newbie'},
+            {'model': 'auth.user'},
+        )
+        with open(path, 'w') as stream:
+            stream.writelines(json.dumps(record) + '\n' for record in records)
+        with self.assertRaises(CommandError):
+            call_command('import_jsonl', path, stdout=StringIO())
+        newbie = User.objects.get(username='newbie')
+        self.assertEqual(newbie.stats.posts_count, 1)
+        self.assertEqual(newbie.stats.followers_count, 1)
+        self.assertTrue(FeedEntry.objects.filter(
+            user=self.follower, post__author=newbie
+        ).exists())
+        self.assertEqual(
+            UserStats.objects.get(user=self.user).posts_count, 5
+        )
+
+
+class ImageStorageTest(PostTestCase):
+    def create_post(self, content, name='copy.gif'):
+        return Post.objects.create(
+            text='Репост',
+            author=self.follower,
+            image=SimpleUploadedFile(name, content),
+        )
+
+    def unique_image(self):
+        buffer = BytesIO()
+        Image.new('RGB', (4, 4), (Post.objects.count(), 1, 2)).save(
+            buffer, 'PNG'
+        )
+        return buffer.getvalue()
+
+    def test_duplicates_share_file_and_thumbnails(self):
+        """Повторная загрузка ссылается на тот же файл и его миниатюры."""
+        self.uploaded.seek(0)
+        copy = self.create_post(self.uploaded.read())
+        self.assertEqual(copy.image.name, self.post.image.name)
+        thumbnails.generate_all(self.post.image.name)
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': copy.id})
+        )
+        self.assertNotContains(response, copy.image.url)
+        self.assertContains(response, '/media/cache/')
+
+    def test_hashed_name_saved_unchanged(self):
+        """Имя, уже адресованное содержимым, сохраняется как есть."""
+        name = self.post.image.name
+        with self.post.image.storage.open(name) as stream:
+            saved = self.post.image.storage.save(name, stream)
+        self.assertEqual(saved, name)
+
+    @override_settings(POST_IMAGE_RELEASE_GRACE=0)
+    def test_file_released_with_last_reference(self):
+        """Файл и миниатюры удаляются вместе с последним постом."""
+        content = self.unique_image()
+        first = self.create_post(content, 'first.png')
+        second = self.create_post(content, 'second.png')
+        name = first.image.name
+        storage = first.image.storage
+        thumbnails.generate_all(name)
+        *_, (_, width, height, options) = images.variants()
+        thumbnail = default.backend.get_thumbnail(
+            images.source(name), images.geometry(width, height), **options
+        )
+        self.assertTrue(thumbnail.exists())
+        first.delete()
+        images.release(name)
+        self.assertTrue(storage.exists(name))
+        second.delete()
+        images.release(name)
+        self.assertFalse(storage.exists(name))
+        self.assertFalse(thumbnail.exists())
+
+    def test_fresh_file_kept(self):
+        """Только что записанный файл не удаляется без ссылок."""
+        post = self.create_post(self.unique_image(), 'fresh.png')
+        name = post.image.name
+        post.delete()
+        images.release(name)
+        self.assertTrue(post.image.storage.exists(name))
+
+
+class QueryPlanTest(PostTestCase):
+    FULL_SCAN = re.compile(r'SCAN (TABLE )?posts_\w+$')
+
+    def test_views_use_indexes(self):
+        """Запросы страниц к таблицам posts идут по индексам."""
+        Follow.objects.create(user=self.follower, author=self.user)
+        Comment.objects.create(post=self.post, author=self.user, text='Ок')
+        trending.rebuild()
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id}),
+            reverse('posts:follow_index'),
+            reverse('posts:search') + '?q=Тестовый',
+            reverse('posts:feed'),
+            reverse('posts:group_feed', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile_feed', kwargs={'username': self.user}),
+            reverse('posts:groups'),
+            reverse('posts:trending'),
+            reverse('posts:group_trending', kwargs={'slug': self.group.slug}),
+            reverse('api:index'),
+            reverse('api:group_list', kwargs={'slug': self.group.slug}),
+            reverse('api:profile', kwargs={'username': self.user}),
+            reverse('api:post_detail', kwargs={'post_id': self.post.id}),
+            reverse('api:follow_index'),
+            reverse('api:batch') + f'?ids={self.post.id}',
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as queries:
+                    self.authorized_follower.get(url)
+                for query in queries:
+                    sql = query['sql']
+                    if not sql.startswith('SELECT') or 'posts_' not in sql:
+                        continue
+                    with connection.cursor() as cursor:
+                        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                        plan = [row[-1] for row in cursor.fetchall()]
+                    for step in plan:
+                        self.assertNotRegex(step, self.FULL_SCAN, sql)
+                        self.assertNotIn('TEMP B-TREE', step, sql)
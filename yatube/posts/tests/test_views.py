@@ -1,10 +1,29 @@
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
 from django.conf import settings
 from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
-from .base_testcase import PostTestCase, Post, Group, User, TestCase
+from .base_testcase import (
+    PostTestCase, Post, Group, User, TestCase, QueryBudgetMixin
+)
 from ..forms import PostForm
-from ..models import Follow
+from ..models import Comment, FeedEntry, Follow, TrendingPost
+from ..templatetags.post_cards import card_key, post_cards
+from .. import (
+    benchmarks, counters, follows, images, pageviews, search, snapshots,
+    thumbnails, trending,
+)
 
 
 class PostPagesTests(PostTestCase):
@@ -39,7 +58,7 @@ class PostPagesTests(PostTestCase):
         self.assertEqual(first_object.text, 'Тестовый пост')
         self.assertEqual(first_object.author, self.user)
         self.assertEqual(first_object.group, self.group)
-        self.assertEqual(first_object.image, 'posts/small.gif')
+        self.assertEqual(first_object.image, self.post.image.name)
 
     def test_group_list_pages_show_correct_context(self):
         """Шаблон group_list сформирован с правильным контекстом."""
@@ -65,7 +84,9 @@ class PostPagesTests(PostTestCase):
         self.assertEqual(response.context.get('post').text, 'Тестовый пост')
         self.assertEqual(response.context.get('post').author, self.user)
         self.assertEqual(response.context.get('post').group, self.group)
-        self.assertEqual(response.context.get('post').image, 'posts/small.gif')
+        self.assertEqual(
+            response.context.get('post').image, self.post.image.name
+        )
 
     def test_post_edit_pages_show_correct_context(self):
         """Шаблон create_post(edit) сформирован с правильным контекстом."""
@@ -103,6 +124,9 @@ class PaginatorViewsTest(TestCase):
         Post.objects.bulk_create(cls.posts)
         cls.posts = Post.objects.all()
 
+    def setUp(self):
+        cache.clear()
+
     def test_page_contains_records(self):
         pages = (
             reverse('posts:index'),
@@ -115,7 +139,10 @@ class PaginatorViewsTest(TestCase):
         for reverse_name in pages:
             with self.subTest(reverse_name=reverse_name):
                 response1 = self.client.get(reverse_name)
-                response2 = self.client.get((reverse_name + '?page=2'))
+                next_cursor = response1.context['page_obj'].next_cursor
+                response2 = self.client.get(
+                    reverse_name, {'cursor': next_cursor}
+                )
                 self.assertEqual(
                     len(response1.context['page_obj']), settings.POSTS_COUNT
                 )
@@ -124,6 +151,41 @@ class PaginatorViewsTest(TestCase):
                     settings.POSTS_COUNT // 3,
                 )
 
+    def test_cursor_navigation(self):
+        """Курсоры ведут на соседние страницы без повторов записей."""
+        url = reverse('posts:index')
+        first_page = self.client.get(url).context['page_obj']
+        self.assertFalse(first_page.has_previous())
+        second_page = self.client.get(
+            url, {'cursor': first_page.next_cursor}
+        ).context['page_obj']
+        self.assertFalse(second_page.has_next())
+        self.assertFalse(
+            set(first_page.object_list) & set(second_page.object_list)
+        )
+        back_page = self.client.get(
+            url, {'cursor': second_page.previous_cursor}
+        ).context['page_obj']
+        self.assertEqual(back_page.object_list, first_page.object_list)
+        self.assertFalse(back_page.has_previous())
+        last_page = self.client.get(
+            url, {'cursor': first_page.paginator.last_cursor}
+        ).context['page_obj']
+        self.assertFalse(last_page.has_next())
+        self.assertEqual(
+            last_page.object_list[-1],
+            Post.objects.order_by('pub_date', 'id').first(),
+        )
+
+    def test_invalid_cursor_returns_first_page(self):
+        """Некорректный курсор открывает первую страницу."""
+        response = self.client.get(
+            reverse('posts:index'), {'cursor': 'garbage'}
+        )
+        self.assertEqual(
+            len(response.context['page_obj']), settings.POSTS_COUNT
+        )
+
 
 class CreatedViewsTest(PostTestCase):
     @classmethod
@@ -181,17 +243,1022 @@ class CacheTests(PostTestCase):
             group=cls.group,
         )
 
+    def setUp(self):
+        super().setUp()
+        self.generate_thumbnails()
+
     def test_cache_index_page(self):
-        """Тест кэширования страницы index.html"""
-        response_1 = self.client.get(reverse('posts:index'))
-        post = Post.objects.first()
-        post.delete()
-        response_2 = self.client.get(reverse('posts:index'))
+        """Главная страница отдаётся из кэша, пока данные не изменятся."""
+        url = reverse('posts:index')
+        response_1 = self.client.get(url)
+        with self.assertNumQueries(0):
+            response_2 = self.client.get(url)
         self.assertEqual(response_1.content, response_2.content)
-        cache.clear()
-        response_3 = self.client.get(reverse('posts:index'))
+        Post.objects.first().delete()
+        # До фиксации удаления страница остаётся в кэше.
+        self.assertEqual(self.client.get(url).content, response_1.content)
+        self.run_commit_hooks()
+        response_3 = self.client.get(url)
         self.assertNotEqual(response_1.content, response_3.content)
 
+    def test_cache_invalidated_on_post_changes(self):
+        """Новый или перенесённый пост сразу виден на страницах."""
+        new_group = Group.objects.create(
+            title='Другая группа', slug='other-slug', description='-'
+        )
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:group_list', kwargs={'slug': new_group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user}),
+        )
+        before = [self.client.get(url).content for url in urls]
+        self.post.group = new_group
+        self.post.save()
+        self.run_commit_hooks()
+        for url, content in zip(urls, before):
+            with self.subTest(url=url):
+                self.assertNotEqual(self.client.get(url).content, content)
+
+    def test_shared_cache_kept_apart_and_survives_noop_migrate(self):
+        """Тесты не пишут в кэш сервера, а пустой migrate его не стирает."""
+        self.assertFalse(
+            settings.CACHES['default']['LOCATION'].startswith(
+                settings.BASE_DIR
+            )
+        )
+        cache.set('kept', 1)
+        call_command('migrate', verbosity=0)
+        self.assertEqual(cache.get('kept'), 1)
+
+    def test_cache_is_per_user(self):
+        """Гость не получает страницу, закэшированную для пользователя."""
+        url = reverse('posts:index')
+        self.authorized_client.get(url)
+        response = self.client.get(url)
+        self.assertNotContains(response, 'Пользователь: author')
+
+
+class PostCardCacheTests(PostTestCase):
+    def setUp(self):
+        super().setUp()
+        self.generate_thumbnails()
+
+    def test_cards_cached_after_render(self):
+        """Отрисованные карточки постов попадают в кэш."""
+        self.client.get(reverse('posts:index'))
+        self.assertIsNotNone(cache.get(card_key(self.post, True, True)))
+
+    def test_cached_card_reused(self):
+        """Закэшированная карточка не рендерится повторно."""
+        key = card_key(self.post, True, True)
+        post_cards([self.post])
+        version, _ = cache.get(key)
+        cache.set(key, (version, 'из кэша'))
+        self.assertEqual(post_cards([self.post]), ['из кэша'])
+
+    def test_card_refreshed_on_edit(self):
+        """После правки поста карточка показывает новый текст."""
+        url = reverse('posts:group_list', kwargs={'slug': self.group.slug})
+        self.client.get(url)
+        self.authorized_client.post(
+            reverse('posts:post_edit', kwargs={'post_id': self.post.id}),
+            data={'text': 'Исправленный пост', 'group': self.group.id},
+        )
+        self.run_commit_hooks()
+        self.assertContains(self.client.get(url), 'Исправленный пост')
+
+
+class ThumbnailTests(PostTestCase):
+    def test_template_falls_back_to_original_until_generated(self):
+        """Пока миниатюра не нарезана, страница показывает оригинал."""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        self.assertContains(self.client.get(url), self.post.image.url)
+        thumbnails.generate_all(self.post.image.name)
+        response = self.client.get(url)
+        self.assertNotContains(response, self.post.image.url)
+        self.assertContains(response, '/media/cache/')
+        for _, width, _, _ in images.variants():
+            self.assertContains(response, f' {width}w')
+
+    def test_generation_locked_per_image(self):
+        """Миниатюру, которую уже режут, второй раз не режут."""
+        _, width, height, options = images.variants()[-1]
+        name = self.post.image.name
+        cache.add(
+            thumbnails._task_key(
+                name, images.geometry(width, height), options
+            ),
+            True,
+        )
+        thumbnails.generate_all(name)
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        )
+        self.assertContains(response, self.post.image.url)
+
+    def test_deleted_image_skipped(self):
+        """Картинку, удалённую до нарезки, задание молча пропускает."""
+        with mock.patch.object(thumbnails, 'generate') as generate, \
+                mock.patch.object(thumbnails, 'logger') as logger:
+            thumbnails.enqueue('posts/deleted.gif')
+            thumbnails.wait()
+        generate.assert_not_called()
+        logger.exception.assert_not_called()
+
+    def test_fallback_page_not_cached(self):
+        """Страница с оригиналом вместо миниатюры не кэшируется."""
+        url = reverse('posts:index')
+        self.assertContains(self.client.get(url), self.post.image.url)
+        self.assertIsNone(cache.get(card_key(self.post, True, True)))
+        self.generate_thumbnails()
+        self.assertNotContains(self.client.get(url), self.post.image.url)
+
+
+@override_settings(COMMENTS_COUNT=3)
+class CommentPaginationTests(PostTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.comments = [
+            Comment.objects.create(
+                post=cls.post, author=cls.follower, text=f'Комментарий {i}'
+            )
+            for i in range(5)
+        ]
+
+    def test_post_detail_shows_first_comments(self):
+        """Страница поста показывает первую порцию старых комментариев."""
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        )
+        page = response.context['comments']
+        self.assertEqual(list(page), self.comments[:3])
+        self.assertTrue(page.has_next())
+        self.assertContains(
+            response,
+            reverse('posts:comments', kwargs={'post_id': self.post.id})
+            + f'?cursor={page.next_cursor}',
+        )
+
+    def test_fragment_returns_next_comments(self):
+        """Фрагмент отдаёт следующую порцию комментариев без страницы."""
+        url = reverse('posts:comments', kwargs={'post_id': self.post.id})
+        first = self.client.get(url).context['comments']
+        response = self.client.get(url, {'cursor': first.next_cursor})
+        self.assertEqual(list(response.context['comments']), self.comments[3:])
+        self.assertFalse(response.context['comments'].has_next())
+        self.assertNotContains(response, '<html')
+        self.assertContains(response, 'Комментарий 4')
+
+    def test_ajax_comment_returns_fragment(self):
+        """AJAX-комментарий возвращает только свой фрагмент."""
+        url = reverse('posts:add_comment', kwargs={'post_id': self.post.id})
+        response = self.authorized_client.post(
+            url, {'text': 'Быстрый ответ'},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertContains(response, 'Быстрый ответ', status_code=201)
+        self.assertNotContains(response, '<html', status_code=201)
+        response = self.authorized_client.post(
+            url, {'text': ''}, HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Comment.objects.count(), 6)
+
+
+class ConditionalGetTests(PostTestCase):
+    def setUp(self):
+        super().setUp()
+        self.post_url = reverse(
+            'posts:post_detail', kwargs={'post_id': self.post.id}
+        )
+        self.urls = (
+            self.post_url,
+            reverse('posts:profile', kwargs={'username': self.user}),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+        )
+
+    def test_unchanged_pages_return_not_modified(self):
+        """Свежая копия по ETag или Last-Modified даёт 304 без тела."""
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.authorized_client.get(url)
+                self.assertTrue(response.has_header('Last-Modified'))
+                by_etag = self.authorized_client.get(
+                    url, HTTP_IF_NONE_MATCH=response['ETag']
+                )
+                by_date = self.authorized_client.get(
+                    url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+                )
+                self.assertEqual(by_etag.status_code, 304)
+                self.assertEqual(by_date.status_code, 304)
+                self.assertEqual(by_etag.content, b'')
+
+    def test_etag_changes_with_data_and_user(self):
+        """ETag меняется после правки, комментария и у другого читателя."""
+        etag = self.authorized_client.get(self.post_url)['ETag']
+        self.assertNotEqual(
+            self.authorized_follower.get(self.post_url)['ETag'], etag
+        )
+        self.assertNotEqual(
+            self.authorized_client.get(self.post_url + '?page=2')['ETag'],
+            etag,
+        )
+        comment = Comment.objects.create(
+            post=self.post, author=self.follower, text='Новый'
+        )
+        response = self.authorized_client.get(
+            self.post_url, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        comment.delete()
+        self.assertNotEqual(
+            self.authorized_client.get(self.post_url)['ETag'], etag
+        )
+
+    def test_edit_changes_profile_and_group_etags(self):
+        """Правка поста выдаёт новые копии профиля и группы."""
+        etags = [self.authorized_client.get(url)['ETag'] for url in self.urls]
+        self.post.text = 'Исправленный текст'
+        self.post.save()
+        for url, etag in zip(self.urls, etags):
+            with self.subTest(url=url):
+                response = self.authorized_client.get(
+                    url, HTTP_IF_NONE_MATCH=etag
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, 'Исправленный текст')
+
+    def test_missing_objects_still_404(self):
+        """Для несуществующих страниц 304 не выдаётся."""
+        urls = (
+            reverse('posts:post_detail', kwargs={'post_id': 10 ** 6}),
+            reverse('posts:profile', kwargs={'username': 'nobody'}),
+            reverse('posts:group_list', kwargs={'slug': 'nothing'}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH='*')
+                self.assertEqual(response.status_code, 404)
+
+
+class FeedTests(PostTestCase):
+    def read_feed(self, url):
+        return self.client.get(url).getvalue().decode()
+
+    def test_feeds_list_recent_posts(self):
+        """Ленты сайта, группы и автора содержат их последние посты."""
+        other = Post.objects.create(text='Чужой пост', author=self.follower)
+        for name, kwargs, posts in (
+            ('posts:feed', {}, (self.post, other)),
+            ('posts:group_feed', {'slug': self.group.slug}, (self.post,)),
+            ('posts:profile_feed', {'username': 'follower'}, (other,)),
+        ):
+            with self.subTest(name=name):
+                response = self.client.get(reverse(name, kwargs=kwargs))
+                self.assertEqual(
+                    response['Content-Type'],
+                    'application/atom+xml; charset=utf-8',
+                )
+                content = response.getvalue().decode()
+                self.assertEqual(content.count('<entry>'), len(posts))
+                for post in posts:
+                    self.assertIn(post.text, content)
+
+    @override_settings(SYNDICATION_ITEMS_COUNT=1)
+    def test_feed_is_limited(self):
+        newer = Post.objects.create(text='Новый пост', author=self.user)
+        content = self.read_feed(reverse('posts:feed'))
+        self.assertEqual(content.count('<entry>'), 1)
+        self.assertIn(newer.text, content)
+
+    def test_unknown_owner_is_404(self):
+        for url in (
+            reverse('posts:group_feed', kwargs={'slug': 'nothing'}),
+            reverse('posts:profile_feed', kwargs={'username': 'nobody'}),
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_feed_is_streamed_then_cached(self):
+        """Лента отдаётся потоком, а повторный запрос берёт её из кэша."""
+        url = reverse('posts:group_feed', kwargs={'slug': self.group.slug})
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        content = response.getvalue()
+        cached = self.client.get(url)
+        self.assertFalse(cached.streaming)
+        self.assertEqual(cached.content, content)
+        Post.objects.create(
+            text='Свежий пост', author=self.user, group=self.group
+        )
+        self.run_commit_hooks()
+        self.assertIn('Свежий пост', self.read_feed(url))
+
+    def test_unchanged_feed_returns_not_modified(self):
+        url = reverse('posts:feed')
+        response = self.client.get(url)
+        for headers in (
+            {'HTTP_IF_NONE_MATCH': response['ETag']},
+            {'HTTP_IF_MODIFIED_SINCE': response['Last-Modified']},
+        ):
+            with self.subTest(headers=headers):
+                self.assertEqual(
+                    self.client.get(url, **headers).status_code, 304
+                )
+        Post.objects.create(text='Новый пост', author=self.user)
+        response = self.client.get(
+            url, HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class ApiTests(PostTestCase):
+    def get_json(self, client, name, status=200, data=None, **kwargs):
+        response = client.get(reverse(f'api:{name}', kwargs=kwargs), data)
+        self.assertEqual(response.status_code, status)
+        return response.json()
+
+    def test_posts_are_compact_payloads(self):
+        """Пост в API — автор, группа, картинка и число комментариев."""
+        Comment.objects.create(post=self.post, author=self.user, text='Ок')
+        post, = self.get_json(self.client, 'index')['results']
+        self.assertEqual(post['id'], self.post.id)
+        self.assertEqual(post['text'], self.post.text)
+        self.assertEqual(post['author']['username'], self.user.username)
+        self.assertEqual(post['group'], {
+            'slug': self.group.slug, 'title': self.group.title
+        })
+        self.assertEqual(post['comments_count'], 1)
+        self.assertEqual(post['image']['url'], self.post.image.url)
+        self.assertIsNone(post['image']['thumbnail'])
+        self.generate_thumbnails()
+        post, = self.get_json(self.client, 'index')['results']
+        self.assertIn('/media/cache/', post['image']['thumbnail'])
+
+    def test_cached_feeds_have_live_counters(self):
+        """Счётчики в кэшированных лентах свежие, как и без кэша."""
+        Follow.objects.create(user=self.follower, author=self.user)
+        self.get_json(self.client, 'index')
+        Comment.objects.create(post=self.post, author=self.user, text='Ок')
+        self.run_commit_hooks()
+        for post in (
+            self.get_json(self.client, 'index')['results'][0],
+            self.get_json(
+                self.client, 'profile', username=self.user.username
+            )['results'][0],
+            self.get_json(self.client, 'post_detail', post_id=self.post.id),
+            self.get_json(
+                self.client, 'batch', data={'ids': self.post.id}
+            )['results'][0],
+            self.get_json(
+                self.authorized_follower, 'follow_index'
+            )['results'][0],
+        ):
+            self.assertEqual(post['comments_count'], 1)
+            self.assertIn('views_count', post)
+
+    @override_settings(POSTS_COUNT=1)
+    def test_cursor_pagination(self):
+        """Ленты API листаются курсором."""
+        newer = Post.objects.create(
+            text='Новый', author=self.user, group=self.group
+        )
+        for name, kwargs in (
+            ('index', {}),
+            ('group_list', {'slug': self.group.slug}),
+            ('profile', {'username': self.user.username}),
+        ):
+            with self.subTest(name=name):
+                first = self.get_json(self.client, name, **kwargs)
+                self.assertEqual(first['results'][0]['id'], newer.id)
+                self.assertIsNone(first['previous'])
+                second = self.get_json(
+                    self.client, name, data={'cursor': first['next']},
+                    **kwargs
+                )
+                self.assertEqual(second['results'][0]['id'], self.post.id)
+                self.assertIsNone(second['next'])
+
+    def test_missing_owner_is_404(self):
+        """Пустая лента несуществующей группы или автора — 404 в JSON."""
+        empty = Group.objects.create(title='Пусто', slug='empty')
+        self.assertEqual(
+            self.get_json(self.client, 'group_list', slug=empty.slug),
+            {'results': [], 'next': None, 'previous': None},
+        )
+        for name, kwargs in (
+            ('group_list', {'slug': 'nothing'}),
+            ('profile', {'username': 'nobody'}),
+            ('post_detail', {'post_id': 10 ** 6}),
+            ('comments', {'post_id': 10 ** 6}),
+        ):
+            with self.subTest(name=name):
+                self.assertIn(
+                    'detail', self.get_json(self.client, name, 404, **kwargs)
+                )
+
+    def test_follow_feed(self):
+        """Лента подписок требует входа и отдаёт посты авторов."""
+        self.get_json(self.client, 'follow_index', 401)
+        Follow.objects.create(user=self.follower, author=self.user)
+        feed = self.get_json(self.authorized_follower, 'follow_index')
+        self.assertEqual(
+            [post['id'] for post in feed['results']], [self.post.id]
+        )
+
+    @override_settings(COMMENTS_COUNT=1)
+    def test_post_detail_with_comments(self):
+        """Пост отдаётся с первой страницей комментариев."""
+        first, second = (
+            Comment.objects.create(
+                post=self.post, author=self.follower, text=f'Ответ {i}'
+            )
+            for i in range(2)
+        )
+        post = self.get_json(
+            self.client, 'post_detail', post_id=self.post.id
+        )
+        self.assertEqual(post['id'], self.post.id)
+        comment, = post['comments']['results']
+        self.assertEqual(comment['id'], first.id)
+        self.assertEqual(comment['author']['username'], 'follower')
+        page = self.get_json(
+            self.client, 'comments', post_id=self.post.id,
+            data={'cursor': post['comments']['next']},
+        )
+        self.assertEqual(page['results'][0]['id'], second.id)
+
+    def test_batch(self):
+        """batch отдаёт посты в порядке запроса и список ненайденных."""
+        other = Post.objects.create(text='Другой', author=self.follower)
+        ids = f'{other.id},{10 ** 6},{self.post.id},{other.id}'
+        data = self.get_json(self.client, 'batch', data={'ids': ids})
+        self.assertEqual(
+            [post['id'] for post in data['results']],
+            [other.id, self.post.id],
+        )
+        self.assertIsNone(data['results'][0]['group'])
+        self.assertEqual(data['missing'], [10 ** 6])
+        self.get_json(self.client, 'batch', 400, data={'ids': 'a,b'})
+        with self.settings(API_BATCH_SIZE=1):
+            self.get_json(self.client, 'batch', 400, data={'ids': ids})
+
+    def test_read_only(self):
+        response = self.authorized_client.post(reverse('api:index'))
+        self.assertEqual(response.status_code, 405)
+
+
+class SnapshotTests(PostTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.root = os.path.join(directory, 'snapshot')
+        override = self.settings(SNAPSHOT_ROOT=self.root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.post_url = reverse(
+            'posts:post_detail', kwargs={'post_id': self.post.id}
+        )
+
+    def read_snapshot(self, url):
+        with open(snapshots.file_path(url), 'rb') as stream:
+            return stream.read()
+
+    def test_export_renders_public_pages(self):
+        """Команда сохраняет страницы такими, какими их видит аноним."""
+        self.generate_thumbnails()
+        out = StringIO()
+        call_command('export_snapshot', stdout=out)
+        self.assertIn('Сохранено страниц: 7 из 7', out.getvalue())
+        self.assertTrue(snapshots.enabled())
+        for url in (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user}),
+            reverse('posts:profile', kwargs={'username': self.follower}),
+            reverse('about:author'),
+            reverse('about:tech'),
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(
+                    self.read_snapshot(url), self.client.get(url).content
+                )
+        # Просмотр клиентом меняет счётчик на странице поста.
+        self.assertIn(
+            self.post.text.encode(), self.read_snapshot(self.post_url)
+        )
+
+    def test_page_without_thumbnails_is_left_to_django(self):
+        self.assertIsNone(snapshots.render(self.post_url))
+        self.assertFalse(os.path.exists(snapshots.file_path(self.post_url)))
+        self.generate_thumbnails()
+        self.assertTrue(snapshots.render(self.post_url))
+
+    def test_removed_page_is_deleted(self):
+        """Страница удалённого поста пропадает из копии."""
+        self.generate_thumbnails()
+        snapshots.export()
+        Post.objects.filter(id=self.post.id).delete()
+        self.assertFalse(snapshots.render(self.post_url))
+        self.assertFalse(os.path.exists(snapshots.file_path(self.post_url)))
+        self.assertTrue(os.path.exists(snapshots.file_path('/')))
+
+    def test_changed_pages(self):
+        """Изменение поста или комментария затрагивает его страницы."""
+        Post.objects.create(text='Второй пост', author=self.user)
+        post_pages = {
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user}),
+            self.post_url,
+        }
+        self.assertEqual(set(snapshots.post_pages(self.post)), post_pages)
+        self.assertEqual(
+            set(snapshots.comment_pages(self.post.id)), {self.post_url}
+        )
+        self.assertNotIn(
+            'Всего постов автора', self.read_rendered(self.post_url)
+        )
+
+    def read_rendered(self, url):
+        self.generate_thumbnails()
+        self.assertTrue(snapshots.render(url))
+        return self.read_snapshot(url).decode()
+
+    def test_renamed_group_and_user_pages(self):
+        """Переименование группы и автора перерисовывает их страницы."""
+        Comment.objects.create(
+            post=self.post, author=self.follower, text='Ок'
+        )
+        self.generate_thumbnails()
+        snapshots.export()
+        old_group_url = reverse(
+            'posts:group_list', kwargs={'slug': self.group.slug}
+        )
+        old_profile_url = reverse(
+            'posts:profile', kwargs={'username': self.follower}
+        )
+        group = Group.objects.get(id=self.group.id)
+        group.title, group.slug = 'Новое название', 'new-slug'
+        group.save()
+        follower = User.objects.get(id=self.follower.id)
+        follower.username = 'reader'
+        follower.save()
+        # Страницы рисуются сразу, без фонового потока.
+        with mock.patch.object(snapshots, '_submit', snapshots.render_all):
+            self.run_commit_hooks()
+        self.assertFalse(os.path.exists(snapshots.file_path(old_group_url)))
+        self.assertFalse(
+            os.path.exists(snapshots.file_path(old_profile_url))
+        )
+        post_page = self.read_snapshot(self.post_url).decode()
+        self.assertIn('Новое название', post_page)
+        self.assertIn('reader', post_page)
+        self.assertIn('Новое название', self.read_snapshot(
+            reverse('posts:group_list', kwargs={'slug': 'new-slug'})
+        ).decode())
+
+    def test_render_without_allowed_hosts(self):
+        """Копия рисуется при пустом ALLOWED_HOSTS и с SNAPSHOT_HOST."""
+        self.generate_thumbnails()
+        with self.settings(DEBUG=True, ALLOWED_HOSTS=[]):
+            self.assertTrue(snapshots.render(self.post_url))
+        with self.settings(
+                SNAPSHOT_HOST='example.com',
+                ALLOWED_HOSTS=['.internal', 'example.com']):
+            self.assertTrue(snapshots.render(self.post_url))
+
+    def test_unsafe_paths_are_skipped(self):
+        self.assertIsNone(snapshots.file_path('/profile/../'))
+        self.assertIsNone(snapshots.file_path('/profile/%2E%2E/'))
+        self.assertEqual(
+            snapshots.file_path('/'), os.path.join(self.root, 'index.html')
+        )
+
+
+class PageviewTests(PostTestCase):
+    def setUp(self):
+        super().setUp()
+        # Просмотры из других тестов пишутся сейчас, а не посреди теста.
+        pageviews.flush()
+        self.url = reverse(
+            'posts:post_detail', kwargs={'post_id': self.post.id}
+        )
+        self.initial = self.views_in_db()
+
+    def view(self, client_id, url=None, **headers):
+        """Просмотр страницы поста с отдельного IP-адреса."""
+        return self.client.get(
+            url or self.url, REMOTE_ADDR=f'10.0.0.{client_id}', **headers
+        )
+
+    def views_in_db(self):
+        return Post.objects.values_list('views_count', flat=True).get(
+            id=self.post.id
+        )
+
+    def test_views_are_buffered_then_flushed(self):
+        """Просмотры копятся в памяти и пишутся в базу пачкой."""
+        for client_id in range(3):
+            response = self.view(client_id)
+        self.assertEqual(response.context['views_count'], self.initial + 3)
+        self.assertEqual(self.views_in_db(), self.initial)
+        api = self.client.get(
+            reverse('api:post_detail', kwargs={'post_id': self.post.id})
+        )
+        self.assertEqual(api.json()['views_count'], self.initial + 3)
+        self.assertEqual(pageviews.flush(), 1)
+        self.assertEqual(self.views_in_db(), self.initial + 3)
+        self.assertEqual(pageviews.pending(self.post.id), 0)
+        post = Post.objects.get(id=self.post.id)
+        self.assertEqual(pageviews.count(post), self.initial + 3)
+
+    @override_settings(PAGEVIEWS_MAX_PENDING=3)
+    def test_full_queue_is_flushed(self):
+        """Очередь ограничена числом просмотров, а не постов."""
+        other = Post.objects.create(text='Второй', author=self.user)
+        self.view(1)
+        self.view(2)
+        self.assertEqual(self.views_in_db(), self.initial)
+        self.view(
+            1, reverse('posts:post_detail', kwargs={'post_id': other.id})
+        )
+        self.assertEqual(self.views_in_db(), self.initial + 2)
+        self.assertEqual(Post.objects.get(id=other.id).views_count, 1)
+
+    def test_not_modified_is_a_view(self):
+        etag = self.view(1)['ETag']
+        response = self.view(2, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(pageviews.pending(self.post.id), 2)
+
+    def test_repeat_views_counted_once(self):
+        """Повторные просмотры клиента в окне не считаются."""
+        self.view(1)
+        self.view(1)
+        self.authorized_client.get(self.url)
+        self.authorized_client.get(self.url, REMOTE_ADDR='10.0.0.9')
+        self.assertEqual(pageviews.pending(self.post.id), 2)
+
+    def test_comment_pages_are_not_views(self):
+        """Листание комментариев курсором — не просмотр поста."""
+        cursor = self.view(1).context['comments'].paginator.last_cursor
+        self.view(2, f'{self.url}?cursor={cursor}')
+        self.assertEqual(pageviews.pending(self.post.id), 1)
+
+    def test_etag_follows_views(self):
+        """Копия браузера устаревает, когда счётчик заметно вырос."""
+        etag = self.view(0)['ETag']
+        for client_id in range(1, settings.PAGEVIEWS_ETAG_STEP + 1):
+            self.view(client_id)
+        response = self.view(0, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_views_flushed_in_background_and_at_exit(self):
+        self.client.get(self.url)
+        self.assertTrue(pageviews._flusher.is_alive())
+        self.assertTrue(pageviews._flusher.daemon)
+        with mock.patch.object(pageviews, 'flush') as flush:
+            pageviews._flush_at_exit()
+            flush.assert_not_called()
+            with self.settings(PAGEVIEWS_FLUSH_AT_EXIT=True):
+                pageviews._flush_at_exit()
+            flush.assert_called_once_with()
+
+    def test_failed_flush_keeps_views(self):
+        """Неудачная запись возвращает просмотры в очередь."""
+        self.client.get(self.url)
+        with mock.patch.object(
+            pageviews, '_write', side_effect=DatabaseError
+        ), self.assertLogs('posts.pageviews', 'ERROR'):
+            self.assertEqual(pageviews.flush(), 0)
+        self.assertEqual(pageviews.pending(self.post.id), 1)
+        pageviews.flush()
+        self.assertEqual(self.views_in_db(), self.initial + 1)
+
+    def test_snapshot_views_are_sent_by_page(self):
+        """Отрисовка копии — не просмотр, а копия сама присылает их."""
+        self.generate_thumbnails()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        with self.settings(SNAPSHOT_ROOT=root):
+            self.assertTrue(snapshots.render(self.url))
+            with open(snapshots.file_path(self.url), encoding='utf-8') as f:
+                page = f.read()
+        self.assertEqual(pageviews.pending(self.post.id), 0)
+        beacon = reverse('posts:post_view', kwargs={'post_id': self.post.id})
+        self.assertIn(f"sendBeacon('{beacon}')", page)
+        self.assertNotIn(
+            'sendBeacon', self.client.get(self.url).content.decode()
+        )
+        self.assertEqual(self.client.get(beacon).status_code, 405)
+        self.assertEqual(
+            self.client.post(beacon, REMOTE_ADDR='10.0.0.1').status_code, 204
+        )
+        self.assertEqual(pageviews.pending(self.post.id), 2)
+
+    @override_settings(THROTTLE_RATES={'post_view': {'ip': (1, 60)}})
+    def test_view_beacon_checked_and_throttled(self):
+        """post_view не принимает чужие посты и частые запросы."""
+        missing = reverse('posts:post_view', kwargs={'post_id': 10 ** 6})
+        self.assertEqual(self.client.post(missing).status_code, 404)
+        beacon = reverse('posts:post_view', kwargs={'post_id': self.post.id})
+        self.assertEqual(self.client.post(beacon).status_code, 429)
+        self.assertEqual(pageviews.pending(10 ** 6), 0)
+
+
+class GroupIndexTests(PostTestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('posts:groups')
+        self.empty = Group.objects.create(
+            title='Пустая группа', slug='empty', description='-'
+        )
+
+    def get_groups(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertTemplateUsed(response, 'posts/groups.html')
+        return {
+            group.slug: (group.posts_count or 0, group.last_pub_date)
+            for group in response.context['page_obj']
+        }
+
+    def test_groups_show_counts_and_last_post(self):
+        later = Post.objects.create(
+            text='Свежий', author=self.user, group=self.group
+        )
+        self.assertEqual(self.get_groups(), {
+            self.group.slug: (2, later.pub_date),
+            self.empty.slug: (0, None),
+        })
+
+    @override_settings(POSTS_COUNT=1)
+    def test_groups_are_paginated_by_title(self):
+        response = self.client.get(self.url)
+        self.assertEqual(
+            [group.slug for group in response.context['page_obj']],
+            [self.empty.slug],
+        )
+        self.assertEqual(self.get_groups(
+            cursor=response.context['page_obj'].next_cursor
+        ), {self.group.slug: (1, self.post.pub_date)})
+
+    def test_cache_follows_posts(self):
+        """Кэш каталога сбрасывают создание, перенос и удаление постов."""
+        self.get_groups()
+        post = Post.objects.create(
+            text='Новый', author=self.user, group=self.empty
+        )
+        self.run_commit_hooks()
+        self.assertEqual(self.get_groups()[self.empty.slug][0], 1)
+        post.group = self.group
+        post.save()
+        self.run_commit_hooks()
+        self.assertEqual(self.get_groups(), {
+            self.group.slug: (2, post.pub_date),
+            self.empty.slug: (0, None),
+        })
+        Post.objects.filter(id=post.id).delete()
+        self.run_commit_hooks()
+        self.assertEqual(self.get_groups()[self.group.slug][0], 1)
+
+
+class TrendingTests(PostTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+        self.hot = Post.objects.create(text='Обсуждаемый', author=self.user)
+        self.old = Post.objects.create(
+            text='Вчерашний', author=self.user, group=self.group
+        )
+        self.stale = Post.objects.create(text='Давний', author=self.user)
+        for post in (self.hot, self.hot, self.old, self.old, self.stale):
+            Comment.objects.create(post=post, author=self.follower, text='Ок')
+        Post.objects.filter(id=self.old.id).update(
+            pub_date=self.now - timedelta(days=2)
+        )
+        Post.objects.filter(id=self.stale.id).update(
+            pub_date=self.now - timedelta(days=8)
+        )
+
+    def page_posts(self, response):
+        return [post.id for post in response.context['page_obj']]
+
+    def test_rebuild_ranks_recent_posts(self):
+        """Рейтинг — комментарии с убыванием по возрасту, только за окно."""
+        self.assertEqual(trending.rebuild(self.now), 3)
+        scores = dict(TrendingPost.objects.values_list('post_id', 'score'))
+        self.assertEqual(set(scores), {self.post.id, self.hot.id, self.old.id})
+        self.assertAlmostEqual(scores[self.hot.id], 11, places=3)
+        self.assertAlmostEqual(scores[self.old.id], 11 / 4, places=3)
+        self.assertAlmostEqual(scores[self.post.id], 1, places=3)
+        self.assertEqual(trending.rebuild(self.now), 3)
+        self.assertEqual(TrendingPost.objects.count(), 3)
+
+    def test_pages_read_ranking(self):
+        trending.rebuild(self.now)
+        response = self.client.get(reverse('posts:trending'))
+        self.assertTemplateUsed(response, 'posts/trending.html')
+        self.assertEqual(
+            self.page_posts(response), [self.hot.id, self.old.id, self.post.id]
+        )
+        response = self.client.get(
+            reverse('posts:group_trending', kwargs={'slug': self.group.slug})
+        )
+        self.assertEqual(response.context['group'], self.group)
+        self.assertEqual(
+            self.page_posts(response), [self.old.id, self.post.id]
+        )
+        response = self.client.get(
+            reverse('posts:group_trending', kwargs={'slug': 'missing'})
+        )
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(POSTS_COUNT=1)
+    def test_cursor_pagination(self):
+        trending.rebuild(self.now)
+        url = reverse('posts:trending')
+        seen = []
+        response = self.client.get(url)
+        while True:
+            seen.extend(self.page_posts(response))
+            page_obj = response.context['page_obj']
+            if not page_obj.has_next():
+                break
+            response = self.client.get(url, {'cursor': page_obj.next_cursor})
+        self.assertEqual(seen, [self.hot.id, self.old.id, self.post.id])
+
+    def test_rebuild_refreshes_cached_pages(self):
+        url = reverse('posts:trending')
+        self.assertEqual(self.page_posts(self.client.get(url)), [])
+        trending.rebuild(self.now)
+        self.run_commit_hooks()
+        self.assertEqual(len(self.page_posts(self.client.get(url))), 3)
+
+    def test_post_follows_group_change(self):
+        trending.rebuild(self.now)
+        self.old.group = None
+        self.old.save()
+        self.assertIsNone(TrendingPost.objects.get(post=self.old).group_id)
+        Post.objects.filter(id=self.hot.id).delete()
+        self.assertFalse(TrendingPost.objects.filter(post_id=self.hot.id))
+
+    def test_rebuild_trending_command(self):
+        out = StringIO()
+        call_command('rebuild_trending', stdout=out)
+        self.assertIn('Постов в рейтинге: 3', out.getvalue())
+
+
+class SearchTests(PostTestCase):
+    def search(self, query, **params):
+        return self.client.get(
+            reverse('posts:search'), {'q': query, **params}
+        )
+
+    def test_search_finds_ranked_posts_with_snippets(self):
+        """Поиск находит посты, самые релевантные выше, и подсвечивает
+        найденные слова.
+        """
+        Post.objects.create(text='Кот и <b>собака</b>', author=self.user)
+        best = Post.objects.create(text='Кот кот кот', author=self.user)
+        response = self.search('кот')
+        posts = list(response.context['page_obj'])
+        self.assertEqual(len(posts), 2)
+        self.assertEqual(posts[0], best)
+        self.assertContains(response, '<mark>Кот</mark>')
+        self.assertContains(response, '&lt;b&gt;собака&lt;/b&gt;')
+        self.assertNotContains(response, self.post.text)
+
+    def test_index_follows_writes(self):
+        """Изменённые и удалённые посты сразу попадают в индекс."""
+        Post.objects.filter(id=self.post.id).update(text='Новый текст')
+        self.assertEqual(len(self.search('новый').context['page_obj']), 1)
+        self.assertEqual(len(self.search('тестовый').context['page_obj']), 0)
+        self.post.delete()
+        self.assertEqual(len(self.search('новый').context['page_obj']), 0)
+
+    def test_search_is_paginated(self):
+        """Результаты поиска листаются по курсору, без подсчёта всех."""
+        for i in range(settings.POSTS_COUNT):
+            Post.objects.create(text=f'Тестовый пост {i}', author=self.user)
+        first = self.search('тест').context['page_obj']
+        self.assertEqual(len(first), settings.POSTS_COUNT)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.search('тест', cursor=first.next_cursor)
+        self.assertFalse(
+            [q for q in queries if 'count(' in q['sql'].lower()]
+        )
+        second = response.context['page_obj']
+        self.assertEqual(len(second), 1)
+        self.assertFalse(second.has_next())
+        self.assertNotIn(second[0], list(first))
+        previous = self.search('тест', cursor=second.previous_cursor)
+        self.assertEqual(
+            list(previous.context['page_obj']), list(first)
+        )
+        last = self.search('тест', cursor=first.paginator.last_cursor)
+        self.assertEqual(list(last.context['page_obj'])[-1], second[0])
+
+    def test_only_last_word_is_prefix(self):
+        """По префиксу ищется только последнее, дописываемое слово."""
+        for query, found in (
+                ('тестовый по', 0), ('тест пост', 0), ('пост тест', 1)):
+            with self.subTest(query=query):
+                page = self.search(query).context['page_obj']
+                self.assertEqual(len(page), found)
+
+    def test_query_syntax_is_ignored(self):
+        """Операторы FTS5 в запросе не ломают поиск."""
+        for query in ('"', 'OR (', 'text:*', ''):
+            with self.subTest(query=query):
+                self.assertEqual(self.search(query).status_code, 200)
+
+    def test_admin_search_uses_index(self):
+        """Поиск в админке находит посты по слову."""
+        Post.objects.create(text='Совсем другой', author=self.user)
+        self.assertQuerysetEqual(
+            search.filter_posts(Post.objects.all(), 'тестов'),
+            [repr(self.post)],
+        )
+
+    def test_rebuild_search_index(self):
+        """Команда rebuild_search_index восстанавливает индекс."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {search.FTS_TABLE}({search.FTS_TABLE}) "
+                f"VALUES ('delete-all')"
+            )
+        self.assertEqual(len(self.search('тестовый').context['page_obj']), 0)
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(len(self.search('тестовый').context['page_obj']), 1)
+
+
+class BenchmarkTests(PostTestCase):
+    def test_seed_keeps_derived_data_consistent(self):
+        """Сидер создаёт данные и досчитывает счётчики и ленты."""
+        prefix = benchmarks.seed(
+            users=5, groups=2, posts=20, comments=10, follows=2, seed=1
+        )
+        users = User.objects.filter(username__startswith=prefix)
+        self.assertEqual(users.count(), 5)
+        self.assertEqual(
+            Post.objects.filter(author__in=users).count(), 20
+        )
+        self.assertEqual(
+            Follow.objects.filter(user__in=users).count(), 10
+        )
+        self.assertEqual(counters.rebuild(), 0)
+        for follow in Follow.objects.filter(user__in=users):
+            self.assertEqual(
+                FeedEntry.objects.filter(
+                    user=follow.user, post__author=follow.author
+                ).count(),
+                follow.author.posts.count(),
+            )
+
+    def test_run_covers_read_routes(self):
+        """Замер проходит по всем маршрутам чтения и не меняет данные."""
+        self.assertEqual(
+            set(benchmarks.READ_ROUTES) | set(benchmarks.WRITE_ROUTES),
+            {pattern.name for pattern in benchmarks.urlpatterns},
+        )
+        Follow.objects.create(user=self.user, author=self.follower)
+        follows = list(Follow.objects.values_list('user', 'author'))
+        results = benchmarks.run(self.user, iterations=2)
+        self.assertEqual(set(results), set(benchmarks.READ_ROUTES))
+        self.assertEqual(
+            list(Follow.objects.values_list('user', 'author')), follows
+        )
+        for name, result in results.items():
+            with self.subTest(route=name):
+                self.assertIn(result['status'], benchmarks.OK_STATUSES)
+                self.assertLessEqual(result['p50'], result['p99'])
+        self.assertIn(
+            '?q=', benchmarks.route_urls(self.user)['search']
+        )
+
+    def test_error_status_fails_run(self):
+        """Ответ с неожиданным кодом прерывает замер, а не попадает в него."""
+        with mock.patch.object(
+            benchmarks, 'OK_STATUSES', (302,)
+        ), self.assertRaisesMessage(CommandError, 'код ответа 200'):
+            call_command('benchmark', iterations=1, stdout=StringIO())
+
+    def test_compare_reports_regressions(self):
+        """Рост p95 сверх допуска и рост числа запросов — регрессии."""
+        baseline = {'index': {'p95': 10, 'queries': 2}}
+        self.assertEqual(benchmarks.compare(
+            {'index': {'p95': 11, 'queries': 2}}, baseline, 0.2, 2
+        ), [])
+        self.assertEqual(len(benchmarks.compare(
+            {'index': {'p95': 20, 'queries': 3}}, baseline, 0.2, 2
+        )), 2)
+
 
 class FollowTests(PostTestCase):
     @classmethod
@@ -230,3 +1297,218 @@ class FollowTests(PostTestCase):
         response = self.authorized_follower.get(reverse('posts:follow_index'))
         first_object = response.context['page_obj'][0]
         self.assertEqual(first_object, self.post)
+
+    def test_new_post_fanned_out_to_followers(self):
+        """Новый пост автора раскладывается в ленты подписчиков."""
+        Follow.objects.create(user=self.follower, author=self.user)
+        post = Post.objects.create(text='Свежий пост', author=self.user)
+        self.assertTrue(
+            FeedEntry.objects.filter(user=self.follower, post=post).exists()
+        )
+
+    @override_settings(POSTS_COUNT=2)
+    def test_follow_backfills_one_page(self):
+        """При подписке в ленту попадает только страница свежих постов."""
+        Post.objects.bulk_create(
+            Post(text=f'Пост {i}', author=self.user) for i in range(3)
+        )
+        newest = list(
+            Post.objects.filter(author=self.user)
+            .order_by('-pub_date', '-id').values_list('id', flat=True)[:2]
+        )
+        Follow.objects.create(user=self.follower, author=self.user)
+        self.assertCountEqual(
+            FeedEntry.objects.filter(user=self.follower).values_list(
+                'post_id', flat=True
+            ),
+            newest,
+        )
+
+    def test_unfollow_prunes_feed(self):
+        """После отписки посты автора пропадают из ленты."""
+        Follow.objects.create(user=self.follower, author=self.user)
+        Follow.objects.filter(user=self.follower, author=self.user).delete()
+        response = self.authorized_follower.get(reverse('posts:follow_index'))
+        self.assertEqual(len(response.context['page_obj']), 0)
+        self.assertFalse(FeedEntry.objects.filter(user=self.follower))
+
+    def test_follow_checks_read_cached_graph(self):
+        """Проверка подписки после первой загрузки обходится без SQL."""
+        self.assertFalse(follows.is_following(self.follower, self.user))
+        with self.assertNumQueries(0):
+            self.assertFalse(follows.is_following(self.follower, self.user))
+        Follow.objects.create(user=self.follower, author=self.user)
+        self.run_commit_hooks()
+        self.assertTrue(follows.is_following(self.follower, self.user))
+        with self.assertNumQueries(0):
+            self.assertTrue(follows.is_following(self.follower, self.user))
+        response = self.authorized_follower.get(
+            reverse('posts:profile', kwargs={'username': self.user})
+        )
+        self.assertTrue(response.context['following'])
+        Follow.objects.filter(user=self.follower, author=self.user).delete()
+        self.run_commit_hooks()
+        self.assertFalse(follows.is_following(self.follower, self.user))
+
+    def test_rolled_back_follow_keeps_graph(self):
+        """Откаченная подписка не попадает в массив подписок."""
+        follows.followee_ids(self.follower.id)
+        with self.assertRaises(DatabaseError), transaction.atomic():
+            Follow.objects.create(user=self.follower, author=self.user)
+            raise DatabaseError
+        self.run_commit_hooks()
+        self.assertFalse(follows.is_following(self.follower, self.user))
+
+    def test_unfollow_ignores_stale_graph(self):
+        """Отписка удаляет подписку, даже если массив её не видит."""
+        follows.followee_ids(self.follower.id)
+        # Без фиксации массив в кэше не знает о подписке.
+        Follow.objects.create(user=self.follower, author=self.user)
+        self.assertFalse(follows.is_following(self.follower, self.user))
+        self.authorized_follower.get(
+            reverse('posts:profile_unfollow', kwargs={'username': self.user})
+        )
+        self.assertFalse(Follow.objects.filter(user=self.follower).exists())
+
+    def test_follow_graph_is_compact_and_sorted(self):
+        authors = [
+            User.objects.create(username=f'writer{i}') for i in range(3)
+        ]
+        for author in reversed(authors):
+            Follow.objects.create(user=self.follower, author=author)
+        self.run_commit_hooks()
+        author_ids = follows.followee_ids(self.follower.id)
+        Follow.objects.create(user=self.follower, author=self.user)
+        self.run_commit_hooks()
+        self.assertEqual(
+            list(follows.followee_ids(self.follower.id)),
+            sorted([self.user.id] + [author.id for author in authors]),
+        )
+        self.assertEqual(author_ids.itemsize, 8)
+
+    def test_follow_is_idempotent_with_stale_graph(self):
+        """Устаревший граф не ломает повторную подписку."""
+        follows.followee_ids(self.follower.id)
+        Follow.objects.bulk_create([
+            Follow(user=self.follower, author=self.user)
+        ])
+        response = self.authorized_follower.get(
+            reverse('posts:profile_follow', kwargs={'username': self.user})
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Follow.objects.count(), 1)
+
+    @override_settings(FEED_FANOUT_LIMIT=0)
+    def test_popular_author_posts_pulled_on_read(self):
+        """Посты популярного автора попадают в ленту при её открытии."""
+        Follow.objects.create(user=self.follower, author=self.user)
+        post = Post.objects.create(text='Пост для всех', author=self.user)
+        self.assertFalse(FeedEntry.objects.filter(post=post).exists())
+        response = self.authorized_follower.get(reverse('posts:follow_index'))
+        self.assertEqual(response.context['page_obj'][0], post)
+
+
+class QueryBudgetTests(QueryBudgetMixin, PostTestCase):
+    """Число запросов страницы не зависит от количества постов на ней."""
+    BUDGETS = {
+        'posts:index': 3,
+        'posts:group_list': 5,
+        'posts:profile': 6,
+        'posts:post_detail': 6,
+        'posts:follow_index': 4,
+        'posts:search': 5,
+        'posts:comments': 3,
+        'posts:feed': 4,
+        'posts:group_feed': 5,
+        'posts:profile_feed': 5,
+        'posts:groups': 3,
+        'posts:trending': 4,
+        'posts:group_trending': 5,
+        'api:index': 4,
+        'api:group_list': 4,
+        'api:profile': 4,
+        'api:post_detail': 4,
+        'api:comments': 3,
+        'api:follow_index': 4,
+        'api:batch': 3,
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        Follow.objects.create(user=cls.follower, author=cls.user)
+        for i in range(settings.POSTS_COUNT * 2):
+            author = User.objects.create_user(username=f'writer{i}')
+            Follow.objects.create(user=cls.follower, author=author)
+            Post.objects.create(
+                text=f'Пост {i}',
+                author=author,
+                group=Group.objects.create(
+                    title=f'Группа {i}', slug=f'group-{i}', description='-'
+                ),
+            )
+            Post.objects.create(
+                text=f'Пост автора {i}', author=cls.user, group=cls.group
+            )
+            Comment.objects.create(post=cls.post, author=author, text='Ок')
+        trending.rebuild()
+
+    def get_urls(self):
+        return {
+            'posts:index': reverse('posts:index'),
+            'posts:group_list': reverse(
+                'posts:group_list', kwargs={'slug': self.group.slug}
+            ),
+            'posts:profile': reverse(
+                'posts:profile', kwargs={'username': self.user}
+            ),
+            'posts:post_detail': reverse(
+                'posts:post_detail', kwargs={'post_id': self.post.id}
+            ),
+            'posts:follow_index': reverse('posts:follow_index'),
+            'posts:search': reverse('posts:search') + '?q=Пост',
+            'posts:comments': reverse(
+                'posts:comments', kwargs={'post_id': self.post.id}
+            ),
+            'posts:feed': reverse('posts:feed'),
+            'posts:group_feed': reverse(
+                'posts:group_feed', kwargs={'slug': self.group.slug}
+            ),
+            'posts:profile_feed': reverse(
+                'posts:profile_feed', kwargs={'username': self.user}
+            ),
+            'posts:groups': reverse('posts:groups'),
+            'posts:trending': reverse('posts:trending'),
+            'posts:group_trending': reverse(
+                'posts:group_trending', kwargs={'slug': self.group.slug}
+            ),
+            'api:index': reverse('api:index'),
+            'api:group_list': reverse(
+                'api:group_list', kwargs={'slug': self.group.slug}
+            ),
+            'api:profile': reverse(
+                'api:profile', kwargs={'username': self.user}
+            ),
+            'api:post_detail': reverse(
+                'api:post_detail', kwargs={'post_id': self.post.id}
+            ),
+            'api:comments': reverse(
+                'api:comments', kwargs={'post_id': self.post.id}
+            ),
+            'api:follow_index': reverse('api:follow_index'),
+            'api:batch': reverse('api:batch') + '?ids={}'.format(
+                ','.join(map(str, Post.objects.values_list('id', flat=True)))
+            ),
+        }
+
+    def test_views_fit_query_budget(self):
+        # Первое открытие поста нарезает миниатюру картинки.
+        self.client.get(self.get_urls()['posts:post_detail'])
+        for page_size in (1, settings.POSTS_COUNT):
+            for name, url in self.get_urls().items():
+                with self.subTest(view=name, page_size=page_size):
+                    with self.settings(POSTS_COUNT=page_size):
+                        cache.clear()
+                        self.assertQueryBudget(
+                            self.authorized_follower, url, self.BUDGETS[name]
+                        )
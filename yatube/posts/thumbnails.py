@@ -0,0 +1,215 @@
+"""Нарезка миниатюр картинок постов в фоне.
+
+post_create и post_edit ставят картинку в очередь, и задание нарезает
+все её варианты из images.variants() по порядку. Очередь обслуживает
+ограниченный пул из THUMBNAIL_WORKERS потоков (при нуле потоков
+картинка режется сразу), а каждая картинка нарезается ровно один раз:
+повторные задания отбрасываются, пока первое не закончится, а между
+процессами каждый вариант защищён блокировкой в кэше.
+
+Шаблоны читают миниатюры через PrecomputedThumbnailBackend: он только
+ищет готовую миниатюру в хранилище sorl, а если её нет, отдаёт исходную
+картинку и ставит нарезку в очередь. Такая разметка не кэшируется.
+get_url вычисляет адрес миниатюры без обращения к хранилищу, а
+card_url отдаёт адрес для API, проверив только файл на диске.
+"""
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.images import ImageFile
+
+from . import images
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_pending = {}
+_pending_lock = threading.Lock()
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    with _pending_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails',
+            )
+    return _executor
+
+
+def _task_key(name, geometry, options):
+    task = '{}:{}:{}'.format(name, geometry, sorted(options.items()))
+    return 'thumbnail:' + hashlib.md5(task.encode()).hexdigest()
+
+
+def generate(name, geometry, options):
+    """Нарезает миниатюру, если её не режет кто-то другой."""
+    key = _task_key(name, geometry, options)
+    if not cache.add(key, True, settings.THUMBNAIL_LOCK_TIMEOUT):
+        return
+    try:
+        _local.generating = True
+        default.backend.get_thumbnail(
+            images.source(name), geometry, **options
+        )
+    finally:
+        _local.generating = False
+        cache.delete(key)
+
+
+def generate_all(name):
+    """Нарезает все варианты картинки, последним — признак готовности.
+
+    Картинку, удалённую раньше, чем до неё дошла очередь (вместе с
+    постом или с каталогом MEDIA_ROOT после теста), задание пропускает.
+    """
+    source = images.source(name)
+    for _, width, height, options in images.variants():
+        if not source.exists():
+            return
+        generate(name, images.geometry(width, height), options)
+
+
+def _generate_logged(name):
+    try:
+        generate_all(name)
+    except Exception:
+        logger.exception('Не удалось нарезать миниатюры %s', name)
+
+
+def _run(name):
+    try:
+        _generate_logged(name)
+    finally:
+        connections.close_all()
+        with _pending_lock:
+            _pending.pop(name, None)
+
+
+def fallbacks_rendered():
+    """Сколько раз в этом потоке вместо миниатюры отдан оригинал.
+
+    Кэши страниц и карточек сравнивают значение до и после отрисовки и
+    не сохраняют разметку с оригиналом, чтобы после нарезки сразу
+    показать миниатюру.
+    """
+    return getattr(_local, 'fallbacks', 0)
+
+
+def note_fallback(name):
+    """Отмечает, что вместо миниатюры отдан оригинал, и ставит нарезку."""
+    _local.fallbacks = fallbacks_rendered() + 1
+    transaction.on_commit(lambda: enqueue(name))
+
+
+def card_url(name):
+    """Адрес миниатюры JPEG в кадре карточки или None, пока её нет.
+
+    Готовность проверяется по файлу последнего варианта, без запросов к
+    базе, поэтому так можно проверить целую страницу постов.
+    """
+    source = images.source(name)
+    *_, (_, width, height, options) = images.variants()
+    if not default.storage.exists(default.backend.get_name(
+            source, images.geometry(width, height), **options)):
+        note_fallback(name)
+        return None
+    return default.backend.get_url(
+        source,
+        images.geometry(*settings.POST_IMAGE_FRAME),
+        **images.THUMBNAIL_OPTIONS,
+        format=images.JPEG,
+    )
+
+
+def enqueue(name):
+    if not settings.THUMBNAIL_WORKERS:
+        # Без пула картинка нарезается сразу, в текущем потоке.
+        _generate_logged(name)
+        return
+    executor = _get_executor()
+    with _pending_lock:
+        if name in _pending:
+            return
+        _pending[name] = executor.submit(_run, name)
+
+
+def wait(timeout=None):
+    """Дожидается завершения поставленных в очередь нарезок."""
+    with _pending_lock:
+        futures = list(_pending.values())
+    wait_futures(futures, timeout)
+
+
+def shutdown():
+    """Дожидается нарезок и останавливает пул.
+
+    Следующее задание запустит новый пул.
+    """
+    global _executor
+    with _pending_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def enqueue_all(image):
+    """Ставит в очередь все варианты картинки.
+
+    Нарезка начнётся после фиксации транзакции, когда файл и пост
+    уже сохранены.
+    """
+    if image:
+        name = image.name
+        transaction.on_commit(lambda: enqueue(name))
+
+
+class PrecomputedThumbnailBackend(ThumbnailBackend):
+    """Бэкенд sorl, который в запросе только читает готовые миниатюры."""
+
+    def _prepare_options(self, source, options):
+        if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(sorl_settings, attr)
+            if value != getattr(sorl_defaults, attr):
+                options.setdefault(key, value)
+        return options
+
+    def get_thumbnail(self, file_, geometry_string, **options):
+        if getattr(_local, 'generating', False):
+            return super().get_thumbnail(file_, geometry_string, **options)
+        if not file_:
+            raise ValueError('falsey file_ argument in get_thumbnail()')
+        source = ImageFile(file_)
+        prepared = self._prepare_options(source, dict(options))
+        name = self._get_thumbnail_filename(source, geometry_string, prepared)
+        cached = default.kvstore.get(ImageFile(name, default.storage))
+        if cached:
+            return cached
+        note_fallback(source.name)
+        return source
+
+    def get_name(self, file_, geometry_string, **options):
+        source = ImageFile(file_)
+        return self._get_thumbnail_filename(
+            source, geometry_string, self._prepare_options(source, options)
+        )
+
+    def get_url(self, file_, geometry_string, **options):
+        return default.storage.url(
+            self.get_name(file_, geometry_string, **options)
+        )
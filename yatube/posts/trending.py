@@ -0,0 +1,98 @@
+"""Рейтинг популярных постов.
+
+Считать популярность по комментариям и свежести при каждом запросе
+значит проходить по таблицам постов и комментариев. Вместо этого
+rebuild_trending периодически (например, из cron раз в несколько минут)
+пересчитывает рейтинг постов за последние TRENDING_WINDOW секунд и
+целиком заменяет им таблицу TrendingPost. Страницы популярного читают
+её по индексу (score) или (group, score) с курсорной пагинацией.
+
+Рейтинг поста — его комментарии и просмотры с весами из
+TRENDING_WEIGHTS, который вдвое убывает каждые TRENDING_HALF_LIFE
+секунд после публикации.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import (
+    DateTimeField, ExpressionWrapper, F, FloatField, Value
+)
+from django.db.models.functions import Power
+from django.utils import timezone
+
+from . import caching
+from .models import Post, TrendingPost
+
+TRENDING_ORDERING = ('-score', '-post_id')
+STAGING_TABLE = 'posts_trendingpost_staging'
+
+
+def _score(now):
+    """Выражение рейтинга поста, которое считает сама база."""
+    weights = settings.TRENDING_WEIGHTS
+    # Разность дат SQLite отдаёт целыми микросекундами.
+    age = ExpressionWrapper(
+        Value(now, DateTimeField()) - F('pub_date'),
+        output_field=FloatField(),
+    )
+    return ExpressionWrapper(
+        (1 + weights['comments'] * F('comments_count')
+         + weights['views'] * F('views_count'))
+        * Power(0.5, age / float(settings.TRENDING_HALF_LIFE * 10 ** 6)),
+        output_field=FloatField(),
+    )
+
+
+def rebuild(now=None):
+    """Пересчитывает рейтинг и возвращает число постов в нём.
+
+    Рейтинги постов окна считаются в базе одним INSERT ... SELECT во
+    временную таблицу соединения, без выборки строк в Python и без
+    блокировки записи в основную базу. Затем короткая транзакция
+    копирует готовую таблицу в TrendingPost, поэтому читатели видят
+    либо старый рейтинг, либо новый.
+    """
+    now = now or timezone.now()
+    select, params = Post.objects.filter(
+        pub_date__gte=now - timedelta(seconds=settings.TRENDING_WINDOW)
+    ).order_by().annotate(score=_score(now)).values_list(
+        'id', 'group_id', 'score'
+    ).query.sql_with_params()
+    table = connection.ops.quote_name(TrendingPost._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TEMP TABLE {STAGING_TABLE} '
+            '(post_id integer PRIMARY KEY, group_id integer, score real)'
+        )
+        try:
+            cursor.execute(
+                f'INSERT INTO {STAGING_TABLE} (post_id, group_id, score) '
+                f'{select}',
+                params,
+            )
+            count = cursor.rowcount
+            with transaction.atomic():
+                cursor.execute(f'DELETE FROM {table}')
+                cursor.execute(
+                    f'INSERT INTO {table} (post_id, group_id, score) '
+                    f'SELECT post_id, group_id, score FROM {STAGING_TABLE}'
+                )
+        finally:
+            cursor.execute(f'DROP TABLE {STAGING_TABLE}')
+    caching.bump_on_commit(caching.TRENDING)
+    return count
+
+
+def move(post):
+    """Переносит пост в рейтинг его новой группы до пересчёта."""
+    TrendingPost.objects.filter(post_id=post.id).update(
+        group_id=post.group_id
+    )
+
+
+def ranked(**filters):
+    """Посты рейтинга вместе с авторами и группами."""
+    return TrendingPost.objects.filter(**filters).select_related(
+        'post__author', 'post__group'
+    )
@@ -1,8 +1,153 @@
+import base64
+import json
+
 from django.conf import settings
-from django.core.paginator import Paginator
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+
+CURSOR_NEXT = 'next'
+CURSOR_PREVIOUS = 'prev'
+CURSOR_LAST = 'last'
+
+
+class CursorPaginator(Paginator):
+    """Пагинатор по ключу сортировки вместо OFFSET/LIMIT.
+
+    Страница выбирается условием на значения ключа последней
+    показанной записи, поэтому любая страница стоит как первая,
+    а общее количество записей не считается.
+    """
+    cursor_query_param = 'cursor'
+
+    def __init__(self, object_list, per_page, ordering=('-pub_date', '-id')):
+        self.ordering = tuple(ordering)
+        super().__init__(object_list.order_by(*self.ordering), per_page)
+        self.fields = tuple(name.lstrip('-') for name in self.ordering)
+        self._num_pages = 1
+
+    @property
+    def num_pages(self):
+        """Число страниц, известных относительно последней выданной.
+
+        Общее количество записей не считается: текущая страница получает
+        номер 2, если перед ней есть записи, и за ней числится ещё одна,
+        если есть записи после. Этого достаточно для has_next(),
+        has_previous() и has_other_pages() у Page.
+        """
+        return self._num_pages
+
+    @staticmethod
+    def _pack(payload):
+        raw = json.dumps(payload, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def encode_cursor(self, direction, obj):
+        values = []
+        for field in self.fields:
+            # Строки values() приходят словарями.
+            value = obj[field] if isinstance(obj, dict) else getattr(
+                obj, field
+            )
+            if hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            values.append(value)
+        return self._pack([direction, values])
+
+    def decode_cursor(self, cursor):
+        """Возвращает (направление, значения ключа) или None."""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            direction, values = json.loads(raw)
+            if direction == CURSOR_LAST:
+                return direction, None
+            if (direction not in (CURSOR_NEXT, CURSOR_PREVIOUS)
+                    or len(values) != len(self.fields)):
+                return None
+            return direction, self.to_python(values)
+        except (ValueError, TypeError, ValidationError, FieldDoesNotExist):
+            return None
+
+    def to_python(self, values):
+        """Значения ключа из курсора в типах полей модели."""
+        opts = self.object_list.model._meta
+        return [
+            opts.get_field(field).to_python(value)
+            for field, value in zip(self.fields, values)
+        ]
+
+    @property
+    def last_cursor(self):
+        return self._pack([CURSOR_LAST, []])
+
+    def _reversed_ordering(self):
+        return tuple(
+            name[1:] if name.startswith('-') else f'-{name}'
+            for name in self.ordering
+        )
+
+    def _keyset_filter(self, values, forward):
+        condition = Q()
+        for i, name in enumerate(self.ordering):
+            lookup = 'lt' if name.startswith('-') == forward else 'gt'
+            term = Q(**{f'{self.fields[i]}__{lookup}': values[i]})
+            for field, value in zip(self.fields[:i], values[:i]):
+                term &= Q(**{field: value})
+            condition |= term
+        return condition
+
+    def fetch(self, values, forward):
+        """До per_page записей за ключом values в направлении forward.
+
+        Без values записи берутся с начала списка или, назад, с конца.
+        Возвращает записи и признак, что за ними есть ещё.
+        """
+        queryset = self.object_list
+        if values is not None:
+            queryset = queryset.filter(self._keyset_filter(values, forward))
+        ordering = self.ordering if forward else self._reversed_ordering()
+        rows = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        return rows[:self.per_page], len(rows) > self.per_page
+
+    def page(self, cursor=None):
+        decoded = self.decode_cursor(cursor) if cursor else None
+        if decoded is None:
+            rows, has_next = self.fetch(None, True)
+            return self._build_page(rows, has_next, False)
+        direction, values = decoded
+        if direction == CURSOR_NEXT:
+            rows, has_next = self.fetch(values, True)
+            return self._build_page(rows, has_next, True)
+        rows, has_previous = self.fetch(values, False)
+        rows.reverse()
+        return self._build_page(
+            rows, direction == CURSOR_PREVIOUS, has_previous
+        )
+
+    def get_page(self, cursor):
+        return self.page(cursor)
+
+    def _build_page(self, rows, has_next, has_previous):
+        has_next = has_next and bool(rows)
+        has_previous = has_previous and bool(rows)
+        number = 2 if has_previous else 1
+        self._num_pages = number + 1 if has_next else number
+        page = Page(rows, number, self)
+        page.next_cursor = page.previous_cursor = None
+        if has_next:
+            page.next_cursor = self.encode_cursor(CURSOR_NEXT, rows[-1])
+        if has_previous:
+            page.previous_cursor = self.encode_cursor(
+                CURSOR_PREVIOUS, rows[0]
+            )
+        return page
 
 
-def get_paginator(request, posts):
-    paginator = Paginator(posts, settings.POSTS_COUNT)
-    page_number = request.GET.get('page')
-    return paginator.get_page(page_number)
+def get_paginator(request, posts, ordering=('-pub_date', '-id'),
+                  per_page=None):
+    paginator = CursorPaginator(
+        posts, per_page or settings.POSTS_COUNT, ordering
+    )
+    return paginator.get_page(
+        request.GET.get(CursorPaginator.cursor_query_param)
+    )
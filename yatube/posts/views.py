@@ -1,24 +1,68 @@
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.http import Http404, HttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
-from django.views.decorators.cache import cache_page
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
+from core.throttling import throttle
+
+from . import follows, pageviews, thumbnails, trending
+from .search import SearchPaginator, SearchResults
+from .caching import (
+    author_scopes, author_state, cache_page_versions, conditional_page,
+    group_scopes, group_state, group_trending_scopes, groups_scopes,
+    index_scopes, post_state, trending_scopes
+)
+from .feed import FEED_ORDERING, get_feed
 from .forms import PostForm, CommentForm
-from .models import Post, Group, User, Follow
+from .models import Comment, Post, Group, User, Follow
 from .utils import get_paginator
 
+COMMENT_ORDERING = ('pub_date', 'id')
+GROUP_ORDERING = ('title', 'id')
+
 
-@cache_page(20, key_prefix='index_page')
+@cache_page_versions(index_scopes)
 def index(request):
-    posts = Post.objects.all()
+    posts = Post.objects.select_related('author', 'group')
     context = {
         'page_obj': get_paginator(request, posts),
     }
     return render(request, 'posts/index.html', context)
 
 
+@cache_page_versions(groups_scopes)
+def group_index(request):
+    """Каталог групп с числом постов и датой последнего.
+
+    Счётчик и дата берутся подзапросами по индексу (group, pub_date) в
+    том же запросе, что и страница групп.
+    """
+    posts = Post.objects.filter(group=OuterRef('pk')).order_by()
+    groups = Group.objects.annotate(
+        posts_count=Subquery(
+            posts.values('group').annotate(
+                count=Count('id')
+            ).values('count')
+        ),
+        last_pub_date=Subquery(
+            posts.order_by('-pub_date').values('pub_date')[:1]
+        ),
+    )
+    context = {
+        'page_obj': get_paginator(request, groups, ordering=GROUP_ORDERING),
+    }
+    return render(request, 'posts/groups.html', context)
+
+
+@conditional_page(group_state)
+@cache_page_versions(group_scopes)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
+    posts = group.posts.select_related('author')
     context = {
         'group': group,
         'page_obj': get_paginator(request, posts),
@@ -26,41 +70,115 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@conditional_page(author_state)
+@cache_page_versions(author_scopes)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    posts = author.posts.all()
-    following = False
-    if request.user.is_authenticated and Follow.objects.filter(
-            user=request.user, author=author
-    ):
-        following = True
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
+    posts = author.posts.select_related('group')
     context = {
         'author': author,
         'page_obj': get_paginator(request, posts),
-        'following': following,
+        'following': follows.is_following(request.user, author),
     }
     return render(request, 'posts/profile.html', context)
 
 
+@cache_page_versions(trending_scopes)
+def trending_posts(request):
+    page_obj = get_paginator(
+        request, trending.ranked(), ordering=trending.TRENDING_ORDERING
+    )
+    page_obj.object_list = [entry.post for entry in page_obj]
+    context = {
+        'page_obj': page_obj,
+    }
+    return render(request, 'posts/trending.html', context)
+
+
+@cache_page_versions(group_trending_scopes)
+def group_trending(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    page_obj = get_paginator(
+        request,
+        trending.ranked(group=group),
+        ordering=trending.TRENDING_ORDERING,
+    )
+    page_obj.object_list = [entry.post for entry in page_obj]
+    context = {
+        'group': group,
+        'page_obj': page_obj,
+    }
+    return render(request, 'posts/group_trending.html', context)
+
+
+def get_comments_page(request, post_id):
+    return get_paginator(
+        request,
+        Comment.objects.filter(post_id=post_id).select_related('author'),
+        ordering=COMMENT_ORDERING,
+        per_page=settings.COMMENTS_COUNT,
+    )
+
+
+def search(request):
+    query = request.GET.get('q', '').strip()
+    paginator = SearchPaginator(SearchResults(query), settings.POSTS_COUNT)
+    context = {
+        'query': query,
+        'page_obj': paginator.get_page(
+            request.GET.get(SearchPaginator.cursor_query_param)
+        ),
+    }
+    return render(request, 'posts/search.html', context)
+
+
+@pageviews.counted
+@conditional_page(post_state)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    comments = post.comments.all()
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'), id=post_id
+    )
     form = CommentForm(request.POST or None)
     context = {
         'post': post,
         'form': form,
-        'comments': comments,
+        'comments': get_comments_page(request, post.id),
+        'views_count': pageviews.count(post),
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+@csrf_exempt
+@require_POST
+@throttle('post_view')
+def post_view(request, post_id):
+    """Просмотр поста из статической копии: его присылает скрипт копии."""
+    if not Post.objects.filter(id=post_id).exists():
+        raise Http404
+    pageviews.record(request, post_id)
+    return HttpResponse(status=204)
+
+
+def comments(request, post_id):
+    context = {
+        'post_id': post_id,
+        'comments': get_comments_page(request, post_id),
+    }
+    return render(request, 'posts/includes/comment_list.html', context)
+
+
 @login_required
+@throttle('post_create')
+@transaction.atomic
 def post_create(request):
     form = PostForm(request.POST or None, files=request.FILES or None)
     if form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
         post.save()
+        thumbnails.enqueue_all(post.image)
         return redirect('posts:profile', post.author)
     return render(
         request, 'posts/create_post.html', {'is_edit': False, 'form': form}
@@ -68,6 +186,7 @@ def post_create(request):
 
 
 @login_required
+@transaction.atomic
 def post_edit(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     if post.author != request.user:
@@ -76,7 +195,8 @@ def post_edit(request, post_id):
         request.POST or None, files=request.FILES or None, instance=post
     )
     if form.is_valid():
-        form.save()
+        post = form.save()
+        thumbnails.enqueue_all(post.image)
         return redirect('posts:post_detail', post_id)
     return render(
         request,
@@ -86,6 +206,8 @@ def post_edit(request, post_id):
 
 
 @login_required
+@throttle('add_comment')
+@transaction.atomic
 def add_comment(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     form = CommentForm(request.POST or None)
@@ -94,29 +216,44 @@ def add_comment(request, post_id):
         comment.author = request.user
         comment.post = post
         comment.save()
+        if request.is_ajax():
+            return render(
+                request,
+                'posts/includes/comment.html',
+                {'comment': comment},
+                status=201,
+            )
+    elif request.is_ajax():
+        return render(
+            request, 'includes/form_errors.html', {'form': form}, status=400
+        )
     return redirect('posts:post_detail', post_id=post_id)
 
 
 @login_required
 def follow_index(request):
-    posts = Post.objects.filter(author__following__user=request.user)
+    page_obj = get_paginator(
+        request, get_feed(request.user), ordering=FEED_ORDERING
+    )
+    page_obj.object_list = [entry.post for entry in page_obj]
     context = {
-        'page_obj': get_paginator(request, posts),
+        'page_obj': page_obj,
     }
     return render(request, 'posts/follow.html', context)
 
 
 @login_required
+@throttle('profile_follow', methods=('GET', 'POST'))
+@transaction.atomic
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
-    if request.user != author and not Follow.objects.filter(
-            user=request.user, author=author
-    ):
-        Follow.objects.create(user=request.user, author=author)
+    if request.user != author:
+        Follow.objects.get_or_create(user=request.user, author=author)
     return redirect('posts:profile', username=username)
 
 
 @login_required
+@transaction.atomic
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
     Follow.objects.filter(user=request.user, author=author).delete()
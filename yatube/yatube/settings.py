@@ -48,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -128,6 +129,43 @@ STATICFILES_DIRS = (os.path.join(BASE_DIR, 'static'),)
 
 EMPTY_VALUE_DISPLAY = '-пусто-'
 POSTS_COUNT = 10
+# Последнее слово поиска короче этого ищется целиком, а не по префиксу.
+SEARCH_PREFIX_MIN_LENGTH = 3
+COMMENTS_COUNT = 20
+
+# Сколько последних постов попадает в Atom-ленту.
+SYNDICATION_ITEMS_COUNT = 20
+
+# Просмотры постов пишутся в базу пачкой раз в PAGEVIEWS_FLUSH_INTERVAL
+# секунд, когда в очереди PAGEVIEWS_MAX_PENDING просмотров, и при выходе
+# процесса: при падении теряется не больше (см. posts.pageviews).
+PAGEVIEWS_FLUSH_INTERVAL = 10
+PAGEVIEWS_MAX_PENDING = 1000
+PAGEVIEWS_FLUSH_AT_EXIT = True
+# Клиент даёт посту не больше одного просмотра за это число секунд.
+PAGEVIEWS_DEDUPE_WINDOW = 60 * 30
+# ETag страницы поста меняется через каждые столько просмотров, так что
+# счётчик в копии браузера отстаёт меньше чем на это число.
+PAGEVIEWS_ETAG_STEP = 10
+
+# Рейтинг популярного пересчитывается командой rebuild_trending по
+# постам за TRENDING_WINDOW секунд; рейтинг поста вдвое убывает каждые
+# TRENDING_HALF_LIFE секунд (см. posts.trending).
+TRENDING_WINDOW = 60 * 60 * 24 * 7
+TRENDING_HALF_LIFE = 60 * 60 * 24
+TRENDING_WEIGHTS = {'comments': 5, 'views': 0.1}
+
+# Сколько постов API отдаёт одним запросом batch.
+API_BATCH_SIZE = 100
+
+# Авторы с большим числом подписчиков не раскладывают посты по лентам
+# при публикации: читатели подтягивают их сами при открытии ленты.
+FEED_FANOUT_LIMIT = 1000
+FEED_BATCH_SIZE = 500
+FEED_CELEBRITIES_TIMEOUT = 300
+
+# Сколько живёт в кэше массив подписок читателя (см. posts.follows).
+FOLLOW_GRAPH_TIMEOUT = 60 * 60 * 24
 MAX_LENGTH_STR = 15
 
 LOGIN_URL = 'users:login'
@@ -139,10 +177,69 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Миниатюры нарезаются в фоне при загрузке картинки, шаблоны только
+# читают готовые.
+THUMBNAIL_BACKEND = 'posts.thumbnails.PrecomputedThumbnailBackend'
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_LOCK_TIMEOUT = 60
+THUMBNAIL_QUALITY = 85
+
+# Загрузки больше мегабайта пишутся во временный файл, а не в память.
+FILE_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024
+
+# Оригинал картинки поста ужимается до POST_IMAGE_MAX_SIZE по большей
+# стороне, варианты для srcset режутся в кадре карточки POST_IMAGE_FRAME.
+POST_IMAGE_MAX_SIZE = 1920
+POST_IMAGE_QUALITY = 85
+POST_IMAGE_FRAME = (960, 339)
+POST_IMAGE_WIDTHS = (480, 960, 1440)
+POST_IMAGE_SIZES = '(min-width: 992px) 960px, 100vw'
+# Файл без ссылок не удаляется, пока он моложе этого срока: на него
+# может сослаться пост из ещё не зафиксированной транзакции.
+POST_IMAGE_RELEASE_GRACE = 5 * 60
+
+# Эталон команды benchmark и допустимый рост p95 относительно него.
+BENCHMARK_BASELINE = os.path.join(BASE_DIR, 'benchmark_baseline.json')
+BENCHMARK_TOLERANCE = 0.2
+BENCHMARK_SLACK_MS = 2
+
+# Пакеты жетонов для запросов записи (core.throttling): сколько запросов
+# можно сделать подряд и за сколько секунд восполняется один жетон,
+# отдельно для пользователя и для IP-адреса. За прокси REMOTE_ADDR должен
+# быть адресом клиента.
+THROTTLE_RATES = {
+    'post_create': {'user': (5, 60), 'ip': (20, 15)},
+    'add_comment': {'user': (10, 10), 'ip': (40, 3)},
+    'profile_follow': {'user': (30, 2), 'ip': (100, 1)},
+    'signup': {'ip': (3, 600)},
+    'post_view': {'ip': (30, 2)},
+}
+
+# Адреса, которым /metrics отдаёт метрики процесса.
+METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')
+
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
+# Страницы лент сбрасываются сигналами при изменении данных, таймаут
+# лишь ограничивает время жизни устаревших копий в кэше.
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Статическая копия публичных страниц для nginx (см. posts.snapshots).
+# Пока каталог существует, изменения перерисовывают затронутые страницы.
+SNAPSHOT_ROOT = os.path.join(BASE_DIR, 'snapshot')
+# Имя сайта в запросах отрисовки копии; None — первое из ALLOWED_HOSTS.
+SNAPSHOT_HOST = None
+SNAPSHOT_THUMBNAILS_TIMEOUT = 60
+
+# LRU в памяти процесса перед общим для всех процессов кэшем в SQLite.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.MetricsTwoTierCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'shared.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'LOCAL_MAX_BYTES': 16 * 1024 * 1024,
+            'GENERATION_SLOTS': 4096,
+        },
     }
 }
@@ -0,0 +1,35 @@
+"""Настройки тестов: свой кэш и каталоги вместо общих с сервером.
+
+Общий кэш на диске переживает тестовую базу, и тесты, сбрасывая его,
+стирали бы кэш запущенного сервера. Поэтому тесты держат кэш во
+временном каталоге, который удаляется при выходе, а копию страниц
+(см. posts.snapshots) не обновляют, пока тест не укажет свой каталог.
+
+Миниатюры тесты режут сразу, без пула: иначе поток пула мог бы писать
+в MEDIA_ROOT теста, пока тот его удаляет. Просмотры постов тесты пишут
+сами: фоновый поток писал бы из своего соединения мимо транзакции
+теста, а при выходе тестовой базы уже нет.
+"""
+import atexit
+import os
+import shutil
+import tempfile
+
+from .settings import *  # noqa: F401,F403
+from .settings import CACHES
+
+TEST_ROOT = tempfile.mkdtemp(prefix='yatube-tests-')
+atexit.register(shutil.rmtree, TEST_ROOT, ignore_errors=True)
+
+CACHES = {
+    alias: {
+        **options,
+        'LOCATION': os.path.join(TEST_ROOT, alias, 'shared.sqlite3'),
+    }
+    for alias, options in CACHES.items()
+}
+SNAPSHOT_ROOT = os.path.join(TEST_ROOT, 'snapshot')
+BENCHMARK_BASELINE = os.path.join(TEST_ROOT, 'benchmark_baseline.json')
+PAGEVIEWS_FLUSH_INTERVAL = 60 * 60
+PAGEVIEWS_FLUSH_AT_EXIT = False
+THUMBNAIL_WORKERS = 0